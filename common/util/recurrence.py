@@ -0,0 +1,282 @@
+"""
+Recurrence rules for chores, written as a subset of the iCalendar
+(RFC 5545) RRULE syntax, with the date counting starts from and the
+dates that are skipped on lines of their own, eg.
+
+    DTSTART:20240101
+    RRULE:FREQ=WEEKLY;BYDAY=MO,TH
+    EXDATE:20240101,20240104
+
+Supported rule parts are
+    FREQ: DAILY, WEEKLY, MONTHLY or YEARLY
+    INTERVAL: the number of days, weeks, months or years between the
+        periods the rule repeats in, counted from DTSTART
+    BYDAY: weekdays, which in monthly and yearly rules may be prefixed
+        with an ordinal, eg. 2TU for the second Tuesday of the month and
+        -1FR for its last Friday
+    BYMONTHDAY: days of the month, negative ones counting from its end
+    BYMONTH: months of the year
+    COUNT, UNTIL: where the rule ends
+
+Occurrences are generated lazily, one period at a time, so taking the
+first few of a rule that never ends costs no more than the periods
+they fall in
+"""
+import calendar
+import datetime
+from itertools import count
+
+
+WEEKDAYS = ['MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU']
+FREQUENCIES = ['DAILY', 'WEEKLY', 'MONTHLY', 'YEARLY']
+
+# Periods a rule may go without occurring before it is taken to never
+# occur again, as with February 30th
+MAX_EMPTY_PERIODS = 1000
+
+
+class Recurrence:
+    """
+    A parsed recurrence rule. by_day holds (ordinal, weekday) tuples,
+    with an ordinal of None for every such weekday in the period and
+    weekdays numbered from Monday as 0
+    """
+    def __init__(self, freq, interval=1, by_day=(), by_month_day=(), by_month=(),
+                 count=None, until=None, start=None, excluded=()):
+        self.freq = freq
+        self.interval = interval
+        self.by_day = list(by_day)
+        self.by_month_day = list(by_month_day)
+        self.by_month = list(by_month)
+        self.count = count
+        self.until = until
+        self.start = start
+        self.excluded = set(excluded)
+
+    def __str__(self):
+        return format_rule(self)
+
+    def occurrences(self, after=None):
+        """
+        Yields the dates the rule occurs on from after, or from start,
+        onwards in order
+        """
+        start = self.start or after or datetime.date.today()
+        after = max(after or start, start)
+
+        # Rules with a count have to be counted from their start
+        first = start if self.count is not None else after
+        yielded = empty = 0
+        for period in self._periods(start, first):
+            dates = [date for date in self._expand(period, start) if date >= start]
+            empty = 0 if dates else empty + 1
+            if empty > MAX_EMPTY_PERIODS:
+                return
+
+            for date in dates:
+                if self.until is not None and date > self.until:
+                    return
+                # Excluded dates still count towards the rule's count
+                yielded += 1
+                if self.count is not None and yielded > self.count:
+                    return
+                if date >= after and date not in self.excluded:
+                    yield date
+
+    def _periods(self, start, first):
+        """
+        Yields the first day of every period the rule occurs in, from
+        the one holding first onwards
+        """
+        if self.freq == 'DAILY':
+            skip = -(-(first - start).days // self.interval)
+            for i in count(skip):
+                yield start + datetime.timedelta(days=i * self.interval)
+        elif self.freq == 'WEEKLY':
+            week = start - datetime.timedelta(days=start.weekday())
+            skip = ((first - week).days // 7) // self.interval
+            for i in count(skip):
+                yield week + datetime.timedelta(weeks=i * self.interval)
+        else:
+            months = 1 if self.freq == 'MONTHLY' else 12
+            step = self.interval * months
+            elapsed = (first.year - start.year) * 12 + first.month - start.month
+            for i in count(elapsed // step):
+                yield _add_months(start.replace(day=1), i * step)
+
+    def _expand(self, period, start):
+        """
+        Returns the dates the rule occurs on in the period starting on
+        period, in order
+        """
+        if self.freq == 'DAILY':
+            dates = [period]
+        elif self.freq == 'WEEKLY':
+            weekdays = [weekday for _, weekday in self.by_day] or [start.weekday()]
+            dates = [period + datetime.timedelta(days=weekday) for weekday in sorted(set(weekdays))]
+        elif self.freq == 'MONTHLY':
+            dates = self._expand_month(period, start)
+        else:
+            months = self.by_month or [start.month]
+            dates = [date for month in sorted(months)
+                     for date in self._expand_month(period.replace(month=month), start)]
+
+        return [date for date in dates if self._matches(date)]
+
+    def _expand_month(self, month, start):
+        days = calendar.monthrange(month.year, month.month)[1]
+        weekdays = {weekday for _, weekday in self.by_day}
+
+        # Days of the month are narrowed down by weekday, if both are given
+        if self.by_month_day or not self.by_day:
+            dates = []
+            for day in self.by_month_day or [start.day]:
+                day = day if day > 0 else days + day + 1
+                if 1 <= day <= days:
+                    dates.append(month.replace(day=day))
+            return sorted({date for date in dates if not weekdays or date.weekday() in weekdays})
+
+        dates = set()
+        for ordinal, weekday in self.by_day:
+            matching = [month.replace(day=day) for day in range(1, days + 1)
+                        if month.replace(day=day).weekday() == weekday]
+            if ordinal is None:
+                dates.update(matching)
+            elif abs(ordinal) <= len(matching):
+                dates.add(matching[ordinal - 1 if ordinal > 0 else ordinal])
+        return sorted(dates)
+
+    def _matches(self, date):
+        if self.by_month and date.month not in self.by_month:
+            return False
+        if self.freq == 'DAILY':
+            if self.by_day and date.weekday() not in {weekday for _, weekday in self.by_day}:
+                return False
+            if self.by_month_day:
+                days = calendar.monthrange(date.year, date.month)[1]
+                if not {date.day, date.day - days - 1} & set(self.by_month_day):
+                    return False
+        return True
+
+
+def parse(text):
+    """
+    Parses a rule written as in the module docstring, raising ValueError
+    for rules that are malformed or use unsupported parts
+    """
+    parts, start, excluded = None, None, set()
+    for line in text.strip().splitlines():
+        name, _, value = line.strip().partition(':')
+        name = name.upper()
+        if not value:
+            # A bare rule
+            name, value = 'RRULE', line.strip()
+        if name == 'RRULE':
+            parts = value
+        elif name == 'DTSTART':
+            start = _parse_date(value)
+        elif name == 'EXDATE':
+            excluded.update(_parse_date(date) for date in value.split(','))
+        else:
+            raise ValueError('Unsupported property %s' % name)
+    if not parts:
+        raise ValueError('No RRULE given')
+
+    options = {}
+    for part in parts.split(';'):
+        name, _, value = part.partition('=')
+        name, value = name.strip().upper(), value.strip().upper()
+        if name == 'FREQ':
+            if value not in FREQUENCIES:
+                raise ValueError('Unsupported FREQ %s' % value)
+            options['freq'] = value
+        elif name == 'INTERVAL':
+            options['interval'] = _parse_int(value, name, minimum=1)
+        elif name == 'COUNT':
+            options['count'] = _parse_int(value, name, minimum=1)
+        elif name == 'UNTIL':
+            options['until'] = _parse_date(value)
+        elif name == 'BYDAY':
+            options['by_day'] = [_parse_weekday(day) for day in value.split(',')]
+        elif name == 'BYMONTHDAY':
+            options['by_month_day'] = [_parse_int(day, name, -31, 31) for day in value.split(',')]
+            if 0 in options['by_month_day']:
+                raise ValueError('BYMONTHDAY may not be 0')
+        elif name == 'BYMONTH':
+            options['by_month'] = [_parse_int(month, name, 1, 12) for month in value.split(',')]
+        else:
+            raise ValueError('Unsupported rule part %s' % name)
+
+    if 'freq' not in options:
+        raise ValueError('FREQ is required')
+    if options['freq'] in ('DAILY', 'WEEKLY') and any(
+            ordinal is not None for ordinal, _ in options.get('by_day', ())):
+        raise ValueError('BYDAY ordinals are only allowed in MONTHLY and YEARLY rules')
+    if 'count' in options and 'until' in options:
+        raise ValueError('COUNT and UNTIL may not both be given')
+    return Recurrence(start=start, excluded=excluded, **options)
+
+
+def format_rule(rule):
+    """
+    Writes rule back out as parse reads it
+    """
+    parts = ['FREQ=%s' % rule.freq]
+    if rule.interval != 1:
+        parts.append('INTERVAL=%d' % rule.interval)
+    if rule.by_day:
+        parts.append('BYDAY=' + ','.join(
+            '%s%s' % ('' if ordinal is None else ordinal, WEEKDAYS[weekday])
+            for ordinal, weekday in rule.by_day))
+    if rule.by_month_day:
+        parts.append('BYMONTHDAY=' + ','.join(str(day) for day in rule.by_month_day))
+    if rule.by_month:
+        parts.append('BYMONTH=' + ','.join(str(month) for month in rule.by_month))
+    if rule.count is not None:
+        parts.append('COUNT=%d' % rule.count)
+    if rule.until is not None:
+        parts.append('UNTIL=' + _format_date(rule.until))
+
+    lines = []
+    if rule.start is not None:
+        lines.append('DTSTART:' + _format_date(rule.start))
+    lines.append('RRULE:' + ';'.join(parts))
+    if rule.excluded:
+        lines.append('EXDATE:' + ','.join(_format_date(date) for date in sorted(rule.excluded)))
+    return '\n'.join(lines)
+
+
+def _add_months(month, months):
+    years, index = divmod(month.month - 1 + months, 12)
+    return month.replace(year=month.year + years, month=index + 1)
+
+
+def _parse_date(value):
+    try:
+        return datetime.datetime.strptime(value.strip()[:8], '%Y%m%d').date()
+    except ValueError:
+        raise ValueError('Dates must be written as YYYYMMDD, not %s' % value)
+
+
+def _format_date(date):
+    return date.strftime('%Y%m%d')
+
+
+def _parse_int(value, name, minimum=None, maximum=None):
+    try:
+        number = int(value)
+    except ValueError:
+        raise ValueError('%s must be a number' % name)
+    if (minimum is not None and number < minimum) or (maximum is not None and number > maximum):
+        raise ValueError('%s is out of range' % name)
+    return number
+
+
+def _parse_weekday(value):
+    value = value.strip()
+    if value[-2:] not in WEEKDAYS:
+        raise ValueError('Unknown weekday %s' % value)
+    ordinal = _parse_int(value[:-2], 'BYDAY', -5, 5) if value[:-2] else None
+    if ordinal == 0:
+        raise ValueError('BYDAY ordinals may not be 0')
+    return ordinal, WEEKDAYS.index(value[-2:])
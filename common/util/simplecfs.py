@@ -11,6 +11,7 @@ simplified representations of User join Chore objects, such as
         its associated vdelta value(the amount by which vwork increases
         when the user performs a unit of real work)
 """
+import itertools
 
 
 def _index(user_list, id):
@@ -63,16 +64,25 @@ def _next_user_get(vworks, last_by=None):
 
 
 
-def _order_project(vworks, vdeltas, interval, initial_offset, last_by=None, period=90):
+def _interval_offsets(interval, initial_offset):
+    """
+    Yields the offsets in days of a chore repeated every interval days,
+    starting initial_offset days from the present day
+    """
+    return itertools.count(initial_offset, interval)
+
+
+def _order_project(vworks, vdeltas, offsets, last_by=None, period=90):
     """
     Given 
         a set of vworks, 
         a set of vdeltas, 
-        a chore interval in days, 
-        an initial offset in days for the next chore,
+        an iterable of the offsets in days from the present day that 
+            the chore occurs on, in order, which may be endless,
         a time period in days, 
     return a list of tuples of user id and scheduled offsets from 
-    the present day.
+    the present day. Offsets are only taken from offsets up to the
+    first past period
     """
     # TODO: Write an implementation of this function with red-black 
     # tree
@@ -80,14 +90,15 @@ def _order_project(vworks, vdeltas, interval, initial_offset, last_by=None, peri
     # Replace vworks with a copy of vworks
     vworks = vworks[:]
 
-    # If neither the lists nor interval is provided , return nothing
+    # If neither the lists nor offsets are provided, return nothing
     
-    if(not(vworks and vdeltas and interval)): return None
+    if(not(vworks and vdeltas and offsets)): return None
     
     order_projection = []
-    elapsed_time = initial_offset
 
-    while(elapsed_time <= period):
+    for elapsed_time in offsets:
+        if(elapsed_time > period): break
+
         # Get id of next person in queue
         last_by = _next_user_get(vworks, last_by)
 
@@ -96,13 +107,10 @@ def _order_project(vworks, vdeltas, interval, initial_offset, last_by=None, peri
         
         # Update value of user's vwork
         vwork = vworks.pop(_index(vworks, last_by)) 
-        vwork = _update_vwork(vwork, vdeldtas)
+        vwork = _update_vwork(vwork, vdeltas)
         
         # Insert vwork into appropriate position in the list
         vworks.insert(_next_vwork_index(vworks, vwork[1]), vwork)
-
-        # Update elapsed time 
-        elapsed_time += interval 
     
     return order_projection
 
@@ -118,7 +126,7 @@ def _update_vwork(vwork, vdeltas):
 """   
 Run with: 
 
-from common.util.simplecfsscheduler import _test
+from common.util.simplecfs import _test
 _test()
 
 """
@@ -139,6 +147,6 @@ def _test():
     print(_next_user_get(vworks = sorted(TEST_vworks, key = lambda user:user[1]), last_by = TEST_last_by))
 
     print("Order of users and offsets with initial offset of 2")
-    print(_order_project(sorted(TEST_vworks), TEST_vdeltas, 5, 2, TEST_last_by))
+    print(_order_project(sorted(TEST_vworks), TEST_vdeltas, _interval_offsets(5, 2), TEST_last_by))
 
     
\ No newline at end of file
@@ -3,6 +3,9 @@ ASGI config for ct project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Requests for the event stream are served by the tracker's server-sent
+event application, everything else by Django.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
 """
@@ -13,4 +16,13 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ct.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once Django is set up
+from tracker.events import sse_application
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http' and scope['path'] == '/api/events/':
+        return await sse_application(scope, receive, send)
+    return await django_application(scope, receive, send)
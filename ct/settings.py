@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.0/ref/settings/
 """
 
+import datetime
 import os
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
@@ -43,6 +44,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'tracker.middleware.MetricsMiddleware',
+    'tracker.middleware.QueryLogMiddleware',
+    'tracker.middleware.ProfilingMiddleware',
+    'tracker.middleware.ReplicaRoutingMiddleware',
+    'tracker.middleware.ShardRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -86,9 +92,63 @@ DATABASES = {
         'PASSWORD': '1234234',
         'HOST': '127.0.0.1',
         'PORT': '',
+
+        # Seconds connections are kept open for reuse by later requests. 
+        # 0 closes them at the end of each request
+        'CONN_MAX_AGE': int(os.environ.get('TRACKER_DB_CONN_MAX_AGE', 60)),
     }
 }
 
+# Read replicas of the default database, one for each host listed in
+# TRACKER_DB_REPLICA_HOSTS. Tests read from the default database instead
+for i, host in enumerate(filter(None, os.environ.get('TRACKER_DB_REPLICA_HOSTS', '').split(','))):
+    DATABASES['replica%d' % (i + 1)] = dict(
+        DATABASES['default'], HOST=host.strip(), TEST={'MIRROR': 'default'})
+
+# Shards households can be stored on besides the default database, one
+# for each host listed in TRACKER_DB_SHARD_HOSTS
+for i, host in enumerate(filter(None, os.environ.get('TRACKER_DB_SHARD_HOSTS', '').split(','))):
+    DATABASES['shard%d' % (i + 1)] = dict(DATABASES['default'], HOST=host.strip())
+
+# TRACKER_DB_SQLITE runs against SQLite files instead: db.sqlite3 
+# through two connections, the second of them standing in for a replica 
+# that is never behind, and shard1.sqlite3 as a second shard
+if os.environ.get('TRACKER_DB_SQLITE'):
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        },
+        'replica': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+            'TEST': {'MIRROR': 'default'},
+        },
+        'shard1': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(BASE_DIR, 'shard1.sqlite3'),
+        },
+    }
+
+DATABASE_ROUTERS = ['tracker.sharding.ShardRouter', 'tracker.db.ReplicaRouter']
+
+# The default cache holds pins keeping users on the primary after they
+# write, see tracker.db, and must be shared between processes when there
+# are replicas. TRACKER_DB_SQLITE, which runs on a single host, shares 
+# it through files
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get(
+            'TRACKER_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('TRACKER_CACHE_LOCATION', ''),
+    }
+}
+if os.environ.get('TRACKER_DB_SQLITE') and not os.environ.get('TRACKER_CACHE_BACKEND'):
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache'),
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
@@ -143,4 +203,120 @@ REST_FRAMEWORK = {
         'tracker.backends.JWTAuthentication',
     ),
     'NON_FIELD_ERRORS_KEY': 'error',
-}
\ No newline at end of file
+}
+
+# Maximum number of sub-requests accepted by a single call to the 
+# batch endpoint
+TRACKER_BATCH_MAX_REQUESTS = 20
+
+# Maximum number of emails accepted by a single call to the bulk invite
+# endpoint
+TRACKER_BULK_INVITE_MAX_EMAILS = 100
+
+# Maximum number of chores created by a single call to the chore list
+# endpoint
+TRACKER_BULK_CREATE_MAX_CHORES = 100
+
+# Seconds within which change log entries are assumed to be committed.
+# Sync cursors only advance past entries older than this, as newer ones
+# may have been given their ids after entries still being committed
+TRACKER_SYNC_SETTLE_SECONDS = 30
+
+# Channel layer used to push scheduling events to clients. The in-process
+# layer only reaches clients connected to the same ASGI process
+TRACKER_CHANNEL_LAYER = 'tracker.events.InProcessChannelLayer'
+
+# Seconds between keepalive comments on idle event streams
+TRACKER_EVENTS_HEARTBEAT = 15
+
+# Number of verified tokens and of users kept in process by 
+# JWTAuthentication, and the seconds a cached user is trusted for
+TRACKER_AUTH_CACHE_SIZE = 1024
+TRACKER_AUTH_USER_CACHE_TTL = 30
+
+# Lifetime of issued access tokens. The same token is handed out again 
+# until it is within TRACKER_TOKEN_RENEW_BEFORE of expiring. Clients 
+# renew expired access tokens with their refresh token
+TRACKER_TOKEN_LIFETIME = datetime.timedelta(minutes=15)
+TRACKER_TOKEN_RENEW_BEFORE = datetime.timedelta(minutes=5)
+TRACKER_REFRESH_TOKEN_LIFETIME = datetime.timedelta(days=60)
+
+# Number of passwords hashed at once, and the seconds a login waits for
+# its turn before being turned away
+TRACKER_PASSWORD_HASHING_WORKERS = 2
+TRACKER_PASSWORD_HASHING_TIMEOUT = 5
+
+# Bearer token Prometheus scrapes /metrics with. Staff users may read 
+# metrics too, and no one else
+TRACKER_METRICS_TOKEN = os.environ.get('TRACKER_METRICS_TOKEN')
+
+# Requests carrying this secret in an 'X-Profile' header or a 'profile'
+# query parameter are profiled, as are a sampled fraction of all 
+# requests. Profiles are written to TRACKER_PROFILING_DIR as pstats files
+TRACKER_PROFILING_SECRET = os.environ.get('TRACKER_PROFILING_SECRET')
+TRACKER_PROFILING_SAMPLE_RATE = 0
+TRACKER_PROFILING_DIR = os.path.join(BASE_DIR, 'profiles')
+
+# Statements slower than this many seconds, and statements of the same
+# shape repeated this many times in one request, are logged to the 
+# 'tracker.queries' logger
+TRACKER_SLOW_QUERY_THRESHOLD = 0.1
+TRACKER_REPEATED_QUERY_THRESHOLD = 5
+
+# Aliases of the databases that safe requests may read from. Users are 
+# kept on the primary for TRACKER_REPLICA_STICKY_SECONDS after they 
+# write, so that they see their own changes
+TRACKER_DATABASE_REPLICAS = [alias for alias in DATABASES if alias.startswith('replica')]
+TRACKER_REPLICA_STICKY_SECONDS = 10
+
+# Check that connections kept open between requests still work before
+# reusing them
+TRACKER_DB_HEALTH_CHECKS = True
+
+# Databases households are stored on, listed in TRACKER_SHARDS, and 
+# those new households are created on. Shards are only ever appended, as
+# each draws the ids of its rows from a range TRACKER_SHARD_ID_SPAN wide
+# picked by its position. Ranges past the first are past 32 bits, and 
+# sharded tables have 64 bit ids and id columns for them
+TRACKER_SHARDS = os.environ.get('TRACKER_SHARDS', 'default').split(',')
+TRACKER_NEW_HOUSEHOLD_SHARDS = TRACKER_SHARDS
+TRACKER_SHARD_ID_SPAN = 10 ** 12
+
+# How tracker.tasks runs background work: 'immediate' runs it inline,
+# 'thread' on TRACKER_TASK_THREADS threads once the request's 
+# transaction commits, for development, and 'database' queues it for
+# the run_tasks command. Failed queued tasks are retried after 
+# TRACKER_TASK_RETRY_DELAY seconds, doubling each time, up to 
+# TRACKER_TASK_MAX_ATTEMPTS times
+TRACKER_TASK_BACKEND = os.environ.get('TRACKER_TASK_BACKEND', 'immediate')
+TRACKER_TASK_THREADS = 4
+TRACKER_TASK_RETRY_DELAY = 10
+TRACKER_TASK_MAX_ATTEMPTS = 5
+
+# Months ahead of the current one that chore completions are partitioned
+# for on Postgres
+TRACKER_COMPLETION_PARTITIONS_AHEAD = 3
+
+# Days rows of each model are kept for by the apply_retention command,
+# which deletes them TRACKER_RETENTION_BATCH_SIZE at a time. Models left
+# out are kept forever. Chore completions are archived to compressed
+# JSON lines files under TRACKER_ARCHIVE_DIR before they are deleted
+TRACKER_RETENTION_DAYS = {
+    'request': 30,
+    'changelog': 90,
+    'chorecompletion': 730,
+}
+TRACKER_RETENTION_BATCH_SIZE = 500
+TRACKER_ARCHIVE_DIR = os.path.join(BASE_DIR, 'archive')
+
+# Seconds a rendered calendar feed is cached for. Feeds are cached under
+# their version, so this only bounds how long stale ones linger
+TRACKER_FEED_CACHE_SECONDS = 60 * 60 * 24
+
+# Where email, such as the daily chore digests, is sent. Outside 
+# production it is written to files under EMAIL_FILE_PATH. Digests are
+# sent TRACKER_DIGEST_BATCH_SIZE at a time
+EMAIL_BACKEND = os.environ.get('EMAIL_BACKEND', 'django.core.mail.backends.filebased.EmailBackend')
+EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
+DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL', 'chores@localhost')
+TRACKER_DIGEST_BATCH_SIZE = 100
@@ -3,3 +3,17 @@ from django.apps import AppConfig
 
 class TrackerConfig(AppConfig):
     name = 'tracker'
+
+    def ready(self):
+        # Connect the receivers invalidating authentication caches, 
+        # publishing events to clients, checking database connections
+        # reserving id ranges on shards, creating partitions and keeping
+        # stats up to date
+        import tracker.backends
+        import tracker.db
+        import tracker.events
+        import tracker.partitions
+        import tracker.sharding
+        import tracker.stats
+
+        tracker.db.check_pin_cache()
@@ -1,12 +1,105 @@
 import jwt
-from datetime import datetime
+import time
 
 from django.conf import settings 
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 
 from rest_framework import authentication, exceptions
 
+from common.util.lrucache import LRUCache
+
 from tracker.models import User 
 
+
+# Payloads of tokens which have already been verified, so that their 
+# signature isn't checked again on every request
+_payload_cache = LRUCache(
+    max_size=getattr(settings, 'TRACKER_AUTH_CACHE_SIZE', 1024))
+
+# Rows of recently authenticated users. Entries are dropped whenever a 
+# user is saved or deleted in this process, and otherwise live for a 
+# short while so that changes made elsewhere are picked up
+_user_cache = LRUCache(
+    max_size=getattr(settings, 'TRACKER_AUTH_CACHE_SIZE', 1024),
+    ttl=getattr(settings, 'TRACKER_AUTH_USER_CACHE_TTL', 30))
+
+
+def decode_token(token):
+    """
+    Returns the verified payload of token, raising AuthenticationFailed
+    if it is invalid or has expired
+    """
+    payload = _payload_cache.get(token)
+    if payload is None:
+        try:
+            # Also verifies the token's expiry
+            payload = jwt.decode(token, settings.SECRET_KEY, algorithms=['HS256'])
+        except:
+            msg = 'Invalid authentication. Could not decode token.'
+            raise exceptions.AuthenticationFailed(msg)
+
+        _payload_cache.set(token, payload)
+    
+    elif payload['exp'] <= time.time():
+        _payload_cache.delete(token)
+        msg = 'This token is no longer valid. Please log in again'
+        raise exceptions.AuthenticationFailed(msg)
+
+    return payload
+
+
+def _get_cached_user(pk, fresh=False):
+    """
+    Returns the user with primary key pk, from the cache when possible,
+    or from the database, refreshing the cache, if fresh. Each call 
+    gets its own instance, so that requests can't see each other's 
+    modifications
+    """
+    row = None if fresh else _user_cache.get(pk)
+    if row is None:
+        user = User.objects.get(pk=pk)
+        field_names = [field.attname for field in User._meta.concrete_fields]
+        row = (user._state.db, field_names, [getattr(user, name) for name in field_names])
+        _user_cache.set(pk, row)
+        return user
+
+    return User.from_db(*row)
+
+
+def get_token_user(payload, fresh=False):
+    """
+    Returns the user a verified token payload was issued to, raising 
+    AuthenticationFailed if they no longer exist, are deactivated, or 
+    have revoked the token. The cache is only invalidated in the worker
+    that saved the user, so checks that can't wait out its TTL, such as
+    refreshing, pass fresh to read the user from the database
+    """
+    try:
+        user = _get_cached_user(payload['id'], fresh=fresh)
+    except User.DoesNotExist:
+        msg = 'No user matching this token was found.'
+        raise exceptions.AuthenticationFailed(msg)
+    
+    if not user.is_active:
+        msg = 'This user has been deactivated.'
+        raise exceptions.AuthenticationFailed(msg)
+
+    # Tokens issued before versions were introduced count as 
+    # version 0
+    if payload.get('ver', 0) != user.token_version:
+        msg = 'This token has been revoked. Please log in again'
+        raise exceptions.AuthenticationFailed(msg)
+
+    return user
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_cache(sender, instance, **kwargs):
+    _user_cache.delete(instance.pk)
+
+
 class JWTAuthentication(authentication.BaseAuthentication):
     authentication_header_prefix = 'Token'
 
@@ -57,30 +150,26 @@ class JWTAuthentication(authentication.BaseAuthentication):
         
         return self._authenticate_credentials(request, token)
 
+    def authenticate_token(self, token):
+        """
+        Authenticate a bare token, for callers which don't receive it 
+        in an Authorization header, such as event streams
+        """
+        return self._authenticate_credentials(None, token)
+
     def _authenticate_credentials(self, request, token):
         """
-        Authenticate with given credentials 
+        Authenticate with given credentials. Verified tokens and their 
+        users are cached, so that most requests authenticate without 
+        checking a signature or querying the database
         """
-        
-        try:
-            payload = jwt.decode(token, settings.SECRET_KEY)
-        except:
-            msg = 'Invalid authentication. Could not decode token.'
-            raise exceptions.AuthenticationFailed(msg)
+        payload = decode_token(token)
 
-        try:
-            user = User.objects.get(pk=payload['id'])
-        except User.DoesNotExist:
-            msg = 'No user matching this token was found.'
-            raise exceptions.AuthenticationFailed(msg)
-        
-        if not user.is_active:
-            msg = 'This user has been deactivated.'
-            raise exceptions.AuthenticationFailed(msg)
-        
-        if datetime.fromtimestamp(payload['exp']) <= datetime.now():
-            msg = 'This token is no longer valid. Please log in again'
+        # Refresh tokens may only be exchanged for access tokens
+        if payload.get('typ', 'access') != 'access':
+            msg = 'Invalid authentication. Refresh tokens cannot authenticate requests.'
             raise exceptions.AuthenticationFailed(msg)
 
+        user = get_token_user(payload)
 
-        return(user, token)
\ No newline at end of file
+        return(user, token)
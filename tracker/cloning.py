@@ -0,0 +1,156 @@
+"""
+Copies a space's subtree, with its chores, under a new parent or as a
+new household, for households that start out from the layout of an
+existing one.
+
+The subtree is read with one query per model, and written with one
+bulk insert per level of the tree and per model, ids being remapped in
+memory, in a single transaction on the shard the copy goes to. Copies
+are logged for syncing clients as the rows they are made of are
+created. Counters such as vwork and schedules start afresh
+"""
+import datetime
+
+from django.db import transaction
+
+from tracker import sharding, stats, tasks
+from tracker.models import (ChangeLog, Chore, Space, UserChore, UserSpace,
+                            _change_entry)
+
+
+def clone_subtree(space, parent=None, name=None, members=False, rosters=False, user=None):
+    """
+    Copies the subtree under space, and its chores, under parent, or as
+    a new household if parent is None, naming the copy of space name if
+    given. Returns the copy of space.
+
+    With members, each copied space keeps those of its members who are
+    members of parent, or all of them in a new household. Without, the
+    copies take the members of parent, as new subspaces do. user is
+    made a member of every space in a new household.
+
+    With rosters, copied chores keep the rosters of the members kept.
+    Without, they are assigned to every member of their space, as new
+    chores are
+    """
+    source = space._state.db or sharding.current_shard()
+    target = parent._state.db if parent is not None else sharding.pick_shard()
+
+    with sharding.using_shard(source):
+        space_ids = Space.objects.subtree_ids(space)
+        spaces = list(Space.objects.filter(pk__in=space_ids).order_by('pk'))
+        chores = list(Chore.objects.filter(parent_space_id__in=space_ids).order_by('pk'))
+        source_members = list(UserSpace.objects
+            .filter(space_id__in=space_ids)
+            .order_by('pk')
+            .values_list('space_id', 'user_id', 'available')) if members else []
+        source_rosters = list(UserChore.objects
+            .filter(chore__parent_space_id__in=space_ids)
+            .order_by('pk')
+            .values_list('chore_id', 'user_id', 'delta_src', 'available')) if rosters else []
+
+    children = {}
+    for child in spaces:
+        children.setdefault(child.parent_id, []).append(child)
+
+    with sharding.using_shard(target), transaction.atomic(using=target):
+        if parent is not None:
+            allowed = set(parent.userspaces.values_list('user_id', flat=True))
+        else:
+            allowed = None
+
+        # Each level is inserted once the one above it has its ids. The
+        # copy of space is saved on its own, every backend returning its
+        # id, so that the rows below it hang off rows made here
+        copied_ids = {}
+        copies = [Space(name=name or space.name, parent_id=parent.pk if parent is not None else None)]
+        copies[0].save()
+        copied_ids[space.pk] = copies[0].pk
+
+        level = children.get(space.pk, [])
+        while level:
+            level_copies = [Space(name=original.name, parent_id=copied_ids[original.parent_id])
+                            for original in level]
+            _bulk_create(Space, level_copies, 'parent_id', 'name')
+            for original, copy in zip(level, level_copies):
+                copied_ids[original.pk] = copy.pk
+            copies.extend(level_copies)
+            level = [child for original in level for child in children.get(original.pk, [])]
+
+        # Members of each copy, by the id of the space it was copied from
+        space_members = {original_id: [] for original_id in copied_ids}
+        if members:
+            for space_id, user_id, available in source_members:
+                if allowed is None or user_id in allowed:
+                    space_members[space_id].append((user_id, available))
+        else:
+            for original_id in copied_ids:
+                space_members[original_id] = [(user_id, True) for user_id in sorted(allowed or ())]
+        if parent is None and user is not None:
+            for original_id, original_members in space_members.items():
+                if user.pk not in {user_id for user_id, _ in original_members}:
+                    original_members.append((user.pk, True))
+
+        userspaces = [
+            UserSpace(space_id=copied_ids[original_id], user_id=user_id, available=available)
+            for original_id, original_members in space_members.items()
+            for user_id, available in original_members]
+        _bulk_create(UserSpace, userspaces, 'space_id', 'user_id')
+        # The copy of space was logged as it was saved
+        ChangeLog.objects.bulk_create(
+            [_change_entry(copy, ChangeLog.CREATED) for copy in copies[1:]] +
+            [_change_entry(userspace, ChangeLog.CREATED) for userspace in userspaces])
+
+        chore_rosters = None
+        if rosters:
+            kept = {original_id: {user_id for user_id, _ in original_members}
+                    for original_id, original_members in space_members.items()}
+            by_chore = {}
+            for chore_id, user_id, delta_src, available in source_rosters:
+                by_chore.setdefault(chore_id, []).append((user_id, delta_src, available))
+            chore_rosters = [
+                [row for row in by_chore.get(chore.pk, []) if row[0] in kept[chore.parent_space_id]]
+                for chore in chores]
+
+        today = datetime.date.today()
+        chore_copies = []
+        for chore in chores:
+            copy = Chore(name=chore.name, interval=chore.interval, recurrence=chore.recurrence,
+                         parent_space_id=copied_ids[chore.parent_space_id])
+            if copy.recurrence:
+                copy.next_date = next(copy.occurrences(today), copy.next_date)
+            chore_copies.append(copy)
+        Chore.create_bulk(chore_copies, chore_rosters)
+
+        # Members' stats in the copies, and above them, are counted once
+        # the copy has been made
+        tasks.enqueue(stats.refresh_member_stats, space_ids=sorted(copied_ids.values()),
+                      user_ids=None, chore_spaces=True)
+
+    return copies[0]
+
+
+def _bulk_create(model, rows, parent_field, key_field):
+    """
+    Inserts rows, setting their ids. Every row's parent_field refers to
+    a row made in the inserting transaction, so backends that don't 
+    return the ids of bulk inserted rows have them read back as the 
+    rows under those parents, matched by key_field. Rows with the same 
+    parent and key are matched in the order their ids were allocated, 
+    which within a connection is the order they were inserted in
+    """
+    if not rows:
+        return
+    model.objects.bulk_create(rows)
+    if rows[0].pk is not None:
+        return
+
+    pks = {}
+    inserted = (model.objects
+        .filter(**{parent_field + '__in': {getattr(row, parent_field) for row in rows}})
+        .order_by('pk')
+        .values_list(parent_field, key_field, 'pk'))
+    for parent_id, key, pk in inserted:
+        pks.setdefault((parent_id, key), []).append(pk)
+    for row in rows:
+        row.pk = pks[getattr(row, parent_field), getattr(row, key_field)].pop(0)
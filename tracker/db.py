@@ -0,0 +1,125 @@
+"""
+Sends reads of the tracker's models to read replicas, and everything
+else to the primary database.
+
+Reads only go to replicas in contexts that allow them, which
+ReplicaRoutingMiddleware sets up for safe requests. Users who have just
+written are pinned to the primary for a while afterwards, so that they
+read their own writes however far behind the replicas are. Anything
+else, such as management commands and the event stream, reads from the
+primary
+"""
+import contextvars
+import random
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import request_started
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.dispatch import receiver
+
+
+_replica_reads = contextvars.ContextVar('replica_reads', default=False)
+
+# Cache backends whose entries are only seen by the process that set them
+PROCESS_LOCAL_CACHES = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+
+@contextmanager
+def replica_reads(allowed=True):
+    """
+    Let reads inside the block go to replicas, or keep them on the
+    primary if allowed is False
+    """
+    token = _replica_reads.set(allowed)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def _pin_key(user_id):
+    return 'tracker:primary:%d' % user_id
+
+
+def pin_to_primary(user_id):
+    """
+    Keep user_id's reads on the primary for TRACKER_REPLICA_STICKY_SECONDS.
+    Pins are kept in the default cache, which check_pin_cache makes sure
+    is shared between processes
+    """
+    cache.set(_pin_key(user_id), True, getattr(settings, 'TRACKER_REPLICA_STICKY_SECONDS', 10))
+
+
+def is_pinned(user_id):
+    return user_id is not None and cache.get(_pin_key(user_id), False)
+
+
+def check_pin_cache():
+    """
+    Raises ImproperlyConfigured if there are replicas but the default
+    cache isn't shared between processes, as users pinned by one 
+    process would go on reading from replicas through the others
+    """
+    backend = settings.CACHES.get(DEFAULT_CACHE_ALIAS, {}).get('BACKEND')
+    if getattr(settings, 'TRACKER_DATABASE_REPLICAS', []) and backend in PROCESS_LOCAL_CACHES:
+        raise ImproperlyConfigured(
+            'TRACKER_DATABASE_REPLICAS needs a default cache shared between processes '
+            'to pin users to the primary, not %s' % backend)
+
+
+class ReplicaRouter:
+    """
+    Routes reads of the tracker's models to one of
+    TRACKER_DATABASE_REPLICAS, picked at random, where the current
+    context allows it, and all writes to the primary.
+
+    Users are always read from the primary, so that authentication sees
+    revoked tokens and newly registered accounts at once.
+    JWTAuthentication's user cache keeps those reads infrequent.
+
+    Reads inside a transaction on the primary stay on it too, since the
+    transaction may have written rows the replicas can't see yet
+    """
+    app_labels = {'tracker'}
+    primary_models = {'user'}
+
+    def db_for_read(self, model, **hints):
+        replicas = getattr(settings, 'TRACKER_DATABASE_REPLICAS', [])
+        if (replicas and _replica_reads.get()
+                and not connections[DEFAULT_DB_ALIAS].in_atomic_block
+                and model._meta.app_label in self.app_labels
+                and model._meta.model_name not in self.primary_models):
+            return random.choice(replicas)
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        # Replicas are migrated by replication
+        return db == DEFAULT_DB_ALIAS
+
+
+@receiver(request_started)
+def check_connections(**kwargs):
+    """
+    With TRACKER_DB_HEALTH_CHECKS, make sure persistent connections kept
+    open from earlier requests still work before reusing them, replacing
+    those that don't rather than failing the request's first query
+    """
+    if not getattr(settings, 'TRACKER_DB_HEALTH_CHECKS', False):
+        return
+
+    for connection in connections.all():
+        if connection.connection is not None and not connection.is_usable():
+            connection.close()
@@ -0,0 +1,101 @@
+"""
+Daily digests of the chores each user is next up for today and
+tomorrow, sent by the send_digests command.
+
+The chores due are read with one query per shard, and their users with
+one query per batch of TRACKER_DIGEST_BATCH_SIZE users, however many
+users and chores there are. Digests are sent through Django's email
+backend over a single connection, a batch at a time.
+
+Each batch is recorded in DigestDelivery in the same transaction it is
+sent in, so that a user is sent at most one digest a day. Batches that
+fail to send are logged and left unrecorded, to be sent by the next run
+that day, and the run goes on with the batches after them
+"""
+import datetime
+import logging
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, transaction
+from django.template.loader import render_to_string
+
+from tracker import sharding
+from tracker.models import Chore, DigestDelivery, User
+
+logger = logging.getLogger('tracker.digests')
+
+
+def get_due_chores(today):
+    """
+    Returns a dictionary mapping the id of every user next up for a
+    chore due today or tomorrow to a list of (date, chore name, space
+    name) tuples, in order
+    """
+    due = defaultdict(list)
+    rows = sharding.collect_from_shards(lambda: list(Chore.objects
+        .filter(next_date__range=(today, today + datetime.timedelta(days=1)),
+                next_user_id__isnull=False)
+        .order_by('next_date', 'name')
+        .values_list('next_user_id', 'next_date', 'name', 'parent_space__name')))
+    for user_id, *chore in rows:
+        due[user_id].append(tuple(chore))
+    for chores in due.values():
+        chores.sort()
+    return due
+
+
+def render(user, chores, today):
+    """
+    Returns the digest of chores for user as an email message
+    """
+    context = {
+        'user': user,
+        'today': [chore for chore in chores if chore[0] == today],
+        'tomorrow': [chore for chore in chores if chore[0] != today],
+    }
+    return EmailMessage(
+        subject='Your chores for %s' % today.strftime('%A %d %B'),
+        body=render_to_string('tracker/digest.txt', context),
+        to=[user.email])
+
+
+def send_digests(today=None, batch_size=None, connection=None):
+    """
+    Sends today's digest to every active user with chores due who hasn't
+    been sent it yet. Returns the number of digests sent
+    """
+    today = today or datetime.date.today()
+    batch_size = batch_size or getattr(settings, 'TRACKER_DIGEST_BATCH_SIZE', 100)
+    due = get_due_chores(today)
+    user_ids = sorted(due)
+
+    connection = connection or get_connection()
+    sent = 0
+    with connection:
+        for i in range(0, len(user_ids), batch_size):
+            batch = user_ids[i:i + batch_size]
+            delivered = set(DigestDelivery.objects.using(DEFAULT_DB_ALIAS)
+                .filter(date=today, user_id__in=batch)
+                .values_list('user_id', flat=True))
+            users = list(User.objects.using(DEFAULT_DB_ALIAS)
+                .filter(pk__in=set(batch) - delivered, is_active=True)
+                .order_by('pk'))
+            if not users:
+                continue
+
+            try:
+                with transaction.atomic(using=DEFAULT_DB_ALIAS):
+                    DigestDelivery.objects.using(DEFAULT_DB_ALIAS).bulk_create(
+                        [DigestDelivery(user=user, date=today) for user in users])
+                    connection.send_messages([render(user, due[user.pk], today) for user in users])
+            except IntegrityError:
+                # A run alongside this one has sent some of the batch
+                continue
+            except Exception:
+                # The batch is rolled back, and the rest are still sent
+                logger.exception('Failed to send digests to users %s', [user.pk for user in users])
+                continue
+            sent += len(users)
+    return sent
@@ -0,0 +1,277 @@
+"""
+Pushes scheduling changes to clients as they happen, so that they do 
+not have to poll for them.
+
+Events are published to a channel layer, which fans them out to the 
+subscribers of each user. The default layer keeps its subscribers in 
+process and only reaches clients connected to the same ASGI process. 
+It can be swapped for a broker backed layer with TRACKER_CHANNEL_LAYER;
+layers need only implement subscribe, unsubscribe and publish.
+
+Clients subscribe through the server-sent event stream served by 
+'sse_application' at /api/events/.
+"""
+import asyncio
+import json
+import threading
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from rest_framework import exceptions
+
+from tracker.models import Chore, Request, UserChore, chores_rescheduled, requests_created
+
+
+class Subscription:
+    """
+    A queue of events for one user, consumed from the event loop it was
+    created on
+    """
+    def __init__(self, user_id, max_size=100):
+        self.user_id = user_id
+        self.loop = asyncio.get_event_loop()
+        self.queue = asyncio.Queue(maxsize=max_size)
+
+    def put(self, event):
+        # Slow consumers lose events rather than hold up publishers. 
+        # Clients resync on reconnect
+        if not self.queue.full():
+            self.queue.put_nowait(event)
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class InProcessChannelLayer:
+    """
+    Channel layer which delivers events to subscribers in this process.
+    Events may be published from any thread
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = {}
+
+    def subscribe(self, user_id):
+        """
+        Must be called from within the event loop which will consume the
+        subscription
+        """
+        subscription = Subscription(user_id)
+        with self._lock:
+            self._subscriptions.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self._subscriptions.pop(subscription.user_id, None)
+
+    def publish(self, user_ids, event):
+        with self._lock:
+            subscriptions = [
+                subscription for user_id in user_ids
+                for subscription in self._subscriptions.get(user_id, ())
+            ]
+        for subscription in subscriptions:
+            subscription.loop.call_soon_threadsafe(subscription.put, event)
+
+
+_channel_layer = None
+_channel_layer_lock = threading.Lock()
+
+def get_channel_layer():
+    global _channel_layer
+    with _channel_layer_lock:
+        if _channel_layer is None:
+            layer_class = getattr(settings, 'TRACKER_CHANNEL_LAYER',
+                                  'tracker.events.InProcessChannelLayer')
+            _channel_layer = import_string(layer_class)()
+    return _channel_layer
+
+
+def publish(user_ids, event, using=None):
+    """
+    Publish event to user_ids once the current transaction on the 
+    database using commits, so that clients never hear about changes
+    that are rolled back
+    """
+    user_ids = set(user_ids) 
+    if user_ids:
+        transaction.on_commit(lambda: get_channel_layer().publish(user_ids, event), using=using)
+
+
+@receiver(post_save, sender=Chore)
+def publish_chore_schedule(sender, instance, created, raw=False, using=None, **kwargs):
+    """
+    Tell a chore's users when its next user or next date changes
+    """
+    if raw or not (created or _schedule_changed(instance)):
+        return
+
+    user_ids = UserChore.objects.using(using).filter(chore=instance).values_list('user_id', flat=True)
+    publish(user_ids, _chore_scheduled(instance), using)
+
+
+@receiver(chores_rescheduled, sender=Chore)
+def publish_chore_schedules(sender, chores, **kwargs):
+    """
+    As publish_chore_schedule, reading the users of all of chores in 
+    one query
+    """
+    chores = [chore for chore in chores if _schedule_changed(chore)]
+    if not chores:
+        return
+
+    # Chores are rescheduled together within a household
+    using = chores[0]._state.db
+    user_ids = {}
+    userchores = (UserChore.objects.using(using).filter(chore__in=chores)
+                  .values_list('chore_id', 'user_id'))
+    for chore_id, user_id in userchores:
+        user_ids.setdefault(chore_id, []).append(user_id)
+    for chore in chores:
+        publish(user_ids.get(chore.pk, []), _chore_scheduled(chore), using)
+
+
+def _schedule_changed(chore):
+    """
+    Return whether chore's schedule changed since it was loaded or last
+    published, remembering it as published
+    """
+    schedule = (chore.next_user_id, chore.next_date)
+    if schedule == getattr(chore, '_loaded_schedule', None):
+        return False
+    chore._loaded_schedule = schedule
+    return True
+
+
+def _chore_scheduled(chore):
+    return {
+        'type': 'chore.scheduled',
+        'chore': chore.pk,
+        'space': chore.parent_space_id,
+        'next_user': chore.next_user_id,
+        'next_date': str(chore.next_date),
+    }
+
+
+@receiver(post_save, sender=Request)
+def publish_request_created(sender, instance, created, raw=False, using=None, **kwargs):
+    if raw or not created:
+        return
+    publish([instance.to_user_id], {
+        'type': 'request.created',
+        'request': instance.pk,
+        'space': instance.space_id,
+    }, using)
+
+@receiver(requests_created, sender=Request)
+def publish_requests_created(sender, requests, **kwargs):
+    for request in requests:
+        publish([request.to_user_id], {
+            'type': 'request.created',
+            'request': request.pk,
+            'space': request.space_id,
+        }, request._state.db)
+
+@receiver(post_delete, sender=Request)
+def publish_request_deleted(sender, instance, using=None, **kwargs):
+    publish([instance.to_user_id], {
+        'type': 'request.deleted',
+        'request': instance.pk,
+        'space': instance.space_id,
+    }, using)
+
+
+def _get_token(scope):
+    """
+    Returns the token passed in the Authorization header or, since 
+    browsers' EventSource can't set headers, the 'token' query parameter
+    """
+    from tracker.backends import JWTAuthentication
+
+    for name, value in scope.get('headers', []):
+        if name == b'authorization':
+            header = value.decode('utf-8').split()
+            if len(header) == 2 and header[0].lower() == JWTAuthentication.authentication_header_prefix.lower():
+                return header[1]
+
+    query = parse_qs(scope.get('query_string', b'').decode('utf-8'))
+    return query.get('token', [None])[0]
+
+
+async def _respond(send, status, body=b''):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json')],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def sse_application(scope, receive, send):
+    """
+    ASGI application streaming the events of the authenticated user as
+    server-sent events
+    """
+    from tracker.backends import JWTAuthentication
+
+    token = _get_token(scope)
+    if token is None:
+        return await _respond(send, 401, b'{"detail": "Authentication credentials were not provided."}')
+    try:
+        user, _ = await sync_to_async(JWTAuthentication().authenticate_token)(token)
+    except exceptions.AuthenticationFailed as exc:
+        return await _respond(send, 401, json.dumps({'detail': str(exc.detail)}).encode('utf-8'))
+
+    heartbeat = getattr(settings, 'TRACKER_EVENTS_HEARTBEAT', 15)
+    layer = get_channel_layer()
+    subscription = layer.subscribe(user.pk)
+
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+        ],
+    })
+
+    disconnected = asyncio.ensure_future(receive())
+    try:
+        while True:
+            next_event = asyncio.ensure_future(subscription.get())
+            done, _ = await asyncio.wait(
+                [next_event, disconnected], timeout=heartbeat,
+                return_when=asyncio.FIRST_COMPLETED)
+
+            if disconnected in done and disconnected.result()['type'] == 'http.disconnect':
+                next_event.cancel()
+                break
+            if disconnected in done:
+                disconnected = asyncio.ensure_future(receive())
+
+            if next_event in done:
+                event = next_event.result()
+                message = 'event: %s\ndata: %s\n\n' % (event['type'], json.dumps(event))
+            else:
+                next_event.cancel()
+                message = ': keepalive\n\n'
+
+            await send({
+                'type': 'http.response.body',
+                'body': message.encode('utf-8'),
+                'more_body': True,
+            })
+    finally:
+        disconnected.cancel()
+        layer.unsubscribe(subscription)
@@ -0,0 +1,164 @@
+"""
+iCalendar feeds of the chores each user is projected to do over the
+coming month, for calendar apps to subscribe to.
+
+Calendar apps can't send credentials, so feeds are read with a secret
+token in their URL instead. Only a digest of the token is stored, and
+issuing a new one revokes the last.
+
+Apps poll feeds every few minutes, so feeds are versioned by the last
+change logged on each shard in the spaces the user has access to, along
+with the day, as projections are made from today. Finding the version
+costs a couple of indexed queries per shard. Feeds are rendered as they
+are streamed to the first poll of each version and cached under it, so
+that the polls that follow are answered from the cache, or with a 304
+by apps that send the version back
+"""
+import datetime
+import hashlib
+import secrets
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from tracker import sharding
+from tracker.models import ChangeLog, Chore, Space, User
+from tracker.sync import format_cursor
+
+
+# Lines longer than this many octets are folded onto the next
+LINE_LENGTH = 75
+
+
+def token_digest(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+def issue_token(user):
+    """
+    Returns a new token for user's feed, revoking the one issued before
+    """
+    token = secrets.token_urlsafe(32)
+    user.feed_token_digest = token_digest(token)
+    user.save(update_fields=['feed_token_digest'])
+    return token
+
+
+def revoke_token(user):
+    user.feed_token_digest = None
+    user.save(update_fields=['feed_token_digest'])
+
+
+def get_user(token):
+    """
+    Returns the active user whose feed token is token, or None
+    """
+    if not token:
+        return None
+    return User.objects.filter(feed_token_digest=token_digest(token), is_active=True).first()
+
+
+def get_version(user):
+    """
+    Returns the ETag and the last modification time of user's feed
+    """
+    today = timezone.localdate()
+    cursor, last_modified = {}, timezone.make_aware(
+        datetime.datetime.combine(today, datetime.time()))
+
+    for shard, space_ids in sharding.on_each_shard(Space.objects.accessible_ids, user):
+        latest = (ChangeLog.objects.using(shard)
+            .filter(Q(space_id__in=space_ids) | Q(user_id=user.pk))
+            .aggregate(pk=Max('pk'), created_at=Max('created_at')))
+        cursor[shard] = latest['pk'] or 0
+        if latest['created_at'] is not None:
+            last_modified = max(last_modified, latest['created_at'])
+
+    version = '%s:%d:%s:%s' % (
+        today.isoformat(), user.pk, user.feed_token_digest, format_cursor(cursor))
+    return '"%s"' % hashlib.sha1(version.encode('utf-8')).hexdigest(), last_modified
+
+
+def _cache_key(user, etag):
+    return 'tracker:feed:%d:%s' % (user.pk, etag.strip('"'))
+
+
+def get_cached(user, etag):
+    return cache.get(_cache_key(user, etag))
+
+
+def stream(user, etag):
+    """
+    Yields user's feed a chunk at a time, caching the whole of it under
+    etag once the last chunk has been yielded
+    """
+    chunks = []
+    for chunk in render(user):
+        chunks.append(chunk)
+        yield chunk
+    cache.set(_cache_key(user, etag), ''.join(chunks),
+              getattr(settings, 'TRACKER_FEED_CACHE_SECONDS', 60 * 60 * 24))
+
+
+def render(user):
+    """
+    Yields the lines of user's feed, projecting one chore at a time from
+    the rosters read along with the chores
+    """
+    chores = sharding.collect_from_shards(lambda: list(Chore.objects
+        .filter(users=user)
+        .select_related('parent_space')
+        .prefetch_related('userchore_set')
+        .order_by('pk')))
+    today = datetime.date.today()
+    stamp = timezone.now().strftime('%Y%m%dT%H%M%SZ')
+
+    yield _line('BEGIN:VCALENDAR')
+    yield _line('VERSION:2.0')
+    yield _line('PRODID:-//tracker//chores//EN')
+    yield _line('CALSCALE:GREGORIAN')
+    yield _line('X-WR-CALNAME:' + _escape('Chores for %s' % (user.name or user.email)))
+
+    for chore in chores:
+        for user_id, offset in chore.get_chore_calendar():
+            if user_id != user.pk:
+                continue
+            date = today + datetime.timedelta(days=offset)
+            yield ''.join([
+                _line('BEGIN:VEVENT'),
+                _line('UID:chore-%d-%s@tracker' % (chore.pk, date.strftime('%Y%m%d'))),
+                _line('DTSTAMP:' + stamp),
+                _line('DTSTART;VALUE=DATE:' + date.strftime('%Y%m%d')),
+                _line('DTEND;VALUE=DATE:' + (date + datetime.timedelta(days=1)).strftime('%Y%m%d')),
+                _line('SUMMARY:' + _escape(chore.name)),
+                _line('LOCATION:' + _escape(chore.parent_space.name)),
+                _line('END:VEVENT'),
+            ])
+
+    yield _line('END:VCALENDAR')
+
+
+def _escape(text):
+    return (text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+            .replace('\r\n', '\\n').replace('\n', '\\n'))
+
+
+def _line(text):
+    """
+    Returns text as a content line, folded so that no line is longer
+    than LINE_LENGTH octets
+    """
+    encoded = text.encode('utf-8')
+    parts = []
+    while len(encoded) > LINE_LENGTH:
+        # Folds go between characters, and continuation lines start
+        # with a space
+        cut = LINE_LENGTH if not parts else LINE_LENGTH - 1
+        while cut and (encoded[cut] & 0xC0) == 0x80:
+            cut -= 1
+        parts.append(encoded[:cut])
+        encoded = encoded[cut:]
+    parts.append(encoded)
+    return '\r\n '.join(part.decode('utf-8') for part in parts) + '\r\n'
@@ -0,0 +1,68 @@
+"""
+Runs password hashing, which is deliberately expensive, on a small pool
+of threads. At most TRACKER_PASSWORD_HASHING_WORKERS passwords are 
+hashed at once, however many logins arrive together, so that they can't
+starve every other request of CPU. Callers wait at most 
+TRACKER_PASSWORD_HASHING_TIMEOUT seconds for a free worker before being
+turned away.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password, check_password
+
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+class PasswordHashingBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Too many logins are being processed. Please try again shortly.'
+    default_code = 'password_hashing_busy'
+
+
+_executor = None
+_executor_lock = threading.Lock()
+_slots = None
+
+def _get_executor():
+    global _executor, _slots
+    with _executor_lock:
+        if _executor is None:
+            workers = getattr(settings, 'TRACKER_PASSWORD_HASHING_WORKERS', 2)
+            _executor = ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix='password-hashing')
+            _slots = threading.BoundedSemaphore(workers)
+    return _executor
+
+
+def _run(func, *args):
+    executor = _get_executor()
+    timeout = getattr(settings, 'TRACKER_PASSWORD_HASHING_TIMEOUT', 5)
+    if not _slots.acquire(timeout=timeout):
+        raise PasswordHashingBusy()
+    try:
+        return executor.submit(func, *args).result()
+    finally:
+        _slots.release()
+
+
+def hash_password(raw_password):
+    """
+    Returns the hash of raw_password, as make_password would
+    """
+    return _run(make_password, raw_password)
+
+
+def verify_password(raw_password, encoded):
+    """
+    Returns a tuple of whether raw_password matches the hash encoded, 
+    and whether the hash should be upgraded to the preferred hasher.
+
+    Hash upgrades are left to the caller, so that no database work 
+    happens on the hashing threads
+    """
+    must_update = []
+    matches = _run(check_password, raw_password, encoded, must_update.append)
+    return matches, bool(must_update)
@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from tracker import retention, sharding
+
+
+class Command(BaseCommand):
+    help = (
+        'Removes the rows that are older than TRACKER_RETENTION_DAYS allows '
+        'from every shard, archiving those of archived models first. Meant '
+        'to be run daily'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('models', nargs='*', metavar='model',
+            help='Models to apply retention to, by default all of them')
+        parser.add_argument('--batch-size', type=int,
+            default=getattr(settings, 'TRACKER_RETENTION_BATCH_SIZE', 500),
+            help='Rows to delete in each transaction')
+        parser.add_argument('--pause', type=float, default=0,
+            help='Seconds to wait between batches')
+
+    def handle(self, *args, **options):
+        try:
+            policies = [retention.get_policy(name) for name in options['models']]
+        except KeyError as error:
+            raise CommandError('No retention policy for %s' % error)
+
+        for policy in policies or retention.POLICIES:
+            for shard in sharding.get_shards():
+                archived, removed = retention.apply(
+                    policy, shard, batch_size=options['batch_size'], pause=options['pause'])
+                if archived:
+                    self.stdout.write('Archived %d %s rows from %s' % (archived, policy.name, shard))
+                self.stdout.write('Removed %d %s rows from %s' % (removed, policy.name, shard))
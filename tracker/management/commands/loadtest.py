@@ -0,0 +1,186 @@
+import datetime
+import random
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from tracker import sharding
+from tracker.backends import decode_token
+from tracker.models import User, Request, UserChore
+
+
+def _percentile(ordered, fraction):
+    """
+    Returns the value at fraction through the sorted list ordered, by 
+    the nearest rank method
+    """
+    if not ordered:
+        return 0
+    rank = max(int(round(fraction * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+class Command(BaseCommand):
+    help = (
+        'Replays a weighted mix of API calls as the users seeded by '
+        'seed_tracker, in process, and reports throughput, latency '
+        'percentiles and queries per request for each kind of call'
+    )
+
+    # Calls in the mix, and their default weights
+    operations = {
+        'login': 1,
+        'list_chores': 10,
+        'list_spaces': 5,
+        'accept_request': 1,
+        'complete_chore': 3,
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000,
+            help='Total number of calls to make')
+        parser.add_argument('--concurrency', type=int, default=1,
+            help='Number of threads making calls. Keep this at 1 on SQLite')
+        parser.add_argument('--mix', default='',
+            help='Weights overriding the defaults, eg. "list_chores=20,login=0"')
+        parser.add_argument('--prefix', default='loadtest')
+        parser.add_argument('--password', default='loadtest-password')
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        weights = dict(self.operations)
+        for item in filter(None, options['mix'].split(',')):
+            name, _, weight = item.partition('=')
+            if name not in weights:
+                raise CommandError('Unknown operation "%s"' % name)
+            weights[name] = float(weight)
+
+        users = list(User.objects.filter(email__startswith=options['prefix'] + '-'))
+        if not users:
+            raise CommandError('No seeded users found. Run seed_tracker first')
+
+        # Requests pending for each user, to be accepted as the run goes
+        self.pending = defaultdict(list)
+        requests = sharding.collect_from_shards(lambda: list(
+            Request.objects.filter(to_user__in=users).values_list('id', 'to_user_id')))
+        for request_id, user_id in requests:
+            self.pending[user_id].append(request_id)
+        self.lock = threading.Lock()
+        self.tokens = {}
+        self.options = options
+
+        self.results = defaultdict(list)
+        names = list(weights)
+        # The first threads make one call more when the calls don't 
+        # divide evenly between them
+        per_thread, remainder = divmod(options['requests'], options['concurrency'])
+        threads = [
+            threading.Thread(target=self._run, args=(
+                random.Random((options['seed'] or 0) + t), users, names, 
+                [weights[name] for name in names], per_thread + (t < remainder)))
+            for t in range(options['concurrency'])
+        ]
+
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        self._report(elapsed)
+
+    def _run(self, rng, users, names, weights, count):
+        client = Client(HTTP_HOST='localhost', raise_request_exception=False)
+
+        try:
+            for _ in range(count):
+                name = rng.choices(names, weights)[0]
+                user = rng.choice(users)
+
+                # Queries are counted on every database, as shards and 
+                # replicas serve most reads
+                with ExitStack() as stack:
+                    queries = [stack.enter_context(CaptureQueriesContext(connections[alias]))
+                               for alias in connections]
+                    start = time.perf_counter()
+                    response = getattr(self, '_' + name)(client, rng, user)
+                    duration = time.perf_counter() - start
+
+                with self.lock:
+                    self.results[name].append(
+                        (duration, response.status_code, sum(len(alias) for alias in queries)))
+        finally:
+            for alias in connections:
+                connections[alias].close()
+
+    def _auth(self, user):
+        """
+        Returns the authorization header for user. Tokens are issued 
+        again once they near expiry, so that long runs don't turn into 
+        runs of 401s
+        """
+        renew_before = getattr(settings, 'TRACKER_TOKEN_RENEW_BEFORE', datetime.timedelta(minutes=5))
+        now = time.time()
+
+        with self.lock:
+            token, renew_at = self.tokens.get(user.pk, (None, now))
+            if renew_at <= now:
+                token = user.issue_token()
+                renew_at = decode_token(token)['exp'] - renew_before.total_seconds()
+                self.tokens[user.pk] = (token, renew_at)
+        return {'HTTP_AUTHORIZATION': 'Token ' + token}
+
+    def _login(self, client, rng, user):
+        return client.post('/api/user/login/', {'user': {
+            'email': user.email, 'password': self.options['password']}},
+            content_type='application/json')
+
+    def _list_chores(self, client, rng, user):
+        return client.get('/api/chore/', **self._auth(user))
+
+    def _list_spaces(self, client, rng, user):
+        return client.get('/api/space/', **self._auth(user))
+
+    def _accept_request(self, client, rng, user):
+        with self.lock:
+            pending = self.pending.get(user.pk)
+            request_id = pending.pop() if pending else None
+
+        # Once a user's requests have all been accepted, list them instead
+        if request_id is None:
+            return client.get('/api/requests/', **self._auth(user))
+        return client.post('/api/requests/accept/', {'request_id': request_id},
+                           content_type='application/json', **self._auth(user))
+
+    def _complete_chore(self, client, rng, user):
+        chore_ids = sharding.collect_from_shards(lambda: list(
+            UserChore.objects.filter(user=user).values_list('chore_id', flat=True)[:20]))
+        chore_id = rng.choice(chore_ids) if chore_ids else 0
+        return client.post('/api/chore/%d/complete/' % chore_id, **self._auth(user))
+
+    def _report(self, elapsed):
+        total = sum(len(results) for results in self.results.values())
+        self.stdout.write('%d calls in %.2fs, %.1f calls/s' % (
+            total, elapsed, total / elapsed if elapsed else 0))
+        self.stdout.write('%-16s %7s %7s %9s %9s %9s %9s' % (
+            'operation', 'calls', 'errors', 'p50 ms', 'p95 ms', 'p99 ms', 'queries'))
+
+        rows = sorted(self.results.items())
+        rows.append(('all', [result for _, results in rows for result in results]))
+        for name, results in rows:
+            if not results:
+                continue
+            durations = sorted(duration * 1000 for duration, _, _ in results)
+            errors = sum(1 for _, status, _ in results if status >= 400)
+            queries = sum(count for _, _, count in results) / len(results)
+            self.stdout.write('%-16s %7d %7d %9.2f %9.2f %9.2f %9.1f' % (
+                name, len(results), errors, _percentile(durations, .5),
+                _percentile(durations, .95), _percentile(durations, .99), queries))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from tracker import sharding
+
+
+class Command(BaseCommand):
+    help = (
+        'Moves the household under a root space, with its subspaces, '
+        'chores, members and pending requests, to another shard. The '
+        'household should be quiet while it is moved'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('space', type=int, help='Id of the root space of the household')
+        parser.add_argument('shard', help='Database alias of the shard to move it to')
+
+    def handle(self, *args, **options):
+        if options['shard'] not in sharding.get_shards():
+            raise CommandError('"%s" is not one of TRACKER_SHARDS' % options['shard'])
+
+        try:
+            source, moved = sharding.move_household(options['space'], options['shard'])
+        except ValueError as error:
+            raise CommandError(str(error))
+
+        if not moved:
+            self.stdout.write('Household %d is already on %s' % (options['space'], source))
+            return
+        self.stdout.write('Moved household %d from %s to %s: %s' % (
+            options['space'], source, options['shard'],
+            ', '.join('%d %s' % (count, name) for name, count in moved.items())))
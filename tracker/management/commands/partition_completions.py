@@ -0,0 +1,35 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from tracker import partitions, sharding
+
+
+class Command(BaseCommand):
+    help = (
+        'Creates the monthly partitions of the chore completion log ahead '
+        'of time on every shard, and removes months that are no longer '
+        'kept. Meant to be run monthly'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ahead', type=int,
+            default=getattr(settings, 'TRACKER_COMPLETION_PARTITIONS_AHEAD', 3),
+            help='Months to create partitions for after the current one')
+        parser.add_argument('--drop-before', metavar='YYYY-MM',
+            help='Remove the completions made before this month')
+
+    def handle(self, *args, **options):
+        drop_before = None
+        if options['drop_before']:
+            try:
+                drop_before = datetime.datetime.strptime(options['drop_before'], '%Y-%m').date()
+            except ValueError:
+                raise CommandError('--drop-before must be a month, eg. 2024-01')
+
+        for shard in sharding.get_shards():
+            partitions.create_partitions(shard, options['ahead'])
+            if drop_before is not None:
+                removed = partitions.drop_before(shard, drop_before)
+                self.stdout.write('Removed %d completions from %s' % (removed, shard))
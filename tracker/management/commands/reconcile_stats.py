@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from tracker import sharding, stats
+from tracker.models import Space
+
+
+class Command(BaseCommand):
+    help = (
+        'Recounts the fairness stats of every household from their chores, '
+        'correcting whatever the incremental updates missed. Meant to be '
+        'run periodically'
+    )
+
+    def handle(self, *args, **options):
+        count = 0
+        for shard in sharding.get_shards():
+            with sharding.using_shard(shard):
+                for root in Space.objects.filter(parent=None).only('id').iterator():
+                    stats.reconcile(root)
+                    count += 1
+
+        self.stdout.write('Reconciled %d households' % count)
@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from tracker import sharding, tasks
+
+
+class Command(BaseCommand):
+    help = (
+        'Runs the background tasks queued on every shard by the database '
+        'task backend, polling for new ones until stopped. Any number of '
+        'workers may run side by side on Postgres'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+            help='Run the tasks that are due and exit')
+        parser.add_argument('--batch', type=int, default=100,
+            help='Tasks to run from one shard before moving on to the next')
+        parser.add_argument('--sleep', type=float, default=1,
+            help='Seconds to wait before polling again once no tasks are due')
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            ran = 0
+            for shard in sharding.get_shards():
+                with sharding.using_shard(shard):
+                    ran += tasks.run_due(options['batch'])
+            total += ran
+
+            if options['once'] and not ran:
+                break
+            if not ran:
+                # Don't hold connections open while idle
+                connections.close_all()
+                time.sleep(options['sleep'])
+
+        self.stdout.write('Ran %d tasks' % total)
@@ -0,0 +1,127 @@
+import datetime
+import random
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+
+from tracker.models import User, Space, Chore, Request, UserSpace, UserChore
+
+
+class Command(BaseCommand):
+    help = (
+        'Seeds the database with a synthetic dataset of households, each a '
+        'tree of spaces with chores, rosters and pending requests, for load '
+        'testing. Rows are written with bulk inserts'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--households', type=int, default=50,
+            help='Number of root spaces. Users are split evenly between them')
+        parser.add_argument('--depth', type=int, default=2,
+            help='Levels of subspaces under each root space')
+        parser.add_argument('--fanout', type=int, default=3,
+            help='Subspaces under each space')
+        parser.add_argument('--chores', type=int, default=5,
+            help='Chores in each space')
+        parser.add_argument('--requests', type=int, default=2,
+            help='Pending requests sent from each household')
+        parser.add_argument('--prefix', default='loadtest',
+            help='Prefix of the seeded users\' email addresses')
+        parser.add_argument('--password', default='loadtest-password')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        batch_size = options['batch_size']
+
+        with transaction.atomic():
+            users = self._seed_users(options)
+            households = [
+                users[i::options['households']] for i in range(options['households'])
+            ]
+
+            spaces, userspaces, chores, userchores, requests = [], [], [], [], []
+            next_space_id = self._next_id(Space)
+            next_chore_id = self._next_id(Chore)
+            today = datetime.date.today()
+
+            for h, members in enumerate(households):
+                if not members:
+                    continue
+
+                # Build the household's tree level by level, assigning 
+                # ids up front so that children can refer to parents 
+                # before anything is written
+                level = [Space(id=next_space_id, name='%s household %d' % (options['prefix'], h))]
+                next_space_id += 1
+                tree = list(level)
+                for depth in range(options['depth']):
+                    children = []
+                    for parent in level:
+                        for f in range(options['fanout']):
+                            children.append(Space(
+                                id=next_space_id, parent_id=parent.id,
+                                name='%s space %d.%d' % (options['prefix'], depth + 1, f)))
+                            next_space_id += 1
+                    tree.extend(children)
+                    level = children
+
+                for space in tree:
+                    spaces.append(space)
+                    userspaces.extend(UserSpace(space_id=space.id, user_id=member.id) for member in members)
+
+                    for c in range(options['chores']):
+                        interval = rng.choice([1, 1, 2, 3, 7, 14, 30])
+                        chores.append(Chore(
+                            id=next_chore_id, name='%s chore %d' % (options['prefix'], c),
+                            parent_space_id=space.id, interval=interval,
+                            next_date=today + datetime.timedelta(days=rng.randint(0, interval)),
+                            next_user_id=rng.choice(members).id))
+                        userchores.extend(
+                            UserChore(chore_id=next_chore_id, user_id=member.id,
+                                      vwork=rng.randint(0, 5), work=0)
+                            for member in members)
+                        next_chore_id += 1
+
+                outsiders = [user for user in users if user not in members]
+                for r in range(min(options['requests'], len(outsiders))):
+                    requests.append(Request(
+                        from_user_id=members[0].id, 
+                        to_user_id=rng.choice(outsiders).id,
+                        space_id=tree[0].id))
+
+            Space.objects.bulk_create(spaces, batch_size=batch_size)
+            UserSpace.objects.bulk_create(userspaces, batch_size=batch_size)
+            Chore.objects.bulk_create(chores, batch_size=batch_size)
+            UserChore.objects.bulk_create(userchores, batch_size=batch_size)
+            Request.objects.bulk_create(requests, batch_size=batch_size)
+
+            # Explicitly assigned ids leave sequences behind on databases
+            # which have them
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(no_style(), [User, Space, Chore]):
+                    cursor.execute(sql)
+
+        self.stdout.write(self.style.SUCCESS(
+            'Seeded %d users, %d spaces, %d chores, %d roster entries and %d requests' % (
+                len(users), len(spaces), len(chores), len(userchores), len(requests))))
+
+    def _next_id(self, model):
+        return (model.objects.aggregate(largest=Max('pk'))['largest'] or 0) + 1
+
+    def _seed_users(self, options):
+        # Every seeded user shares one password, so it is hashed once
+        password = make_password(options['password'])
+        next_id = self._next_id(User)
+        users = [
+            User(id=next_id + i, email='%s-user%d-%d@example.com' % (options['prefix'], next_id + i, i),
+                 password=password)
+            for i in range(options['users'])
+        ]
+        User.objects.bulk_create(users, batch_size=options['batch_size'])
+        return users
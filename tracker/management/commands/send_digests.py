@@ -0,0 +1,32 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from tracker import digests
+
+
+class Command(BaseCommand):
+    help = (
+        'Emails every user the chores they are next up for today and '
+        'tomorrow. Users are sent at most one digest a day, so the command '
+        'can be rerun safely. Meant to be run daily'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', metavar='YYYY-MM-DD',
+            help='Day to send the digests of, by default today')
+        parser.add_argument('--batch-size', type=int,
+            default=getattr(settings, 'TRACKER_DIGEST_BATCH_SIZE', 100),
+            help='Digests to send in each batch')
+
+    def handle(self, *args, **options):
+        today = None
+        if options['date']:
+            try:
+                today = datetime.datetime.strptime(options['date'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('--date must be a day, eg. 2024-01-31')
+
+        sent = digests.send_digests(today, options['batch_size'])
+        self.stdout.write('Sent %d digests' % sent)
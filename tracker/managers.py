@@ -1,4 +1,5 @@
 from django.contrib.auth.base_user import BaseUserManager 
+from django.db import models
 
 
 class CustomUserManager(BaseUserManager):
@@ -28,3 +29,91 @@ class CustomUserManager(BaseUserManager):
             raise ValueError('Superuser must have is_superuser=True.')
         
         return self.create_user(email, password, **extra_fields)
+
+
+class SpaceManager(models.Manager):
+    def accessible_ids(self, user):
+        """
+        Return the set of ids of spaces user is a member of, along with 
+        the ids of every space in the subtrees under them. 
+
+        The tree is walked with a single recursive query rather than one
+        query per level
+        """
+        if user is None or user.pk is None:
+            return set()
+
+        userspace_table = self.model._meta.get_field('userspaces').related_model._meta.db_table
+        return self._walk_down(
+            'SELECT space_id FROM {} WHERE user_id = %s'.format(userspace_table), 
+            [user.pk])
+
+    def subtree_ids(self, space):
+        """
+        Return the set of ids of space and of every space in the subtree
+        under it, walked with a single recursive query
+        """
+        space_table = self.model._meta.db_table
+        return self._walk_down(
+            'SELECT id FROM {} WHERE id = %s'.format(space_table), 
+            [space.pk])
+
+    def subtrees(self, space_ids):
+        """
+        Return a dictionary mapping each id in space_ids to the set of 
+        ids of the spaces in its subtree, walked with a single recursive
+        query
+        """
+        space_ids = list(space_ids)
+        if not space_ids:
+            return {}
+
+        space_table = self.model._meta.db_table
+        query = (
+            'WITH RECURSIVE subtree(root, id) AS ('
+            ' SELECT id, id FROM {space} WHERE id IN ({placeholders})'
+            ' UNION'
+            ' SELECT t.root, s.id FROM {space} s INNER JOIN subtree t ON s.parent_id = t.id'
+            ') SELECT root, id FROM subtree'
+        ).format(space=space_table, placeholders=', '.join(['%s'] * len(space_ids)))
+
+        subtrees = {}
+        for space in self.raw(query, space_ids):
+            subtrees.setdefault(space.root, set()).add(space.pk)
+        return subtrees
+
+    def ancestor_ids(self, space_ids):
+        """
+        Return the set of the ids in space_ids and of every space above 
+        them, walked with a single recursive query
+        """
+        space_ids = list(space_ids)
+        if not space_ids:
+            return set()
+
+        space_table = self.model._meta.db_table
+        query = (
+            'WITH RECURSIVE ancestors(id, parent_id) AS ('
+            ' SELECT id, parent_id FROM {space} WHERE id IN ({placeholders})'
+            ' UNION'
+            ' SELECT s.id, s.parent_id FROM {space} s INNER JOIN ancestors a ON s.id = a.parent_id'
+            ') SELECT id FROM ancestors'
+        ).format(space=space_table, placeholders=', '.join(['%s'] * len(space_ids)))
+
+        return {space.pk for space in self.raw(query, space_ids)}
+
+    def _walk_down(self, roots, params):
+        """
+        Return the ids of the spaces selected by the query roots, along
+        with the ids of all of their descendants
+        """
+        space_table = self.model._meta.db_table
+        query = (
+            'WITH RECURSIVE subtree(id) AS ('
+            ' {roots}'
+            ' UNION'
+            ' SELECT s.id FROM {space} s INNER JOIN subtree t ON s.parent_id = t.id'
+            ') SELECT id FROM subtree'
+        ).format(roots=roots, space=space_table)
+
+        return {space.pk for space in self.raw(query, params)}
@@ -0,0 +1,172 @@
+"""
+In-process metrics, exposed in the Prometheus text format at /metrics.
+
+Every thread records into its own shard of each metric, so recording 
+never waits on a lock. Shards are only summed up when the metrics are
+scraped.
+"""
+import threading
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('%s="%s"' % (name, _escape(value)) for name, value in labels) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def render(self):
+        """
+        Returns every registered metric in the Prometheus text format
+        """
+        lines = []
+        for metric in list(self._metrics):
+            lines.append('# HELP %s %s' % (metric.name, metric.documentation))
+            lines.append('# TYPE %s %s' % (metric.name, metric.type))
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _shard(self):
+        """
+        Returns this thread's shard, a dictionary of label values to the
+        values recorded under them
+        """
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _collect(self):
+        """
+        Returns a list of each set of label values with the values 
+        recorded under it in every shard
+        """
+        with self._lock:
+            shards = list(self._shards)
+
+        collected = {}
+        for shard in shards:
+            # Copying is atomic, while iterating over a dictionary 
+            # another thread is writing to is not
+            for key, value in shard.copy().items():
+                collected.setdefault(key, []).append(value)
+        return sorted(collected.items())
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        shard = self._shard()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def render(self):
+        for key, values in self._collect():
+            labels = _format_labels(zip(self.labelnames, key))
+            yield '%s%s %s' % (self.name, labels, _format_value(sum(values)))
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=(), **kwargs):
+        super().__init__(name, documentation, labelnames, **kwargs)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        shard = self._shard()
+        key = self._key(labels)
+
+        # Counts of each bucket, followed by the sum of observations
+        counts = shard.get(key)
+        if counts is None:
+            counts = shard[key] = [0] * len(self.buckets) + [0]
+
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        counts[-1] += value
+
+    def render(self):
+        for key, values in self._collect():
+            label_pairs = list(zip(self.labelnames, key))
+            cumulative = 0
+            for i, bound in enumerate(self.buckets):
+                cumulative += sum(counts[i] for counts in values)
+                labels = _format_labels(label_pairs + [('le', _format_value(bound))])
+                yield '%s_bucket%s %d' % (self.name, labels, cumulative)
+
+            labels = _format_labels(label_pairs)
+            yield '%s_sum%s %s' % (self.name, labels, _format_value(sum(counts[-1] for counts in values)))
+            yield '%s_count%s %d' % (self.name, labels, cumulative)
+
+
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000)
+
+REQUEST_LATENCY = Histogram(
+    'tracker_request_duration_seconds', 'Time taken to respond to requests.',
+    ['view'], LATENCY_BUCKETS)
+REQUESTS = Counter(
+    'tracker_requests_total', 'Requests served.',
+    ['view', 'method', 'status'])
+REQUEST_QUERIES = Histogram(
+    'tracker_request_queries', 'Database queries issued per request.',
+    ['view'], QUERY_BUCKETS)
+REQUEST_QUERY_TIME = Histogram(
+    'tracker_request_query_duration_seconds', 'Time spent in database queries per request.',
+    ['view'], LATENCY_BUCKETS)
+RESPONSE_SIZE = Histogram(
+    'tracker_response_size_bytes', 'Size of response bodies.',
+    ['view'], SIZE_BUCKETS)
+SCHEDULER_CALLS = Counter(
+    'tracker_scheduler_calls_total', 'Calls made to the chore scheduler.',
+    ['function'])
+TASKS = Counter(
+    'tracker_tasks_total', 'Background tasks run.',
+    ['task', 'outcome'])
+TASK_LATENCY = Histogram(
+    'tracker_task_duration_seconds', 'Time taken to run background tasks.',
+    ['task'], LATENCY_BUCKETS)
@@ -0,0 +1,185 @@
+import cProfile
+import hmac
+import os
+import random
+import re
+import time
+from contextlib import ExitStack
+from datetime import datetime
+
+from django.conf import settings
+from django.db import connections
+from rest_framework import exceptions
+from rest_framework.authentication import get_authorization_header
+from rest_framework.permissions import SAFE_METHODS
+
+from tracker import db, metrics, sharding
+from tracker.backends import JWTAuthentication, decode_token
+from tracker.querylog import QueryLog
+
+
+class MetricsMiddleware:
+    """
+    Records the latency, database queries, response size and status of 
+    every request, labelled with the name of the view it resolved to
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = {'count': 0, 'time': 0.0}
+
+        def count_query(execute, sql, params, many, context):
+            start = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                queries['count'] += 1
+                queries['time'] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(count_query))
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else '<unresolved>'
+
+        metrics.REQUEST_LATENCY.observe(duration, view=view)
+        metrics.REQUESTS.inc(view=view, method=request.method, status=response.status_code)
+        metrics.REQUEST_QUERIES.observe(queries['count'], view=view)
+        metrics.REQUEST_QUERY_TIME.observe(queries['time'], view=view)
+        if not response.streaming:
+            metrics.RESPONSE_SIZE.observe(len(response.content), view=view)
+
+        return response
+
+
+class QueryLogMiddleware:
+    """
+    Logs the slow and repeated statements issued by each request, see 
+    tracker.querylog
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with QueryLog() as query_log:
+            response = self.get_response(request)
+
+            match = getattr(request, 'resolver_match', None)
+            query_log.label = match.view_name if match else request.path
+
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    Profiles requests with cProfile when they carry the profiling secret
+    in the 'X-Profile' header or the 'profile' query parameter, or when 
+    they are picked by sampling. Each profile is written as a pstats 
+    file, named after the time, the view and the time taken, to 
+    TRACKER_PROFILING_DIR.
+
+    Requests profiled on demand are told where their profile was written
+    in the 'X-Profile-File' header
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        requested = self._is_requested(request)
+        sample_rate = getattr(settings, 'TRACKER_PROFILING_SAMPLE_RATE', 0)
+        if not requested and not (sample_rate and random.random() < sample_rate):
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.disable()
+        duration = time.perf_counter() - start
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unresolved'
+        path = self._write_profile(profiler, view, duration)
+
+        if requested:
+            response['X-Profile-File'] = os.path.basename(path)
+        return response
+
+    def _is_requested(self, request):
+        secret = getattr(settings, 'TRACKER_PROFILING_SECRET', None)
+        if not secret:
+            return False
+
+        given = request.META.get('HTTP_X_PROFILE') or request.GET.get('profile')
+        return bool(given) and hmac.compare_digest(given.encode('utf-8'), secret.encode('utf-8'))
+
+    def _write_profile(self, profiler, view, duration):
+        directory = getattr(settings, 'TRACKER_PROFILING_DIR', 
+                            os.path.join(settings.BASE_DIR, 'profiles'))
+        os.makedirs(directory, exist_ok=True)
+
+        name = '%s-%s-%dms.prof' % (
+            datetime.now().strftime('%Y%m%dT%H%M%S%f'),
+            re.sub(r'[^A-Za-z0-9_.-]', '_', view),
+            duration * 1000)
+        path = os.path.join(directory, name)
+        profiler.dump_stats(path)
+        return path
+
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Lets safe requests read from replicas, unless their user has written
+    within the last TRACKER_REPLICA_STICKY_SECONDS. Successful unsafe 
+    requests pin their user to the primary for that long, see tracker.db
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        user_id = self._get_user_id(request)
+        safe = request.method in SAFE_METHODS
+
+        with db.replica_reads(safe and not db.is_pinned(user_id)):
+            response = self.get_response(request)
+
+        if not safe and user_id is not None and response.status_code < 400:
+            db.pin_to_primary(user_id)
+        return response
+
+    def _get_user_id(self, request):
+        """
+        Returns the id of the user the request's token was issued to, 
+        without a query. Authentication proper is left to the view
+        """
+        header = get_authorization_header(request).split()
+        if len(header) != 2 or header[0].decode('utf-8').lower() != \
+                JWTAuthentication.authentication_header_prefix.lower():
+            return None
+
+        try:
+            return decode_token(header[1].decode('utf-8')).get('id')
+        except (exceptions.AuthenticationFailed, UnicodeDecodeError):
+            return None
+
+
+class ShardRoutingMiddleware:
+    """
+    Gives each request its own shard context, starting on the default
+    shard, for views to activate the shard they act on in. See 
+    tracker.sharding
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with sharding.using_shard(None):
+            return self.get_response(request)
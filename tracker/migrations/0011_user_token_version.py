@@ -0,0 +1,23 @@
+# Generated by Django 3.1.14 on 2026-10-19 17:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0010_changelog'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='token_issued_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='token_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
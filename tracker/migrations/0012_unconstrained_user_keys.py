@@ -0,0 +1,45 @@
+# Generated by Django 3.1.14 on 2026-10-19 17:41
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0011_user_token_version'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='chore',
+            name='last_user',
+            field=models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='recently_completed_chores', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='chore',
+            name='next_user',
+            field=models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='upcoming_chores', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='request',
+            name='from_user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='sent_requests', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='request',
+            name='to_user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='received_requests', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='userchore',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='userspace',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='userspaces', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 3.1.14 on 2026-10-19 18:02
+
+from django.db import migrations, models
+
+
+def create_table(apps, schema_editor):
+    """
+    Partition completions by month on Postgres. The primary key must 
+    include the partition key there, though ids stay unique on their own
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        schema_editor.create_model(apps.get_model('tracker', 'ChoreCompletion'))
+        return
+
+    schema_editor.execute(
+        'CREATE TABLE "tracker_chorecompletion" ('
+        '"id" serial NOT NULL, '
+        '"chore_id" integer NOT NULL, '
+        '"space_id" integer NOT NULL, '
+        '"user_id" integer NOT NULL, '
+        '"completed_on" date NOT NULL, '
+        '"vdelta" double precision NOT NULL, '
+        'PRIMARY KEY ("id", "completed_on")'
+        ') PARTITION BY RANGE ("completed_on")')
+    schema_editor.execute(
+        'CREATE TABLE "tracker_chorecompletion_default" '
+        'PARTITION OF "tracker_chorecompletion" DEFAULT')
+    schema_editor.execute(
+        'CREATE INDEX "tracker_cho_user_id_521330_idx" '
+        'ON "tracker_chorecompletion" ("user_id", "completed_on")')
+    schema_editor.execute(
+        'CREATE INDEX "tracker_cho_space_i_8c2315_idx" '
+        'ON "tracker_chorecompletion" ("space_id", "completed_on")')
+
+
+def drop_table(apps, schema_editor):
+    schema_editor.delete_model(apps.get_model('tracker', 'ChoreCompletion'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0013_task'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(state_operations=[
+            migrations.CreateModel(
+                name='ChoreCompletion',
+                fields=[
+                    ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                    ('chore_id', models.IntegerField()),
+                    ('space_id', models.IntegerField()),
+                    ('user_id', models.IntegerField()),
+                    ('completed_on', models.DateField()),
+                    ('vdelta', models.FloatField()),
+                ],
+                options={
+                    'indexes': [
+                        models.Index(fields=['user_id', 'completed_on'], name='tracker_cho_user_id_521330_idx'),
+                        models.Index(fields=['space_id', 'completed_on'], name='tracker_cho_space_i_8c2315_idx'),
+                    ],
+                },
+            ),
+        ]),
+        migrations.RunPython(create_table, drop_table),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.1.14 on 2026-10-19 17:59
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0014_chorecompletion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MemberStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chores', models.PositiveIntegerField(default=0)),
+                ('completions', models.PositiveIntegerField(default=0)),
+                ('vwork', models.FloatField(default=0)),
+                ('weight', models.FloatField(default=0)),
+                ('space', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='member_stats', to='tracker.space')),
+                ('user', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='memberstats',
+            constraint=models.UniqueConstraint(fields=('space', 'user'), name='tracker_memberstats_space_user'),
+        ),
+    ]
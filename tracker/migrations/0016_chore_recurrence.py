@@ -0,0 +1,18 @@
+# Generated by Django 3.1.14 on 2026-10-19 18:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0015_memberstats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chore',
+            name='recurrence',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
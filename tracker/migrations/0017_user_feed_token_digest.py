@@ -0,0 +1,18 @@
+# Generated by Django 3.1.14 on 2026-10-19 18:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0016_chore_recurrence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='feed_token_digest',
+            field=models.CharField(max_length=64, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.1.14 on 2026-10-19 18:15
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0017_user_feed_token_digest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DigestDelivery',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('sent_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='digestdelivery',
+            constraint=models.UniqueConstraint(fields=('user', 'date'), name='tracker_digestdelivery_user_date'),
+        ),
+    ]
@@ -0,0 +1,109 @@
+# Generated by Django 3.1.14 on 2026-10-19 19:40
+
+from django.db import migrations, models
+
+
+def widen_completions(apps, schema_editor):
+    """
+    Completions are partitioned on Postgres, and their table was made by
+    hand, as was its sequence. SQLite's integers are 64 bit already
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    schema_editor.execute(
+        'ALTER TABLE "tracker_chorecompletion" '
+        'ALTER COLUMN "id" TYPE bigint, '
+        'ALTER COLUMN "chore_id" TYPE bigint, '
+        'ALTER COLUMN "space_id" TYPE bigint, '
+        'ALTER COLUMN "user_id" TYPE bigint')
+    schema_editor.execute(
+        'ALTER SEQUENCE "tracker_chorecompletion_id_seq" AS bigint')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0018_digestdelivery'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='space',
+            name='id',
+            field=models.BigAutoField(primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='chore',
+            name='id',
+            field=models.BigAutoField(primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='request',
+            name='id',
+            field=models.BigAutoField(primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='userchore',
+            name='id',
+            field=models.BigAutoField(primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='userspace',
+            name='id',
+            field=models.BigAutoField(primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='changelog',
+            name='id',
+            field=models.BigAutoField(primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='changelog',
+            name='object_id',
+            field=models.BigIntegerField(),
+        ),
+        migrations.AlterField(
+            model_name='changelog',
+            name='space_id',
+            field=models.BigIntegerField(db_index=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='changelog',
+            name='user_id',
+            field=models.BigIntegerField(db_index=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='memberstats',
+            name='id',
+            field=models.BigAutoField(primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='task',
+            name='id',
+            field=models.BigAutoField(primary_key=True, serialize=False),
+        ),
+        migrations.SeparateDatabaseAndState(state_operations=[
+            migrations.AlterField(
+                model_name='chorecompletion',
+                name='id',
+                field=models.BigAutoField(primary_key=True, serialize=False),
+            ),
+            migrations.AlterField(
+                model_name='chorecompletion',
+                name='chore_id',
+                field=models.BigIntegerField(),
+            ),
+            migrations.AlterField(
+                model_name='chorecompletion',
+                name='space_id',
+                field=models.BigIntegerField(),
+            ),
+            migrations.AlterField(
+                model_name='chorecompletion',
+                name='user_id',
+                field=models.BigIntegerField(),
+            ),
+        ]),
+        migrations.RunPython(widen_completions, migrations.RunPython.noop),
+    ]
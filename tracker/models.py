@@ -1,15 +1,73 @@
 import jwt
 import datetime 
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
 
 from django.conf import settings
-from django.db import models
+from django.db import models, router, transaction
+from django.utils import timezone
 from django.contrib.auth.models import AbstractUser, PermissionsMixin
-from django.db.models.signals import pre_delete 
-from django.dispatch import receiver 
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import Greatest
+from django.db.models.signals import pre_delete, post_save, post_delete, m2m_changed
+from django.dispatch import receiver, Signal
 
-from common.util.simplecfs import _next_user_get, _order_project
+from common.util.lrucache import LRUCache
+from common.util.recurrence import parse as parse_recurrence
+from common.util.simplecfs import _interval_offsets, _next_user_get, _order_project
 
-from tracker.managers import CustomUserManager
+from tracker import sharding
+from tracker.hashers import hash_password, verify_password
+from tracker.managers import CustomUserManager, SpaceManager
+from tracker.metrics import SCHEDULER_CALLS
+
+
+# Tokens already signed in this process, keyed by everything that goes
+# into them
+_token_cache = LRUCache(max_size=getattr(settings, 'TRACKER_AUTH_CACHE_SIZE', 1024))
+
+# Sent with the list of chores whose schedules Chore.reschedule updated
+# in bulk, in place of the post_save that bulk updates don't send
+chores_rescheduled = Signal()
+
+# Sent with the chores Chore.assign_users and Chore.create_bulk assigned
+# users to in bulk, and the ids of the users, each assigned to some of 
+# the chores at least, in place of the m2m_changed bulk creates don't
+# send
+users_assigned = Signal()
+
+# Sent with the requests Request.invite created in bulk, in place of the
+# post_save bulk creates don't send
+requests_created = Signal()
+
+# Deletions under way in this thread, innermost last, see 
+# _logging_deletions
+_deletions = threading.local()
+
+
+class _LoggedDeletionQuerySet(models.QuerySet):
+    def delete(self):
+        with _logging_deletions(self.db):
+            return super().delete()
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+
+class _LoggedDeletionModel(models.Model):
+    """
+    Models whose deletions are logged for syncing clients. Deleting 
+    them, and the rows deleted along with them, logs the rows in bulk
+    """
+    objects = _LoggedDeletionQuerySet.as_manager()
+
+    class Meta:
+        abstract = True
+
+    def delete(self, using=None, keep_parents=False):
+        with _logging_deletions(using or router.db_for_write(type(self), instance=self)):
+            return super().delete(using=using, keep_parents=keep_parents)
 
 
 class User(AbstractUser, PermissionsMixin):
@@ -25,19 +83,107 @@ class User(AbstractUser, PermissionsMixin):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Tokens carry the version they were issued under, and are refused
+    # once it has been bumped. token_issued_at is when the token 
+    # currently handed out was issued
+    token_version = models.PositiveIntegerField(default=0)
+    token_issued_at = models.DateTimeField(null=True)
+
+    # Digest of the token in the URL of the user's calendar feed, which
+    # tracker.feeds issues and revokes
+    feed_token_digest = models.CharField(max_length=64, null=True, unique=True)
+
     objects = CustomUserManager()
     def __str__(self):
         return self.email
     
     @property 
     def token(self):
-        return self._generate_jwt_token() 
+        """
+        The access token currently issued to this user, or None if there
+        is none or it has expired. Reading it never issues one, so that 
+        serializing users writes nothing, see issue_token
+        """
+        lifetime = getattr(settings, 'TRACKER_TOKEN_LIFETIME', datetime.timedelta(minutes=15))
+        if self.token_issued_at is None or self.token_issued_at + lifetime <= timezone.now():
+            return None
+        return self._get_jwt_token()
+
+    @property
+    def refresh_token(self):
+        """
+        A long lived token which can only be exchanged for access 
+        tokens. Refresh tokens are signed afresh each time, and should 
+        only be asked for when logging in
+        """
+        lifetime = getattr(settings, 'TRACKER_REFRESH_TOKEN_LIFETIME', datetime.timedelta(days=60))
+        issued_at = int(timezone.now().timestamp())
+        return self._generate_jwt_token(
+            issued_at, issued_at + int(lifetime.total_seconds()), token_type='refresh')
+
+    def set_password(self, raw_password):
+        self.password = hash_password(raw_password)
+        self._password = raw_password
+
+    def check_password(self, raw_password):
+        """
+        Return a boolean of whether the raw_password was correct. The 
+        hash is checked on the password hashing pool, and upgraded here
+        if need be
+        """
+        matches, must_update = verify_password(raw_password, self.password)
+        if matches and must_update:
+            self.set_password(raw_password)
+            # Password hash upgrades shouldn't be considered password changes.
+            self._password = None
+            self.save(update_fields=['password'])
+        return matches
+
+    def revoke_tokens(self):
+        """
+        Invalidate every token issued to this user so far
+        """
+        self.token_version += 1
+        self.token_issued_at = None
+        self.save(update_fields=['token_version', 'token_issued_at'])
     
-    def _generate_jwt_token(self):
-        dt = datetime.datetime.now() + datetime.timedelta(days=60)
+    def issue_token(self):
+        """
+        Returns the token currently issued to this user, issuing a new one
+        only if there is none or it is about to expire. Logging in and 
+        refreshing issue tokens, reads of the user only see them
+        """
+        lifetime = getattr(settings, 'TRACKER_TOKEN_LIFETIME', datetime.timedelta(minutes=15))
+        renew_before = getattr(settings, 'TRACKER_TOKEN_RENEW_BEFORE', datetime.timedelta(minutes=5))
+
+        now = timezone.now()
+        if self.token_issued_at is None or self.token_issued_at + lifetime - renew_before <= now:
+            self.token_issued_at = now.replace(microsecond=0)
+            self.save(update_fields=['token_issued_at'])
+        return self._get_jwt_token()
+
+    def _get_jwt_token(self):
+        """
+        Returns the token for the stored issue time and version. Tokens
+        are derived from these, so a token that was already signed in 
+        this process is returned from cache
+        """
+        lifetime = getattr(settings, 'TRACKER_TOKEN_LIFETIME', datetime.timedelta(minutes=15))
+        issued_at = int(self.token_issued_at.timestamp())
+        key = (self.pk, self.token_version, issued_at)
+        token = _token_cache.get(key)
+        if token is None:
+            token = self._generate_jwt_token(issued_at, issued_at + int(lifetime.total_seconds()))
+            _token_cache.set(key, token)
+        return token
+
+    def _generate_jwt_token(self, issued_at, expires_at, token_type='access'):
         token = jwt.encode({
             'id': self.pk,
-            'exp': int(dt.timestamp())
+            'ver': self.token_version,
+            'typ': token_type,
+            'iat': issued_at,
+            'exp': expires_at,
         }, settings.SECRET_KEY, algorithm='HS256')
 
         return token.decode('utf-8')
@@ -51,7 +197,8 @@ class User(AbstractUser, PermissionsMixin):
         It is a projection of the roster 
         """
         date_wise = {}
-        chores = self.chores.all()
+        chores = sharding.collect_from_shards(lambda: list(
+            Chore.objects.filter(users=self).prefetch_related('userchore_set')))
         today = datetime.datetime.today()
 
         # Get calendars for each individual chore associated with this user
@@ -72,7 +219,11 @@ class User(AbstractUser, PermissionsMixin):
         return date_wise
     
 
-class Space(models.Model):
+class Space(_LoggedDeletionModel):
+    # Sharded models have 64 bit ids, as each shard past the first draws
+    # them from a range starting past 32 bits, see 
+    # sharding.reserve_id_range
+    id = models.BigAutoField(primary_key=True)
     name = models.CharField(max_length=50)
     members = models.ManyToManyField(User, related_name='spaces', through='UserSpace')
     parent = models.ForeignKey(
@@ -80,6 +231,8 @@ class Space(models.Model):
         null=True, 
         related_name='child',
         on_delete=models.CASCADE)
+
+    objects = SpaceManager.from_queryset(_LoggedDeletionQuerySet)()
     
     @property
     def full_name (self):
@@ -94,41 +247,47 @@ class Space(models.Model):
         when a new space is added
         """
         if(self.parent):
-            for member in self.parent.members.all():
-                self.members.add(member)
+            self.members.add(*self.parent.userspaces.values_list('user_id', flat=True))
 
+    @sharding.on_instance_shard
     def add_member(self, member):
         """
         Used to add user to this space and all its subspaces
         """
-        self.members.add(member) 
-        for child in self.child.all():
-            child.initialize_member(member)
+        member.spaces.add(*Space.objects.subtree_ids(self))
 
+    @sharding.on_instance_shard
     def assign_members_to_chores(self):
-        for member in self.members.all():
-            self.assign_member_to_chores(member)
+        Chore.assign_users(self._subtree_chores(), self.userspaces.values_list('user_id', flat=True))
 
+    @sharding.on_instance_shard
     def assign_member_to_chores(self, member):
         """
         Assign new members to all the chores in this space, including
         chores in subspaces 
         """
-        for chore in self.chores.all():
-            chore.users.add(member)
-            chore.get_next_user()
-        
-        for child in self.child.all():
-            child.assign_member_to_chores(member)
+        Chore.assign_users(self._subtree_chores(), [member.pk])
 
     def mark_available(self, user):
-        self.userspace_set.get(user=user).mark_available()
+        self._mark_availability(user, True)
 
     def mark_unavailable(self, user):
-        self.userspace_set.get(user=user).mark_unavailable()
+        self._mark_availability(user, False)
+
+    @sharding.on_instance_shard
+    def _mark_availability(self, user, available):
+        userspace = self.userspaces.get(user=user)
+        if available:
+            userspace.mark_available()
+        else:
+            userspace.mark_unavailable()
+
+    def _subtree_chores(self):
+        return Chore.objects.filter(parent_space_id__in=Space.objects.subtree_ids(self))
 
 
-class Chore(models.Model):
+class Chore(_LoggedDeletionModel):
+    id = models.BigAutoField(primary_key=True)
     name = models.CharField(max_length=200)
     parent_space = models.ForeignKey(
         Space,
@@ -145,13 +304,31 @@ class Chore(models.Model):
     # repeated
     interval = models.PositiveIntegerField(default=1)
 
+    # A recurrence rule, as read by common.util.recurrence, that the 
+    # chore repeats by instead of interval, eg. on Mondays and Thursdays
+    recurrence = models.TextField(blank=True, default='')
+
     # The next date that the chore must be performed, and 
     # the last date the chore was performed
     next_date = models.DateField(default=datetime.date.today() + datetime.timedelta(days=1))
     last_date = models.DateField(null=True)
 
-    next_user = models.ForeignKey(User, null=True, related_name='upcoming_chores', on_delete=models.SET_NULL)
-    last_user = models.ForeignKey(User, null=True, related_name='recently_completed_chores', on_delete=models.SET_NULL)
+    # Users are global while chores are sharded, so the database can't 
+    # enforce references to users. The same goes for the other sharded
+    # models
+    next_user = models.ForeignKey(User, null=True, related_name='upcoming_chores', on_delete=models.SET_NULL, db_constraint=False)
+    last_user = models.ForeignKey(User, null=True, related_name='recently_completed_chores', on_delete=models.SET_NULL, db_constraint=False)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+
+        # Remember the schedule as loaded, so that saves can tell 
+        # whether it has changed
+        instance._loaded_schedule = (
+            instance.__dict__.get('next_user_id'),
+            instance.__dict__.get('next_date'))
+        return instance
 
     def schedule_chore(self, date): 
         """
@@ -164,10 +341,31 @@ class Chore(models.Model):
             self.min_vwork = self.userchore_set.filter(available=True).get(user=self.next_user).vwork
             self.save()
 
+    def occurrences(self, start):
+        """
+        Yields the dates from start onwards that the chore occurs on, 
+        by its recurrence rule or else every interval days from start
+        """
+        if self.recurrence:
+            return parse_recurrence(self.recurrence).occurrences(start)
+        return (start + datetime.timedelta(days=offset) 
+                for offset in _interval_offsets(self.interval, 0))
+
+    def next_occurrence(self, date):
+        """
+        Returns the first date after date that the chore occurs on, or 
+        None once its recurrence rule has ended, as occurrences yields 
+        nothing more for it
+        """
+        if self.recurrence:
+            return next(self.occurrences(date + datetime.timedelta(days=1)), None)
+        return date + datetime.timedelta(days=self.interval)
+
     def get_next_user(self, consecutive_chores=False):
         """ 
         Uses _next_user_get to retrieve next user to be scheduled on a chore.
         """
+        SCHEDULER_CALLS.inc(function='get_next_user')
         vworks = self._generate_vworks(2)
         if(consecutive_chores):
             next_user_id = _next_user_get(vworks)
@@ -176,7 +374,7 @@ class Chore(models.Model):
         
         if(next_user_id != None):
             try:
-                self.next_user = self.users.get(pk=next_user_id)
+                self.next_user_id = next_user_id
                 self.save()
                 return
 
@@ -185,6 +383,160 @@ class Chore(models.Model):
                 self.save()
                 return
 
+    @classmethod
+    def assign_users(cls, chores, user_ids):
+        """
+        Assigns the users with ids user_ids to chores in bulk, starting 
+        each of them at the chore's min_vwork, and then reschedules the 
+        chores. Users already assigned to a chore are left as they are
+        """
+        chores = {chore.pk: chore for chore in chores}
+        user_ids = list(user_ids)
+        assigned = set(UserChore.objects
+            .filter(chore__in=chores.keys(), user__in=user_ids)
+            .values_list('chore_id', 'user_id'))
+
+        userchores = [
+            UserChore(chore=chore, user_id=user_id, vwork=chore.min_vwork)
+            for chore in chores.values() for user_id in user_ids
+            if (chore.pk, user_id) not in assigned]
+        if not userchores:
+            return
+
+        # bulk_create sends no post_save, so the new rows are logged here. 
+        # Backends that don't return the ids of bulk inserted rows have 
+        # them read back
+        userchores = UserChore.objects.bulk_create(userchores)
+        if userchores[0].pk is None:
+            userchores = [
+                userchore for userchore in UserChore.objects
+                    .filter(chore__in=chores.keys(), user__in=user_ids)
+                if (userchore.chore_id, userchore.user_id) not in assigned]
+            for userchore in userchores:
+                userchore.chore = chores[userchore.chore_id]
+        ChangeLog.objects.bulk_create(
+            [_change_entry(userchore, ChangeLog.CREATED) for userchore in userchores])
+        users_assigned.send(sender=cls, chores=list(chores.values()), user_ids=user_ids)
+
+        cls.reschedule(chores.values())
+
+    @classmethod
+    def create_bulk(cls, chores, rosters=None):
+        """
+        Bulk counterpart of creating each of the unsaved chores in 
+        chores and then initializing it: inserts the chores, assigns 
+        each to the members of its space and picks its first next user 
+        in memory, in a handful of queries however many chores and 
+        members there are. The chores' shard must be active. Returns the
+        saved chores.
+
+        rosters may list, for each chore in turn, the (user id, 
+        delta_src, available) tuples of the roster to give it in place 
+        of its space's members.
+
+        bulk_create sends no post_save or m2m_changed, so the new rows 
+        are logged here, and users_assigned and chores_rescheduled are 
+        sent in their place
+        """
+        chores = list(chores)
+        if not chores:
+            return []
+
+        if rosters is None:
+            members = {}
+            userspaces = (UserSpace.objects
+                .filter(space_id__in={chore.parent_space_id for chore in chores})
+                .order_by('pk')
+                .values_list('space_id', 'user_id'))
+            for space_id, user_id in userspaces:
+                members.setdefault(space_id, []).append((user_id, 100.0, True))
+            rosters = [members.get(chore.parent_space_id, []) for chore in chores]
+        rosters = [list(roster) for roster in rosters]
+
+        # Everyone on a roster starts at the chore's min_vwork, so the 
+        # first two available are the two with the least vwork
+        SCHEDULER_CALLS.inc(len(chores), function='get_next_user')
+        for chore, roster in zip(chores, rosters):
+            available = [user_id for user_id, _, is_available in roster if is_available][:2]
+            chore.next_user_id = _next_user_get(
+                [(user_id, chore.min_vwork) for user_id in available])
+
+        # Backends that don't return the ids of bulk inserted rows have 
+        # them read back, as the last rows inserted in the chores' 
+        # spaces, from within the inserting transaction
+        with transaction.atomic(using=sharding.current_shard()):
+            saved = cls.objects.bulk_create(chores)
+            if saved[0].pk is None:
+                saved = list(cls.objects
+                    .filter(parent_space_id__in={chore.parent_space_id for chore in chores})
+                    .order_by('-pk')[:len(chores)])[::-1]
+            chores = saved
+
+            userchores = UserChore.objects.bulk_create([
+                UserChore(chore=chore, user_id=user_id, vwork=chore.min_vwork,
+                          delta_src=delta_src, available=available)
+                for chore, roster in zip(chores, rosters)
+                for user_id, delta_src, available in roster])
+            if userchores and userchores[0].pk is None:
+                by_pk = {chore.pk: chore for chore in chores}
+                userchores = list(UserChore.objects.filter(chore__in=chores))
+                for userchore in userchores:
+                    userchore.chore = by_pk[userchore.chore_id]
+            ChangeLog.objects.bulk_create(
+                [_change_entry(chore, ChangeLog.CREATED) for chore in chores] +
+                [_change_entry(userchore, ChangeLog.CREATED) for userchore in userchores])
+
+            user_ids = {user_id for roster in rosters for user_id, _, _ in roster}
+            if user_ids:
+                users_assigned.send(sender=cls, chores=chores, user_ids=sorted(user_ids))
+            chores_rescheduled.send(
+                sender=cls, chores=[chore for chore in chores if chore.next_user_id is not None])
+        return chores
+
+    @classmethod
+    def reschedule(cls, chores):
+        """
+        Bulk counterpart of schedule_chore that keeps each chore's 
+        next_date: picks the next user of every chore in chores and 
+        updates its min_vwork, reading all of their rosters in one query 
+        and saving the chores that changed in one update. 
+
+        bulk_update sends no post_save, so the changed chores are logged 
+        here and chores_rescheduled is sent in its place
+        """
+        chores = list(chores)
+        SCHEDULER_CALLS.inc(len(chores), function='get_next_user')
+
+        # The two available users with the least vwork on each chore
+        vworks = {}
+        userchores = (UserChore.objects
+            .filter(chore__in=chores, available=True)
+            .values_list('chore_id', 'user_id', 'vwork'))
+        for chore_id, user_id, vwork in userchores:
+            chore_vworks = vworks.setdefault(chore_id, [])
+            if len(chore_vworks) < 2:
+                chore_vworks.append((user_id, vwork))
+
+        changed = []
+        for chore in chores:
+            chore_vworks = vworks.get(chore.pk, [])
+            next_user_id = _next_user_get(chore_vworks, chore.last_user_id)
+            if next_user_id is None:
+                continue
+
+            min_vwork = dict(chore_vworks)[next_user_id]
+            if (chore.next_user_id, chore.min_vwork) != (next_user_id, min_vwork):
+                chore.next_user_id = next_user_id
+                chore.min_vwork = min_vwork
+                changed.append(chore)
+
+        if not changed:
+            return
+        cls.objects.bulk_update(changed, ['next_user', 'min_vwork'])
+        ChangeLog.objects.bulk_create(
+            [_change_entry(chore, ChangeLog.UPDATED) for chore in changed])
+        chores_rescheduled.send(sender=cls, chores=changed)
+
     def postpone(self):
         """
         Postpones a chore for the day after today or next_date, whichever is greater
@@ -193,21 +545,42 @@ class Chore(models.Model):
             (datetime.date.today()  if datetime.date.today() > self.next_date else self.next_date)
             + datetime.timedelta(days=1))
     
+    @sharding.on_instance_shard
     def mark_complete(self, user):
         """
-        Mark chore complete by user, update their work score and 
-        schedule the next round of this chore.
+        Mark chore complete by user, update their work score, record the
+        completion and schedule the next round of this chore.
         """
-        # Get and update userchore with least vwork value 
-        userchore = self.userchore_set.get(user=user)
-        userchore.increment_work()
-        userchore.save()
+        today = datetime.date.today()
+        with transaction.atomic(using=self._state.db):
+            # Get and update userchore with least vwork value 
+            userchore = self.userchore_set.get(user=user)
+            vdelta = userchore.vdelta
+            userchore.increment_work()
+            userchore.save()
 
-        # Update last_date
-        self.last_date = datetime.date.today()
+            ChoreCompletion.objects.create(
+                chore_id=self.pk, space_id=self.parent_space_id, user_id=user.pk,
+                completed_on=today, vdelta=vdelta)
+
+            # Count the completion in the stats of every space the chore
+            # is under
+            MemberStats.objects.filter(
+                space_id__in=Space.objects.ancestor_ids([self.parent_space_id]), user_id=user.pk
+            ).update(completions=F('completions') + 1, vwork=F('vwork') + vdelta)
+
+            # Update last_date and last_user
+            self.last_date = today
+            self.last_user = user
 
-        # Schedule next round of this chore
-        self.schedule_chore(datetime.date.today() + datetime.timedelta(days=self.interval))
+            # Schedule next round of this chore. Once its recurrence 
+            # rule has ended, no one is up for it any more
+            following = self.next_occurrence(today)
+            if following is None:
+                self.next_user = None
+                self.save()
+            else:
+                self.schedule_chore(following)
     
     def get_chore_calendar(self):
         """
@@ -220,8 +593,12 @@ class Chore(models.Model):
         vworks = self._generate_vworks()
         vdeltas = self._generate_vdeltas()
         today = datetime.date.today()
-        initial_offset = ((today if today > self.last_date else self.last_date) - today)
-        return _order_project(vworks, vdeltas, self.interval, initial_offset.days, self.last_user, 30)
+        start = today if today > self.next_date else self.next_date
+
+        # Occurrences are generated only as far as the projection reaches
+        offsets = ((date - today).days for date in self.occurrences(start))
+        SCHEDULER_CALLS.inc(function='_order_project')
+        return _order_project(vworks, vdeltas, offsets, self.last_user_id, 30) or []
 
     def mark_available(self, user):
         self.userchore_set.get(user=user).mark_available()
@@ -241,7 +618,7 @@ class Chore(models.Model):
 
         # Retrieve all users that are responsible for this chore, excluding users who aren't 
         # available
-        userchores = self.userchore_set.filter(chore=self.pk).exclude(available=False)
+        userchores = self._available_userchores()
 
         if(max_length):
             userchores = userchores[:max_length]
@@ -262,7 +639,7 @@ class Chore(models.Model):
 
         # Retrieve all users that are responsible for this chore, excluding users who aren't 
         # available
-        userchores = self.userchore_set.filter(chore=self.pk).exclude(available=False)
+        userchores = self._available_userchores()
 
         # Build vworks 
         for userchore in userchores:
@@ -273,9 +650,22 @@ class Chore(models.Model):
 
         return vdeltas
 
+    def _available_userchores(self):
+        """
+        Returns the userchores of the users available for this chore, 
+        from those prefetched with it if they were, so that projecting 
+        a list of chores doesn't query each of them
+        """
+        if 'userchore_set' in getattr(self, '_prefetched_objects_cache', {}):
+            return [userchore for userchore in self.userchore_set.all() if userchore.available]
+        return self.userchore_set.filter(chore=self.pk).exclude(available=False)
+
     def _initialize_users(self):
-        for user in self.parent_space.members.all():
-            self._initialize_user(user)
+        self.users.add(*self.parent_space.userspaces.values_list('user_id', flat=True), through_defaults={
+            'vwork': self.min_vwork,
+            'work':0,
+            'delta_src':100
+            })
 
     def _initialize_user(self, user):
         self.users.add(user, through_defaults={
@@ -285,9 +675,10 @@ class Chore(models.Model):
             })
 
 
-class Request(models.Model):
-    from_user = models.ForeignKey(User, related_name='sent_requests', on_delete=models.CASCADE)
-    to_user = models.ForeignKey(User, related_name='received_requests', on_delete=models.CASCADE)
+class Request(_LoggedDeletionModel):
+    id = models.BigAutoField(primary_key=True)
+    from_user = models.ForeignKey(User, related_name='sent_requests', on_delete=models.CASCADE, db_constraint=False)
+    to_user = models.ForeignKey(User, related_name='received_requests', on_delete=models.CASCADE, db_constraint=False)
     space = models.ForeignKey(Space, related_name='pending_requests', on_delete=models.CASCADE)
 
     created_date = models.DateField(auto_now_add=True)
@@ -295,10 +686,36 @@ class Request(models.Model):
     class Meta:
         ordering = ['created_date']
 
+    @classmethod
+    def invite(cls, space_id, from_user, user_ids):
+        """
+        Creates requests from from_user to each of the users with ids
+        user_ids to join the space with id space_id, in bulk, and returns
+        them. The space's shard must be active, and the users must not
+        have been invited to the space already
+        """
+        user_ids = list(user_ids)
+        if not user_ids:
+            return []
+
+        # bulk_create sends no post_save, so the new rows are logged here.
+        # Backends that don't return the ids of bulk inserted rows have 
+        # them read back
+        requests = cls.objects.bulk_create([
+            cls(from_user=from_user, to_user_id=user_id, space_id=space_id)
+            for user_id in user_ids])
+        if requests[0].pk is None:
+            requests = list(cls.objects.filter(space_id=space_id, to_user_id__in=user_ids))
+        ChangeLog.objects.bulk_create(
+            [_change_entry(request, ChangeLog.CREATED) for request in requests])
+        requests_created.send(sender=cls, requests=requests)
+        return requests
 
-class UserChore(models.Model):
+
+class UserChore(_LoggedDeletionModel):
+    id = models.BigAutoField(primary_key=True)
     chore = models.ForeignKey(Chore, on_delete=models.CASCADE)
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_constraint=False)
 
     vwork = models.FloatField(default=0)
     work = models.IntegerField(default=0)
@@ -333,50 +750,381 @@ class UserChore(models.Model):
         self.save()
 
 
-class UserSpace(models.Model):
+class UserSpace(_LoggedDeletionModel):
+    id = models.BigAutoField(primary_key=True)
     space = models.ForeignKey(Space, related_name='userspaces', on_delete=models.CASCADE)
-    user = models.ForeignKey(User, related_name='userspaces', on_delete=models.CASCADE)
+    user = models.ForeignKey(User, related_name='userspaces', on_delete=models.CASCADE, db_constraint=False)
 
     available = models.BooleanField(default=True)
 
+    @sharding.on_instance_shard
     def mark_unavailable(self):
         """
         Mark user unavailable for performing chores in this space
         """
-        self.available = False
-        
-        # Mark user unavailable for all chores in this space
-        for chore in self.space.chores.all():
-            chore.mark_unavailable(self.user)
-        
-        # Mark user unavailable for all chores in this space's subspaces
-        for child in self.space.child.all():
-            child.userspace_set.get(user=self.user).mark_unavailable()
-
-        self.save()
+        self._mark_availability(False)
     
+    @sharding.on_instance_shard
     def mark_available(self):
         """
         Marks user available for performing chores in this space
         after a period of their absence.
         """
-        self.available = True 
+        self._mark_availability(True)
 
-        # Mark user available for all chores in this space
-        for chore in self.space.chores.all():
-            chore.userchore_set.get(user=self.user).mark_available()
-        
-        # Mark user available for all chores in this space's subspaces
-        for child in self.space.child.all():
-            child.userspace_set.get(user=self.user).mark_available()
-        
-        self.save()
+    def _mark_availability(self, available):
+        """
+        Sets the user's availability in this space at once, and queues
+        it to be spread to the subspaces and chores under it. The task is
+        queued in the same transaction as the change, so that it is
+        queued if and only if the change is saved
+        """
+        from tracker import tasks
+
+        shard = sharding.current_shard()
+        with transaction.atomic(using=shard):
+            self.available = available
+            self.save(update_fields=['available'], using=shard)
+            tasks.enqueue(tasks.propagate_availability,
+                          space_id=self.space_id, user_id=self.user_id, available=available)
+
+    @sharding.on_instance_shard
+    def propagate_availability(self):
+        """
+        Spreads the user's availability in this space to its subspaces
+        and to all the chores in them, and reschedules the chores the
+        user may have been next up for
+        """
+        userchores = self._set_availability(self.available)
+        if not self.available:
+            Chore.reschedule({userchore.chore for userchore in userchores})
+
+    def _set_availability(self, available):
+        """
+        Sets the availability of this userspace's user in its space's 
+        subtree, and on every chore in it, with one update per table. 
+        Users coming back have their vwork raised to the chores' 
+        min_vwork, as in UserChore.mark_available.
+
+        Updates send no post_save, so the changed rows are logged here. 
+        Returns the userchores that were changed
+        """
+        subtree = Space.objects.subtree_ids(self.space)
+
+        userspaces = list(UserSpace.objects
+            .filter(user_id=self.user_id, space_id__in=subtree)
+            .exclude(available=available))
+        UserSpace.objects.filter(pk__in=[userspace.pk for userspace in userspaces]).update(
+            available=available)
+
+        userchores = list(UserChore.objects
+            .filter(user_id=self.user_id, chore__parent_space_id__in=subtree)
+            .exclude(available=available)
+            .select_related('chore'))
+        updated = {'available': available}
+        if available:
+            updated['vwork'] = Greatest('vwork', Subquery(Chore.objects
+                .filter(pk=OuterRef('chore_id'))
+                .values('min_vwork')))
+        UserChore.objects.filter(pk__in=[userchore.pk for userchore in userchores]).update(
+            **updated)
+
+        ChangeLog.objects.bulk_create(
+            [_change_entry(row, ChangeLog.UPDATED) for row in userspaces + userchores])
+        return userchores
 
 
     
 
+class ChangeLog(models.Model):
+    """
+    Append-only log of changes to the models that clients keep local 
+    copies of. Entries are written in the same transaction as the change
+    they record, and their ids double as sync cursors.
+
+    space_id and user_id hold the space and the user that an entry is 
+    visible to. They are plain integers rather than foreign keys so that
+    entries outlive the rows they refer to
+    """
+    id = models.BigAutoField(primary_key=True)
+    CREATED = 'created'
+    UPDATED = 'updated'
+    DELETED = 'deleted'
+    ACTIONS = [
+        (CREATED, 'Created'),
+        (UPDATED, 'Updated'),
+        (DELETED, 'Deleted'),
+    ]
+
+    model = models.CharField(max_length=20)
+    object_id = models.BigIntegerField()
+    action = models.CharField(max_length=7, choices=ACTIONS)
+
+    space_id = models.BigIntegerField(null=True, db_index=True)
+    user_id = models.BigIntegerField(null=True, db_index=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+
+
+class ChoreCompletion(models.Model):
+    """
+    Append-only record of every time a chore was completed, written in
+    the same transaction as the completion. chore_id, space_id and 
+    user_id are plain integers, as in ChangeLog, so that records outlive
+    the rows they refer to.
+
+    On Postgres the table is partitioned by month of completed_on, see
+    tracker.partitions, so that old months can be dropped whole
+    """
+    id = models.BigAutoField(primary_key=True)
+    chore_id = models.BigIntegerField()
+    space_id = models.BigIntegerField()
+    user_id = models.BigIntegerField()
+
+    completed_on = models.DateField()
+
+    # The vwork added to the user's score for the chore
+    vdelta = models.FloatField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user_id', 'completed_on']),
+            models.Index(fields=['space_id', 'completed_on']),
+        ]
+
+
+class MemberStats(models.Model):
+    """
+    Rollup of a member's chores across a space's whole subtree, read by
+    the fairness stats endpoint. Kept up to date by tracker.stats
+    """
+    id = models.BigAutoField(primary_key=True)
+    space = models.ForeignKey(Space, related_name='member_stats', on_delete=models.CASCADE)
+    user = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE, db_constraint=False)
+
+    # Chores the member is on, times they completed them and the vwork 
+    # those completions added to their scores
+    chores = models.PositiveIntegerField(default=0)
+    completions = models.PositiveIntegerField(default=0)
+    vwork = models.FloatField(default=0)
+
+    # The sum of the member's weights on their chores, the inverse of the
+    # vwork each completion adds. Members are due shares of the work in
+    # proportion to their weight
+    weight = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['space', 'user'], name='tracker_memberstats_space_user'),
+        ]
+
+
+class DigestDelivery(models.Model):
+    """
+    Record of the daily digest sent to a user, so that each user is sent
+    at most one a day. Users are global, and so are their deliveries
+    """
+    user = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    date = models.DateField()
+    sent_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'date'], name='tracker_digestdelivery_user_date'),
+        ]
+
+
+class Task(models.Model):
+    """
+    Background work queued by tracker.tasks' database backend, run by
+    the run_tasks command. Tasks are stored on the shard of the write 
+    that queued them, in the same transaction, so that they are queued 
+    if and only if the write commits.
+
+    Tasks that succeed are deleted. Tasks that fail are retried at 
+    run_at until they have failed TRACKER_TASK_MAX_ATTEMPTS times, after
+    which they are kept with failed set
+    """
+    id = models.BigAutoField(primary_key=True)
+    name = models.CharField(max_length=100)
+    arguments = models.JSONField(default=dict)
+
+    run_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    failed = models.BooleanField(default=False)
+    last_error = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['failed', 'run_at'])]
+
+
+def _change_scope(instance, action, chore_spaces=None):
+    """
+    Returns a tuple of the ids of the space and the user that a change 
+    to instance is visible to. The spaces of roster rows' chores are 
+    looked up in chore_spaces, a dictionary of chore ids to space ids, 
+    when they are in it
+    """
+    if isinstance(instance, Space):
+        # Once deleted, a space is only visible from its parent
+        if action == ChangeLog.DELETED and instance.parent_id:
+            return (instance.parent_id, None)
+        return (instance.pk, None)
+    if isinstance(instance, Chore):
+        return (instance.parent_space_id, None)
+    if isinstance(instance, UserChore):
+        # Read the chore's space without caching the chore on instance,
+        # where it would go stale
+        if UserChore.chore.is_cached(instance):
+            space_id = instance.chore.parent_space_id
+        elif chore_spaces is not None and instance.chore_id in chore_spaces:
+            space_id = chore_spaces[instance.chore_id]
+        else:
+            space_id = Chore.objects.using(instance._state.db).filter(pk=instance.chore_id).values_list(
+                'parent_space_id', flat=True).first()
+        return (space_id, instance.user_id)
+    if isinstance(instance, UserSpace):
+        return (instance.space_id, instance.user_id)
+    if isinstance(instance, Request):
+        return (instance.space_id, instance.to_user_id)
+
+
+def _change_entry(instance, action, chore_spaces=None):
+    space_id, user_id = _change_scope(instance, action, chore_spaces)
+    return ChangeLog(
+        model=instance._meta.model_name, 
+        object_id=instance.pk,
+        action=action,
+        space_id=space_id,
+        user_id=user_id)
+
+
+class _Deletion:
+    """
+    The change log entries of the rows a deletion removes, by database,
+    and the spaces of the chores of the roster rows among them
+    """
+    def __init__(self):
+        self.chore_ids = defaultdict(set)
+        self.chore_spaces = defaultdict(dict)
+        self.entries = defaultdict(list)
+
+    def log(self, instance, using):
+        # pre_delete is sent for every row before any is deleted, and 
+        # roster rows are deleted before their chores, so the chores' 
+        # spaces are read in one query on logging the first row
+        chore_ids = self.chore_ids.pop(using, None)
+        if chore_ids:
+            self.chore_spaces[using].update(Chore.objects.using(using)
+                .filter(pk__in=chore_ids).values_list('pk', 'parent_space_id'))
+        self.entries[using].append(
+            _change_entry(instance, ChangeLog.DELETED, self.chore_spaces[using]))
+
+    def save(self):
+        for using, entries in self.entries.items():
+            ChangeLog.objects.using(using).bulk_create(entries)
+
+
+@contextmanager
+def _logging_deletions(using):
+    """
+    Within this, rows deleted are logged in bulk, once they are all 
+    gone and in the same transaction, rather than one query at a time 
+    as each is
+    """
+    if not hasattr(_deletions, 'stack'):
+        _deletions.stack = []
+    deletion = _Deletion()
+    _deletions.stack.append(deletion)
+    try:
+        with transaction.atomic(using=using):
+            yield
+            deletion.save()
+    finally:
+        _deletions.stack.pop()
+
+
 @receiver(pre_delete, sender=User)
-def cascade_delete_space(sender, instance, **kwargs):
-    for space in instance.spaces.all():
-        if space.members.count() == 1:
-            space.delete()
\ No newline at end of file
+def cascade_delete_space(sender, instance, using, **kwargs):
+    for shard in sharding.get_shards():
+        for space in Space.objects.using(shard).filter(members=instance):
+            if space.userspaces.count() == 1:
+                space.delete()
+
+        # Deleting the user only cascades on the database it is on
+        if shard != using:
+            Request.objects.using(shard).filter(
+                models.Q(from_user=instance) | models.Q(to_user=instance)).delete()
+            UserChore.objects.using(shard).filter(user=instance).delete()
+            UserSpace.objects.using(shard).filter(user=instance).delete()
+            MemberStats.objects.using(shard).filter(user=instance).delete()
+            Chore.objects.using(shard).filter(next_user=instance).update(next_user=None)
+            Chore.objects.using(shard).filter(last_user=instance).update(last_user=None)
+
+
+@receiver(post_save, sender=Space)
+@receiver(post_save, sender=Chore)
+@receiver(post_save, sender=UserChore)
+@receiver(post_save, sender=UserSpace)
+@receiver(post_save, sender=Request)
+def log_save(sender, instance, created, raw=False, using=None, **kwargs):
+    if raw:
+        return
+    _change_entry(instance, ChangeLog.CREATED if created else ChangeLog.UPDATED).save(using=using)
+
+
+@receiver(post_delete, sender=Space)
+@receiver(post_delete, sender=Chore)
+@receiver(post_delete, sender=UserChore)
+@receiver(post_delete, sender=UserSpace)
+@receiver(post_delete, sender=Request)
+def log_delete(sender, instance, using=None, **kwargs):
+    deletions = getattr(_deletions, 'stack', None)
+    if deletions:
+        deletions[-1].log(instance, using)
+    else:
+        _change_entry(instance, ChangeLog.DELETED).save(using=using)
+
+
+@receiver(pre_delete, sender=UserChore)
+def collect_roster_chores(sender, instance, using=None, **kwargs):
+    deletions = getattr(_deletions, 'stack', None)
+    if deletions and not UserChore.chore.is_cached(instance):
+        deletions[-1].chore_ids[using].add(instance.chore_id)
+
+
+@receiver(m2m_changed, sender=UserSpace)
+@receiver(m2m_changed, sender=UserChore)
+def log_through_change(sender, instance, action, reverse, model, pk_set, using=None, **kwargs):
+    """
+    Adding to and removing from 'members' and 'users' write the through
+    rows in bulk without sending save or delete signals, so they are
+    logged here. Additions are logged once the rows exist, removals 
+    before the rows are gone
+    """
+    if action not in ('post_add', 'pre_remove', 'pre_clear'):
+        return
+
+    # Through models' foreign keys to the model declaring the relation, 
+    # and to the model it relates to
+    through_fields = {
+        UserSpace: ('space', 'user'),
+        UserChore: ('chore', 'user'),
+    }
+    instance_field, related_field = through_fields[sender]
+    if reverse:
+        instance_field, related_field = related_field, instance_field
+
+    rows = sender.objects.using(using).filter(**{instance_field: instance})
+    if pk_set is not None:
+        rows = rows.filter(**{related_field + '__in': pk_set})
+    if sender is UserChore:
+        rows = rows.select_related('chore')
+
+    log_action = ChangeLog.CREATED if action == 'post_add' else ChangeLog.DELETED
+    ChangeLog.objects.using(using).bulk_create([_change_entry(row, log_action) for row in rows])
@@ -0,0 +1,154 @@
+"""
+Keeps the monthly partitions of ChoreCompletion's table on Postgres.
+
+Completions go to the partition of the month they were made in, or to a
+default partition while that month has none. Partitions are created
+TRACKER_COMPLETION_PARTITIONS_AHEAD months ahead after migrating and by
+the partition_completions command, which is meant to be run monthly and
+also drops months that are no longer kept, a whole partition at a time.
+
+Other databases keep completions in a plain table, which old months are
+deleted from in batches
+"""
+import datetime
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models.signals import post_migrate
+from django.dispatch import receiver
+
+from tracker import sharding
+from tracker.models import ChoreCompletion
+
+
+TABLE = ChoreCompletion._meta.db_table
+DEFAULT_PARTITION = TABLE + '_default'
+
+
+def month_start(date):
+    return date.replace(day=1)
+
+
+def add_months(month, count):
+    years, index = divmod(month.month - 1 + count, 12)
+    return datetime.date(month.year + years, index + 1, 1)
+
+
+def partition_name(month):
+    return '%s_y%04dm%02d' % (TABLE, month.year, month.month)
+
+
+def is_partitioned(using):
+    return connections[using].vendor == 'postgresql'
+
+
+def get_partitions(using):
+    """
+    Returns the months that have partitions on the database using
+    """
+    if not is_partitioned(using):
+        return []
+
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            'SELECT child.relname FROM pg_inherits '
+            'JOIN pg_class parent ON pg_inherits.inhparent = parent.oid '
+            'JOIN pg_class child ON pg_inherits.inhrelid = child.oid '
+            'WHERE parent.relname = %s', [TABLE])
+        names = [name for name, in cursor.fetchall()]
+
+    prefix = TABLE + '_y'
+    return sorted(
+        datetime.date(int(name[len(prefix):len(prefix) + 4]), int(name[-2:]), 1)
+        for name in names if name.startswith(prefix))
+
+
+def create_partitions(using, ahead=None):
+    """
+    Creates the partitions for the current month and the ahead months
+    after it on the database using, where they are missing
+    """
+    if not is_partitioned(using):
+        return
+    if ahead is None:
+        ahead = getattr(settings, 'TRACKER_COMPLETION_PARTITIONS_AHEAD', 3)
+
+    current = month_start(datetime.date.today())
+    existing = set(get_partitions(using))
+    for month in (add_months(current, i) for i in range(ahead + 1)):
+        if month not in existing:
+            create_partition(using, month)
+
+
+def create_partition(using, month):
+    """
+    Creates the partition for month on the database using. Completions
+    for month that went to the default partition while it had none are
+    moved to it: Postgres won't create a partition for rows the default
+    partition holds, so the default partition is detached while they
+    are moved, all in one transaction
+    """
+    connection = connections[using]
+    table = connection.ops.quote_name(TABLE)
+    default = connection.ops.quote_name(DEFAULT_PARTITION)
+    partition = connection.ops.quote_name(partition_name(month))
+    bounds = [month, add_months(month, 1)]
+
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT EXISTS (SELECT 1 FROM {} '
+            'WHERE completed_on >= %s AND completed_on < %s)'.format(default), bounds)
+        stranded = cursor.fetchone()[0]
+
+        if stranded:
+            cursor.execute('ALTER TABLE {} DETACH PARTITION {}'.format(table, default))
+        cursor.execute(
+            'CREATE TABLE {} PARTITION OF {} '
+            'FOR VALUES FROM (%s) TO (%s)'.format(partition, table), bounds)
+        if stranded:
+            cursor.execute(
+                'INSERT INTO {} SELECT * FROM {} '
+                'WHERE completed_on >= %s AND completed_on < %s'.format(partition, default),
+                bounds)
+            cursor.execute(
+                'DELETE FROM {} WHERE completed_on >= %s AND completed_on < %s'.format(default),
+                bounds)
+            cursor.execute('ALTER TABLE {} ATTACH PARTITION {} DEFAULT'.format(table, default))
+
+
+def drop_before(using, month, batch_size=1000):
+    """
+    Removes the completions made before month from the database using,
+    dropping whole partitions on Postgres and deleting batch_size rows
+    at a time elsewhere. Returns the number of completions removed
+    """
+    connection = connections[using]
+    removed = 0
+
+    if is_partitioned(using):
+        with connection.cursor() as cursor:
+            for partition in get_partitions(using):
+                if partition >= month:
+                    continue
+                name = connection.ops.quote_name(partition_name(partition))
+                cursor.execute('SELECT COUNT(*) FROM {}'.format(name))
+                removed += cursor.fetchone()[0]
+                cursor.execute('ALTER TABLE {} DETACH PARTITION {}'.format(
+                    connection.ops.quote_name(TABLE), name))
+                cursor.execute('DROP TABLE {}'.format(name))
+
+    # Completions in the default partition, or in the plain table, are
+    # deleted a batch at a time to keep transactions short
+    completions = ChoreCompletion.objects.using(using).filter(completed_on__lt=month)
+    while True:
+        batch = list(completions.values_list('pk', flat=True)[:batch_size])
+        if not batch:
+            break
+        removed += ChoreCompletion.objects.using(using).filter(pk__in=batch)._raw_delete(using)
+    return removed
+
+
+@receiver(post_migrate)
+def create_upcoming_partitions(sender, using, **kwargs):
+    if sender.name == 'tracker' and using in sharding.get_shards():
+        create_partitions(using)
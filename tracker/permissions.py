@@ -0,0 +1,74 @@
+from rest_framework.permissions import BasePermission
+
+from tracker import sharding
+from tracker.models import Space
+
+
+def get_accessible_space_ids(request):
+    """
+    Returns the set of ids of the spaces the requesting user has 
+    access to, ie., spaces they are a member of and all of the subspaces 
+    under those spaces. 
+
+    The set is computed with a single query on each shard the first 
+    time it is asked for and cached on the request, so that every 
+    subsequent membership check made while handling the request is 
+    answered in memory
+    """
+    accessible = getattr(request, '_accessible_space_ids', None)
+    if accessible is None:
+        request._space_shards = {
+            space_id: shard
+            for shard, space_ids in sharding.on_each_shard(
+                Space.objects.accessible_ids, request.user)
+            for space_id in space_ids}
+        accessible = request._accessible_space_ids = set(request._space_shards)
+    return accessible
+
+
+def get_space_shard(request, space_id):
+    """
+    Returns the shard holding the space with id space_id, which the 
+    requesting user must have access to
+    """
+    get_accessible_space_ids(request)
+    return request._space_shards[int(space_id)]
+
+
+def is_space_member(request, space_id):
+    """
+    Returns True if the requesting user has access to the space 
+    with id space_id
+    """
+    try:
+        space_id = int(space_id)
+    except (TypeError, ValueError):
+        return False
+    return space_id in get_accessible_space_ids(request)
+
+
+class IsSpaceMember(BasePermission):
+    """
+    Allows access only to members of the space named in the URL. 
+
+    Views declare which of their URL keyword arguments holds the space 
+    id through 'space_url_kwarg'. Requests routed without that argument
+    (eg., listing root spaces) are let through. Requests let through to 
+    a space have its shard activated for the rest of the request
+    """
+    message = 'You must be a member of this space.'
+
+    def has_permission(self, request, view):
+        if not(request.user and request.user.is_authenticated):
+            return False
+
+        space_url_kwarg = getattr(view, 'space_url_kwarg', None)
+        space_id = view.kwargs.get(space_url_kwarg) if space_url_kwarg else None
+        if space_id is None:
+            return True
+
+        if not is_space_member(request, space_id):
+            return False
+
+        sharding.activate(get_space_shard(request, space_id))
+        return True
@@ -0,0 +1,115 @@
+"""
+Instrumentation of the SQL issued while handling requests, or any other
+block of code wrapped in a QueryLog.
+
+Statements slower than TRACKER_SLOW_QUERY_THRESHOLD seconds are logged
+with the innermost tracker frame that issued them, eg. 
+'tracker/models.py:245 Chore._generate_vworks'. Statements of the same 
+shape issued TRACKER_REPEATED_QUERY_THRESHOLD times or more within one 
+block, the signature of an N+1 pattern, are logged when it ends.
+
+Entries are written to the 'tracker.queries' logger as JSON objects.
+"""
+import json
+import logging
+import os
+import re
+import sys
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+
+logger = logging.getLogger('tracker.queries')
+
+_TRACKER_DIR = os.path.dirname(os.path.abspath(__file__))
+_INSTRUMENTATION_FILES = {
+    os.path.join(_TRACKER_DIR, 'querylog.py'),
+    os.path.join(_TRACKER_DIR, 'middleware.py'),
+}
+
+# Lists of placeholders, as in 'IN (%s, %s, %s)', whose length varies 
+# between otherwise identical statements
+_PLACEHOLDER_LIST = re.compile(r'%s(?:\s*,\s*%s)+')
+
+
+def query_shape(sql):
+    """
+    Returns sql with its lists of placeholders collapsed, so that 
+    statements differing only in the number of values they are passed 
+    have the same shape
+    """
+    return _PLACEHOLDER_LIST.sub('%s, ...', sql)
+
+
+def tracker_frame():
+    """
+    Returns a description of the innermost frame on the current stack 
+    that belongs to the tracker, outside of this instrumentation
+    """
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if filename.startswith(_TRACKER_DIR + os.sep) and filename not in _INSTRUMENTATION_FILES:
+            code = frame.f_code
+            return '%s:%d %s' % (
+                os.path.relpath(filename, os.path.dirname(_TRACKER_DIR)),
+                frame.f_lineno,
+                getattr(code, 'co_qualname', code.co_name))
+        frame = frame.f_back
+    return None
+
+
+def _log(event, **fields):
+    fields['event'] = event
+    logger.warning(json.dumps(fields, default=str, sort_keys=True))
+
+
+class QueryLog:
+    """
+    Context manager logging the slow and repeated statements issued on 
+    every database connection while it is active. label names the block
+    being instrumented in log entries, eg. the view handling a request
+    """
+    def __init__(self, label=None):
+        self.label = label
+        self.slow_threshold = getattr(settings, 'TRACKER_SLOW_QUERY_THRESHOLD', 0.1)
+        self.repeat_threshold = getattr(settings, 'TRACKER_REPEATED_QUERY_THRESHOLD', 5)
+
+        self.shapes = Counter()
+        # Shapes seen repeat_threshold times, mapped to the frame that
+        # issued them when they reached it
+        self.repeated = {}
+        self._stack = None
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for alias in connections:
+            self._stack.enter_context(connections[alias].execute_wrapper(self._record))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+        for shape, frame in self.repeated.items():
+            _log('repeated_query', label=self.label, sql=shape,
+                 count=self.shapes[shape], frame=frame)
+
+    def _record(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            shape = query_shape(sql)
+            self.shapes[shape] += 1
+
+            if duration >= self.slow_threshold:
+                _log('slow_query', label=self.label, sql=sql, 
+                     duration=round(duration, 6), frame=tracker_frame(),
+                     database=context['connection'].alias)
+
+            if self.shapes[shape] == self.repeat_threshold:
+                self.repeated[shape] = tracker_frame()
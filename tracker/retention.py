@@ -0,0 +1,154 @@
+"""
+Removes rows once they are older than their model's retention period in
+TRACKER_RETENTION_DAYS, archiving those of models with archive set to
+compressed JSON lines files under TRACKER_ARCHIVE_DIR first.
+
+Rows are removed TRACKER_RETENTION_BATCH_SIZE at a time, each batch in a
+transaction of its own, so that no delete holds locks on a busy table
+for long. Archives are written before the rows are deleted, so a run
+that is interrupted may archive some rows twice but never loses any
+"""
+import datetime
+import gzip
+import json
+import os
+import time
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, transaction
+from django.utils import timezone
+
+from tracker import partitions
+from tracker.models import ChangeLog, ChoreCompletion, Request
+
+
+class Policy:
+    """
+    How rows of model expire. Their age is read from date_field. Rows of
+    logged models are deleted with signals, so that their deletion is
+    logged for syncing clients and published to them
+    """
+    def __init__(self, model, date_field, archive=False, logged=False):
+        self.model = model
+        self.date_field = date_field
+        self.archive = archive
+        self.logged = logged
+
+    @property
+    def name(self):
+        return self.model._meta.model_name
+
+    def cutoff(self, today=None):
+        """
+        Returns the date rows older than which have expired, or None if
+        they are kept forever
+        """
+        days = getattr(settings, 'TRACKER_RETENTION_DAYS', {}).get(self.name)
+        if days is None:
+            return None
+        return (today or timezone.localdate()) - datetime.timedelta(days=days)
+
+    def filter(self, queryset, expired, today=None):
+        """
+        Returns the rows of queryset that have expired, or that have not
+        """
+        cutoff = self.cutoff(today)
+        if cutoff is None:
+            return queryset.none() if expired else queryset
+        if isinstance(self.model._meta.get_field(self.date_field), models.DateTimeField):
+            cutoff = timezone.make_aware(datetime.datetime.combine(cutoff, datetime.time()))
+        lookup = '%s__%s' % (self.date_field, 'lt' if expired else 'gte')
+        return queryset.filter(**{lookup: cutoff})
+
+
+POLICIES = [
+    # Invitations that were never accepted
+    Policy(Request, 'created_date', logged=True),
+    # Clients syncing from before the oldest entry kept download their
+    # lists in full
+    Policy(ChangeLog, 'created_at'),
+    Policy(ChoreCompletion, 'completed_on', archive=True),
+]
+
+
+def get_policy(name):
+    for policy in POLICIES:
+        if policy.name == name:
+            return policy
+    raise KeyError(name)
+
+
+def unexpired(queryset):
+    """
+    Returns queryset without the rows that have expired but have yet to
+    be removed
+    """
+    return get_policy(queryset.model._meta.model_name).filter(queryset, expired=False)
+
+
+def apply(policy, using, today=None, batch_size=None, pause=0):
+    """
+    Archives and removes the expired rows of policy's model on the
+    database using, pausing for pause seconds between batches. Returns
+    the numbers of rows archived and removed
+    """
+    if policy.cutoff(today) is None:
+        return 0, 0
+    rows = policy.filter(policy.model.objects.using(using), expired=True, today=today)
+    batch_size = batch_size or getattr(settings, 'TRACKER_RETENTION_BATCH_SIZE', 500)
+
+    archived = _archive(policy, rows, using, batch_size, today) if policy.archive else 0
+
+    # Whole months of completions are dropped at once where they are
+    # partitioned
+    removed = 0
+    if policy.model is ChoreCompletion:
+        removed += partitions.drop_before(
+            using, partitions.month_start(policy.cutoff(today)), batch_size)
+
+    while True:
+        with transaction.atomic(using=using):
+            batch = list(rows.order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not batch:
+                break
+            batch_rows = policy.model.objects.using(using).filter(pk__in=batch)
+            if policy.logged:
+                batch_rows.delete()
+            else:
+                batch_rows._raw_delete(using)
+        removed += len(batch)
+        if pause:
+            time.sleep(pause)
+
+    return archived, removed
+
+
+def archive_path(policy, using, today=None):
+    return os.path.join(
+        getattr(settings, 'TRACKER_ARCHIVE_DIR', 'archive'), using, policy.name,
+        '%s.jsonl.gz' % (today or timezone.localdate()).isoformat())
+
+
+def _archive(policy, rows, using, batch_size, today=None):
+    """
+    Appends rows to the day's archive of policy's model, a batch at a
+    time, and returns the number of rows written
+    """
+    path = archive_path(policy, using, today)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    count, last_pk = 0, None
+    with gzip.open(path, 'at', encoding='utf-8') as archive:
+        while True:
+            batch = rows.order_by('pk')
+            if last_pk is not None:
+                batch = batch.filter(pk__gt=last_pk)
+            batch = list(batch.values()[:batch_size])
+            if not batch:
+                break
+            for row in batch:
+                archive.write(json.dumps(row, cls=DjangoJSONEncoder, sort_keys=True) + '\n')
+            count += len(batch)
+            last_pk = batch[-1]['id']
+    return count
@@ -1,9 +1,144 @@
+import datetime
+
+from django.conf import settings
 from django.contrib.auth import authenticate 
+from django.core.exceptions import FieldDoesNotExist
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
 
 from rest_framework import serializers 
+from rest_framework.permissions import SAFE_METHODS
+
+from common.util.recurrence import parse as parse_recurrence
 
 from tracker.models import (User, Space, Chore, Request,
-                            UserSpace, UserChore)
+                            UserSpace, UserChore, MemberStats)
+from tracker import sharding, tasks
+from tracker.backends import decode_token, get_token_user
+from tracker.permissions import is_space_member
+
+
+def _validate_membership(serializer, space_id):
+    """
+    Raise a ValidationError if the user making the request isn't a
+    member of the space with id space_id. Membership is answered from 
+    the set of accessible spaces cached on the request, so this does 
+    not cost a query per check.
+
+    Serializers used without a request in their context are not checked
+    """
+    request = serializer.context.get('request')
+    if request is not None and not is_space_member(request, space_id):
+        raise serializers.ValidationError(
+            'You must be a member of this space.'
+        )
+    return space_id
+
+
+def _parse_sparse_params(request):
+    """
+    Returns a tuple of the sets of field names passed in the 'fields' 
+    and 'expand' query parameters of request. Either is None when the
+    corresponding parameter is absent
+    """
+    params = []
+    for key in ('fields', 'expand'):
+        value = request.query_params.get(key)
+        if value is None:
+            params.append(None)
+            continue
+        params.append({name.strip() for name in value.split(',') if name.strip()})
+    return tuple(params)
+
+
+class SparseFieldsMixin:
+    """
+    Lets clients request a subset of a serializer's fields with 
+    '?fields=id,name' and pick the nested relations to expand with 
+    '?expand=next_user'. Nested relations that are requested but not 
+    expanded are rendered as primary keys, or left out if they are 
+    to-many relations. Without either parameter every field is 
+    serialized and every relation expanded.
+
+    Only read requests are pruned, so that writes are always validated 
+    against the full set of fields
+    """
+
+    # Nested fields, mapped to the relation select_related must follow
+    # to render them
+    select_related_fields = {}
+
+    # Nested to-many fields, mapped to the lookup or Prefetch used to
+    # render them, or to a function returning one
+    prefetch_related_fields = {}
+
+    # Fields which aren't model columns, mapped to the columns they
+    # are computed from
+    computed_fields = {}
+
+    # Computed fields, mapped to the lookups to prefetch to compute them
+    computed_prefetches = {}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        request = self.context.get('request')
+        if request is None or request.method not in SAFE_METHODS:
+            return
+
+        requested, expanded = _parse_sparse_params(request)
+
+        for name in list(self.fields):
+            if requested is not None and name not in requested:
+                self.fields.pop(name)
+            elif expanded is None or name in expanded:
+                continue
+            elif name in self.select_related_fields:
+                self.fields[name] = serializers.PrimaryKeyRelatedField(read_only=True)
+            elif name in self.prefetch_related_fields:
+                self.fields.pop(name)
+
+    @classmethod
+    def optimize_queryset(cls, queryset, request):
+        """
+        Returns queryset with the joins, prefetches and columns that the
+        fields kept for request need, and nothing more
+        """
+        fields = cls(context={'request': request}).fields
+        model = queryset.model
+
+        columns, select, prefetch = [], [], []
+        for name, field in fields.items():
+            if name in cls.prefetch_related_fields:
+                prefetch.append(cls.get_prefetch(name))
+            elif name in cls.select_related_fields:
+                relation = cls.select_related_fields[name]
+                columns.append(relation)
+                if isinstance(field, serializers.BaseSerializer):
+                    select.append(relation)
+                    columns.extend(relation + '__' + nested for nested in field.Meta.fields)
+            elif name in cls.computed_fields:
+                columns.extend(cls.computed_fields[name])
+                prefetch.extend(cls.computed_prefetches.get(name, ()))
+            else:
+                try:
+                    model._meta.get_field(field.source)
+                except FieldDoesNotExist:
+                    continue
+                columns.append(field.source)
+
+        if select:
+            queryset = sharding.select_global(queryset, *select)
+        if prefetch:
+            queryset = queryset.prefetch_related(*prefetch)
+        if columns:
+            queryset = queryset.only(*columns)
+        return queryset
+
+    @classmethod
+    def get_prefetch(cls, name):
+        lookup = cls.prefetch_related_fields[name]
+        return lookup() if callable(lookup) else lookup
 
 # Serializes User
 class UserSerializer(serializers.ModelSerializer):
@@ -30,6 +165,12 @@ class UserSerializer(serializers.ModelSerializer):
     
         instance.save()
 
+        # Changing the password logs out every other session, and this
+        # one is issued a new token
+        if password is not None:
+            instance.revoke_tokens()
+            instance.issue_token()
+
         return instance
 
 class UserEmailSerializer(serializers.ModelSerializer):
@@ -37,12 +178,17 @@ class UserEmailSerializer(serializers.ModelSerializer):
         fields = ['email']
         model = User
 
+        # Emails written through this serializer refer to existing users,
+        # so they mustn't be checked for uniqueness
+        extra_kwargs = {'email': {'validators': []}}
+
 
 # Serializes login requests
 class LoginSerializer(serializers.Serializer):
     email = serializers.CharField(required=True, max_length=255)
     password = serializers.CharField(required=True, max_length=128, write_only=True)
     token = serializers.CharField(max_length=255, read_only=True)
+    refresh_token = serializers.CharField(max_length=255, read_only=True)
 
     def validate(self, data):
         """
@@ -78,10 +224,41 @@ class LoginSerializer(serializers.Serializer):
             )
         
 
-        # 'validate' method should return a dictionary of valid data
+        # 'validate' method should return a dictionary of valid data.
+        # The access token is issued by the view
+        return {
+            'email': user.email,
+            'refresh_token': user.refresh_token,
+            'user': user
+        }
+
+
+# Serializes requests to exchange a refresh token for an access token
+class RefreshTokenSerializer(serializers.Serializer):
+    email = serializers.CharField(max_length=255, read_only=True)
+    refresh_token = serializers.CharField(required=True, max_length=255, write_only=True)
+    token = serializers.CharField(max_length=255, read_only=True)
+
+    def validate(self, data):
+        """
+        Make sure the refresh token is genuine, unexpired and hasn't 
+        been revoked. Unlike logging in, this needs no password hashing.
+        The user is read from the database, as a token revoked by 
+        another worker may still be cached in this one
+        """
+        payload = decode_token(data.get('refresh_token'))
+
+        if payload.get('typ') != 'refresh':
+            raise serializers.ValidationError(
+                'A refresh token is required.'
+            )
+
+        user = get_token_user(payload, fresh=True)
+
+        # The access token is issued by the view
         return {
             'email': user.email,
-            'token': user.token
+            'user': user
         }
 
 
@@ -96,12 +273,13 @@ class RegistrationSerializer(serializers.ModelSerializer):
     )
     
     token = serializers.CharField(max_length=255, read_only=True)
+    refresh_token = serializers.CharField(max_length=255, read_only=True)
 
     class Meta:
         model = User 
         # List all of the fields  that could be included in a request
         # or response 
-        fields = ['email', 'password', 'token']
+        fields = ['email', 'password', 'token', 'refresh_token']
     
     def create(self, validated_data):
         return User.objects.create_user(**validated_data)
@@ -112,10 +290,15 @@ class UserSpaceSerializer(serializers.ModelSerializer):
         model = UserSpace
         fields = ['available', 'user']
 
-class RootSpaceSerializer(serializers.ModelSerializer):
+class RootSpaceSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    prefetch_related_fields = {
+        'userspaces': lambda: Prefetch(
+            'userspaces', queryset=sharding.select_global(UserSpace.objects.all(), 'user')),
+    }
+
     name = serializers.CharField(max_length=50, required=True)
     id = serializers.IntegerField(allow_null=True, read_only=True)
-    userspaces = UserSpaceSerializer(many=True)
+    userspaces = UserSpaceSerializer(many=True, read_only=True)
 
     class Meta:
         fields = ['name', 'id', 'userspaces']
@@ -126,25 +309,42 @@ class RootSpaceSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         name = validated_data.get('name')
         creator = validated_data.get('creator')
-        space = Space.objects.create(name=name)
-        space.members.add(creator)
+
+        # New households are spread across the shards taking them
+        with sharding.using_shard(sharding.pick_shard()):
+            space = Space.objects.create(name=name)
+            space.members.add(creator)
         
         return space
 
 
 # Serializes child spaces
-class SpaceSerializer(serializers.ModelSerializer):
+class SpaceSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    prefetch_related_fields = RootSpaceSerializer.prefetch_related_fields
+    computed_fields = {
+        'full_name': ('name', 'parent'),
+    }
+
+    # Spaces listed together share ancestors, which are then fetched
+    # once for the whole list rather than once for each space
+    computed_prefetches = {
+        'full_name': ('parent',),
+    }
+
     name = serializers.CharField(max_length=50, required=True)
     full_name = serializers.CharField(max_length=600, read_only=True)
     id = serializers.IntegerField(allow_null=True, read_only=True)
     parent_id = serializers.IntegerField(allow_null=True)
     
-    userspaces = UserSpaceSerializer(many=True)
+    userspaces = UserSpaceSerializer(many=True, read_only=True)
 
     class Meta:
-        fields = ['name', 'id', 'userspaces']
+        fields = ['name', 'full_name', 'id', 'parent_id', 'userspaces']
         model = Space
 
+    def validate_parent_id(self, value):
+        return _validate_membership(self, value)
+
     def update(self, instance, validated_data):
         parent_id = validated_data.get('parent_id', instance.parent.pk)
 
@@ -166,13 +366,50 @@ class SpaceSerializer(serializers.ModelSerializer):
             pass
         space = Space.objects.create(name=name, parent=parent)
         space.initialize_members_from_parent_space()       
+
+        # Render the members the space inherited without a query each
+        prefetch_related_objects([space], *map(self.get_prefetch, self.prefetch_related_fields))
         return space
 
+
+class SpaceCloneSerializer(serializers.Serializer):
+    """
+    Validates the options of a copy of a space's subtree, see 
+    tracker.cloning. Membership of the parent is checked by the view
+    """
+    name_error = 'Name must be between 1 and 50 characters.'
+
+    parent_id = serializers.IntegerField(required=False, allow_null=True)
+    name = serializers.CharField(max_length=50, required=False, allow_null=True, error_messages={
+        'blank': name_error, 'max_length': name_error, 'invalid': name_error})
+    members = serializers.BooleanField(default=False)
+    rosters = serializers.BooleanField(default=False)
+
+
+class ChoreBulkCreateSerializer(serializers.ListSerializer):
+    """
+    Creates the chores passed to ChoreListSerializer with many=True in
+    bulk, along with their rosters and first next users
+    """
+    def create(self, validated_data):
+        chores = Chore.create_bulk([self.child.build(item) for item in validated_data])
+
+        # Users are global, and read for every chore in one query
+        prefetch_related_objects(chores, 'next_user', 'last_user')
+        return chores
+
+
 # Serializes list of chores
-class ChoreListSerializer(serializers.Serializer):
+class ChoreListSerializer(SparseFieldsMixin, serializers.Serializer):
+    select_related_fields = {
+        'next_user': 'next_user',
+        'last_user': 'last_user',
+    }
+
     name = serializers.CharField(max_length=50, required=True)
     parent_space_id = serializers.IntegerField(required=True)
     interval = serializers.IntegerField(required=False)
+    recurrence = serializers.CharField(required=False, allow_blank=True)
     id = serializers.IntegerField(read_only=True)
 
     next_date = serializers.DateField(read_only=True)
@@ -181,10 +418,28 @@ class ChoreListSerializer(serializers.Serializer):
     next_user = UserEmailSerializer(read_only=True)
     last_user = UserEmailSerializer(read_only=True)
 
+    def validate_parent_space_id(self, value):
+        return _validate_membership(self, value)
+
+    def validate_recurrence(self, value):
+        if not value:
+            return ''
+        try:
+            rule = parse_recurrence(value)
+        except ValueError as error:
+            raise serializers.ValidationError(str(error))
+
+        # Intervals and ordinals are counted from the day the rule is set
+        # unless it says otherwise
+        if rule.start is None:
+            rule.start = datetime.date.today()
+        return str(rule)
+
     def update(self, instance, validated_data):
         parent_space_id = validated_data.get('parent_id', instance.parent_space.pk)
         instance.name = validated_data.get('name', instance.name)
         instance.interval = validated_data.get('interval', instance.interval)
+        instance.recurrence = validated_data.get('recurrence', instance.recurrence)
         instance.parent = Space.objects.get(pk=parent_space_id)
         
         instance.get_next_user()
@@ -192,17 +447,37 @@ class ChoreListSerializer(serializers.Serializer):
         instance.refresh_from_db()
         return instance
 
-    def create(self, validated_data):
-        parent_space_id = validated_data.get('parent_space_id')
-        name = validated_data.get('name')
+    class Meta:
+        list_serializer_class = ChoreBulkCreateSerializer
+
+    def build(self, validated_data):
+        """
+        Returns an unsaved chore from validated_data
+        """
         interval = validated_data.get('interval')
-        parent_space = Space.objects.get(pk=parent_space_id)
-        
-        instance = None
-        if(interval): instance = Chore.objects.create(name=name, interval=interval, parent_space=parent_space)
-        else: instance = Chore.objects.create(name=name, parent_space=parent_space)
-        instance._initialize_users()
-        instance.get_next_user()
+        recurrence = validated_data.get('recurrence', '')
+
+        instance = Chore(
+            name=validated_data.get('name'), recurrence=recurrence,
+            parent_space_id=validated_data.get('parent_space_id'))
+        if(interval): instance.interval = interval
+
+        # Chores that recur by rule are first due on its first occurrence
+        if(recurrence): instance.next_date = next(
+            instance.occurrences(datetime.date.today()), instance.next_date)
+        return instance
+
+    def create(self, validated_data):
+        instance = self.build(validated_data)
+
+        # The chore's roster and first next user are set up in the 
+        # background, and may not be there yet when it is rendered. The
+        # task is queued on the chore's shard along with it, so that it
+        # is queued if and only if the chore is saved
+        shard = sharding.current_shard()
+        with transaction.atomic(using=shard):
+            instance.save(using=shard)
+            tasks.enqueue(tasks.initialize_chore, chore_id=instance.pk)
 
         instance.refresh_from_db()
         return instance
@@ -215,16 +490,74 @@ class RequestSerializer(serializers.Serializer):
 
     created_date = serializers.DateField(read_only=True)
 
+    def validate_space_id(self, value):
+        return _validate_membership(self, value)
+
     def create(self, validated_data):
         space_id = validated_data.get('space_id')
         from_user = validated_data.get('from_user')
         to_user = validated_data.get('to_user')
 
-        from_user = User.objects.get(email=from_user["email"])
+        # Requests are sent by the requesting user, whose membership of 
+        # the space has been checked
+        request = self.context.get('request')
+        if request is not None:
+            from_user = request.user
+        else:
+            from_user = User.objects.get(email=from_user["email"])
         to_user = User.objects.get(email=to_user["email"])
-        space = Space.objects.get(pk=space_id)
 
-        return Request.objects.create(from_user=from_user, to_user=to_user, space=space)
+        return Request.objects.create(from_user=from_user, to_user=to_user, space_id=space_id)
+
+class MemberStatsSerializer(serializers.ModelSerializer):
+    """
+    Serializes a member's stats in a space. Shares and spreads are worked
+    out against the totals over every member of the space, passed in the
+    context as 'totals'
+    """
+    user = UserEmailSerializer(read_only=True)
+    vwork_spread = serializers.SerializerMethodField()
+    share = serializers.SerializerMethodField()
+    fair_share = serializers.SerializerMethodField()
+
+    class Meta:
+        model = MemberStats
+        fields = ['user', 'chores', 'completions', 'vwork', 'vwork_spread', 'share', 'fair_share']
+
+    def get_vwork_spread(self, stats):
+        """
+        How far ahead of the member with the least vwork this member is
+        """
+        return stats.vwork - self.context['totals']['min_vwork']
+
+    def get_share(self, stats):
+        total = self.context['totals']['completions']
+        return stats.completions / total if total else None
+
+    def get_fair_share(self, stats):
+        total = self.context['totals']['weight']
+        return stats.weight / total if total else None
+
+
+class BatchSerializer(serializers.Serializer):
+    """
+    Validates a batch of sub-requests. The sub-requests themselves are 
+    checked as they are dispatched, each failing on its own
+    """
+    requests_error = 'A list of requests is required.'
+
+    requests = serializers.ListField(error_messages={
+        'required': requests_error, 'null': requests_error, 'not_a_list': requests_error})
+    atomic = serializers.BooleanField(default=False)
+
+    def validate_requests(self, value):
+        max_requests = getattr(settings, 'TRACKER_BATCH_MAX_REQUESTS', 20)
+        if len(value) > max_requests:
+            raise serializers.ValidationError(
+                'At most %d requests may be batched.' % max_requests
+            )
+        return value
+
 
 class UserCalendarSerializer(serializers.Serializer):
     #TODO: define calendar serializer
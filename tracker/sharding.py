@@ -0,0 +1,294 @@
+"""
+Spreads households, ie. root spaces along with everything under them,
+across the databases listed in TRACKER_SHARDS. Users are global and
+kept on the default database, which is also the first shard.
+
+Queries for sharded models go to the shard active in the current
+context, or to the shard of the instance they are made through. Views
+activate the shard of the space they act on once IsSpaceMember has
+found it. Lists spanning every household of a user are read from each
+shard in turn.
+
+A household's shard is wherever its root space is found; there is no
+directory to keep up to date. Rows in sharded tables draw their ids from
+a range reserved for each shard, TRACKER_SHARD_ID_SPAN ids wide, so that
+ids stay unique across shards and households keep them when they are
+moved with move_household
+"""
+import contextvars
+import functools
+import random
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models.signals import post_migrate
+from django.dispatch import receiver
+
+
+# Models stored with the household they belong to. Everything else is
+# global
+SHARDED_MODELS = {
+    'space', 'chore', 'userchore', 'userspace', 'request', 'changelog', 'chorecompletion',
+    'memberstats', 'task',
+}
+
+_current_shard = contextvars.ContextVar('current_shard', default=None)
+
+
+def get_shards():
+    return getattr(settings, 'TRACKER_SHARDS', [DEFAULT_DB_ALIAS])
+
+
+def is_sharded(model):
+    return model._meta.app_label == 'tracker' and model._meta.model_name in SHARDED_MODELS
+
+
+def current_shard():
+    return _current_shard.get() or DEFAULT_DB_ALIAS
+
+
+def activate(shard):
+    """
+    Send queries for sharded models to shard for the rest of the current
+    context. ShardRoutingMiddleware gives each request its own context
+    """
+    _current_shard.set(shard)
+
+
+@contextmanager
+def using_shard(shard):
+    """
+    Send queries for sharded models made inside the block to shard
+    """
+    token = _current_shard.set(shard)
+    try:
+        yield
+    finally:
+        _current_shard.reset(token)
+
+
+def on_instance_shard(method):
+    """
+    Run a model method with the shard of the instance it is called on
+    active, for the queries it makes through managers rather than
+    through the instance's relations
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with using_shard(self._state.db or current_shard()):
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+def pick_shard():
+    """
+    Returns the shard to create a new household on, one of
+    TRACKER_NEW_HOUSEHOLD_SHARDS picked at random
+    """
+    return random.choice(getattr(settings, 'TRACKER_NEW_HOUSEHOLD_SHARDS', None) or get_shards())
+
+
+def find(queryset):
+    """
+    Returns the first object matched by queryset on any shard, or None.
+    The object's shard is its _state.db
+    """
+    for shard in get_shards():
+        instance = queryset.using(shard).first()
+        if instance is not None:
+            return instance
+    return None
+
+
+def on_each_shard(function, *args, **kwargs):
+    """
+    Call function once with each shard active, returning a list of
+    (shard, result) tuples
+    """
+    results = []
+    for shard in get_shards():
+        with using_shard(shard):
+            results.append((shard, function(*args, **kwargs)))
+    return results
+
+
+def collect_from_shards(function, *args, **kwargs):
+    """
+    Call function, which must return a list, once with each shard 
+    active and return the concatenation of the lists
+    """
+    return [item for shard, items in on_each_shard(function, *args, **kwargs) for item in items]
+
+
+def select_global(queryset, *relations):
+    """
+    Returns queryset following relations to global models, such as
+    users. They are joined while there is a single shard, and prefetched
+    from the default database once there are more, since shards other
+    than the default don't hold them
+    """
+    if len(get_shards()) > 1:
+        return queryset.prefetch_related(*relations)
+    return queryset.select_related(*relations)
+
+
+@contextmanager
+def atomic_on_all_shards():
+    """
+    A transaction on each shard. They are committed one after the other,
+    so a failure while committing may leave some of them committed
+    """
+    with ExitStack() as stack:
+        for shard in get_shards():
+            stack.enter_context(transaction.atomic(using=shard))
+        yield
+
+
+class ShardRouter:
+    """
+    Routes queries for sharded models to the shard of the instance they
+    are made through, or else to the current shard. Queries for the
+    default shard and for global models are left to the routers that
+    follow, which may send reads to replicas
+    """
+    def _shard_for(self, model, hints):
+        if not is_sharded(model):
+            return None
+
+        # Global instances, such as users, say nothing about the shard
+        instance = hints.get('instance')
+        if instance is not None and is_sharded(type(instance)) and instance._state.db:
+            shard = instance._state.db
+        else:
+            shard = current_shard()
+
+        # Instances read from replicas of the default shard are written
+        # back to it
+        if shard in getattr(settings, 'TRACKER_DATABASE_REPLICAS', []):
+            shard = DEFAULT_DB_ALIAS
+        return None if shard == DEFAULT_DB_ALIAS else shard
+
+    def db_for_read(self, model, **hints):
+        return self._shard_for(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._shard_for(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Sharded rows refer to global users, and users to rows on
+        # every shard
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        # Every database but the replicas has every table, so that it can
+        # be listed as a shard, and shards promoted to be the default
+        if db in getattr(settings, 'TRACKER_DATABASE_REPLICAS', []):
+            return None
+        return True
+
+
+def reserve_id_range(shard):
+    """
+    Moves the id sequences of the sharded tables on shard to the start
+    of the shard's range, unless they are already past it
+    """
+    from django.apps import apps
+
+    start = get_shards().index(shard) * getattr(settings, 'TRACKER_SHARD_ID_SPAN', 10 ** 12)
+    if not start:
+        return
+
+    connection = connections[shard]
+    tables = [model._meta.db_table for model in apps.get_app_config('tracker').get_models()
+              if is_sharded(model)]
+    with connection.cursor() as cursor:
+        for table in tables:
+            if connection.vendor == 'postgresql':
+                cursor.execute(
+                    "SELECT setval(pg_get_serial_sequence(%s, 'id'), "
+                    "GREATEST(%s, (SELECT COALESCE(MAX(id), 0) FROM {})))".format(
+                        connection.ops.quote_name(table)),
+                    [table, start])
+            elif connection.vendor == 'sqlite':
+                cursor.execute('UPDATE sqlite_sequence SET seq = MAX(seq, %s) WHERE name = %s',
+                               [start, table])
+                if not cursor.rowcount:
+                    cursor.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)',
+                                   [table, start])
+
+
+@receiver(post_migrate)
+def reserve_id_ranges(sender, using, **kwargs):
+    if sender.name == 'tracker' and using in get_shards():
+        reserve_id_range(using)
+
+
+def move_household(root_space_id, target):
+    """
+    Copies the household under the root space root_space_id to the
+    shard target, keeping every id, and deletes it from its current
+    shard. Returns the shard it was moved from, and the number of rows
+    moved for each model.
+
+    The moved rows are logged as updated on target, so that syncing
+    clients pick them up there. Households are expected to be quiet
+    while they are moved: writes made to them on their old shard in
+    the meantime, and tasks queued for them there, are lost
+    """
+    from tracker.models import (Space, Chore, UserChore, UserSpace, Request,
+                                ChangeLog, ChoreCompletion, MemberStats, _change_entry)
+
+    root = find(Space.objects.filter(pk=root_space_id, parent=None))
+    if root is None:
+        raise ValueError('No household has the root space %s' % root_space_id)
+    source = root._state.db
+    if source == target:
+        return source, {}
+
+    with transaction.atomic(using=target), transaction.atomic(using=source):
+        space_ids = Space.objects.db_manager(source).subtree_ids(root)
+        querysets = [
+            Space.objects.filter(pk__in=space_ids),
+            Chore.objects.filter(parent_space_id__in=space_ids),
+            UserSpace.objects.filter(space_id__in=space_ids),
+            UserChore.objects.filter(chore__parent_space_id__in=space_ids),
+            Request.objects.filter(space_id__in=space_ids),
+        ]
+        rows = [list(queryset.using(source)) for queryset in querysets]
+
+        # Chores are logged with the space they are in, so that they
+        # can be logged without reading them back
+        chores = {chore.pk: chore for chore in rows[1]}
+        for userchore in rows[3]:
+            userchore.chore = chores[userchore.chore_id]
+
+        moved = {}
+        for model_rows in rows:
+            if model_rows:
+                model = type(model_rows[0])
+                model.objects.using(target).bulk_create(model_rows)
+                moved[model._meta.model_name] = len(model_rows)
+
+        ChangeLog.objects.using(target).bulk_create([
+            _change_entry(row, ChangeLog.UPDATED) for model_rows in rows for row in model_rows])
+
+        # Completions and stats aren't synced to clients, so they aren't
+        # logged
+        unlogged = [
+            ChoreCompletion.objects.filter(space_id__in=space_ids),
+            MemberStats.objects.filter(space_id__in=space_ids),
+        ]
+        for queryset in unlogged:
+            model_rows = queryset.model.objects.using(target).bulk_create(
+                queryset.using(source).iterator(), batch_size=1000)
+            if model_rows:
+                moved[queryset.model._meta.model_name] = len(model_rows)
+
+        # Deleting without signals leaves the moved rows unlogged on the
+        # old shard, where clients would otherwise read them as deleted.
+        # Children go before their parents
+        for queryset in unlogged + querysets[::-1]:
+            queryset.using(source)._raw_delete(source)
+
+    return source, moved
@@ -0,0 +1,125 @@
+"""
+Fairness statistics for the members of each space, over the chores in
+its whole subtree, kept in MemberStats rollups so that reading them is a
+single indexed lookup.
+
+Completions are counted into the rollups as they are made, by
+Chore.mark_complete. Changes to memberships and rosters queue a recount
+of the rollups they touch. reconcile_stats recounts every household,
+correcting whatever the incremental updates miss, such as chores that
+were deleted, and is meant to be run periodically
+"""
+from django.db import transaction
+from django.db.models import Count, ExpressionWrapper, F, FloatField, Sum
+from django.db.models.functions import NullIf
+from django.db.models.signals import m2m_changed
+from django.dispatch import receiver
+
+from tracker import sharding, tasks
+from tracker.models import (Chore, MemberStats, Space, UserChore, UserSpace,
+                            users_assigned)
+
+
+def refresh(space_ids, user_ids=None):
+    """
+    Recount the rollups of the members user_ids, or of every member, in
+    the spaces space_ids on the current shard from their chores
+    """
+    space_ids = set(space_ids)
+    subtrees = Space.objects.subtrees(space_ids)
+
+    members = UserSpace.objects.filter(space_id__in=space_ids)
+    if user_ids is not None:
+        members = members.filter(user_id__in=user_ids)
+    members = list(members.values_list('space_id', 'user_id'))
+
+    # Totals for each member over the chores directly in each space, 
+    # which are then summed over every subtree
+    totals = {}
+    if members:
+        rows = (UserChore.objects
+            .filter(chore__parent_space_id__in=set().union(*subtrees.values()),
+                    user_id__in={user_id for _, user_id in members})
+            .values_list('chore__parent_space_id', 'user_id')
+            .annotate(
+                chores=Count('id'),
+                completions=Sum('work'),
+                vwork=Sum(ExpressionWrapper(
+                    F('work') * F('delta_src') / 100.0, output_field=FloatField())),
+                # Members whose chores add no vwork have no weight on 
+                # them, rather than failing the division
+                weight=Sum(ExpressionWrapper(
+                    100.0 / NullIf(F('delta_src'), 0), output_field=FloatField()))))
+        for space_id, user_id, *values in rows:
+            totals[(space_id, user_id)] = values
+
+    stats = []
+    for space_id, user_id in members:
+        values = [0, 0, 0.0, 0.0]
+        for descendant in subtrees.get(space_id, ()):
+            for i, value in enumerate(totals.get((descendant, user_id), ())):
+                values[i] += value or 0
+        chores, completions, vwork, weight = values
+        stats.append(MemberStats(
+            space_id=space_id, user_id=user_id, chores=chores,
+            completions=completions, vwork=vwork, weight=weight))
+
+    stale = MemberStats.objects.filter(space_id__in=space_ids)
+    if user_ids is not None:
+        stale = stale.filter(user_id__in=user_ids)
+    with transaction.atomic(using=sharding.current_shard()):
+        stale.delete()
+        MemberStats.objects.bulk_create(stats)
+
+
+def reconcile(root_space):
+    """
+    Recount every rollup in the household under root_space
+    """
+    refresh(Space.objects.subtree_ids(root_space))
+
+
+@tasks.task
+def refresh_member_stats(space_ids, user_ids, chore_spaces=False):
+    """
+    Recount the rollups of user_ids in space_ids, or if chore_spaces is
+    set, in the spaces holding chores space_ids and every space above
+    """
+    if chore_spaces:
+        space_ids = Space.objects.ancestor_ids(space_ids)
+    refresh(space_ids, user_ids)
+
+
+def _queue_refresh(using, space_ids, user_ids, chore_spaces=False):
+    with sharding.using_shard(using):
+        tasks.enqueue(refresh_member_stats, space_ids=sorted(space_ids),
+                      user_ids=sorted(user_ids), chore_spaces=chore_spaces)
+
+
+@receiver(m2m_changed, sender=UserSpace)
+def memberships_changed(sender, instance, action, reverse, pk_set, using=None, **kwargs):
+    if action not in ('post_add', 'post_remove') or not pk_set:
+        return
+    if reverse:
+        _queue_refresh(using, pk_set, [instance.pk])
+    else:
+        _queue_refresh(using, [instance.pk], pk_set)
+
+
+@receiver(m2m_changed, sender=UserChore)
+def rosters_changed(sender, instance, action, reverse, pk_set, using=None, **kwargs):
+    if action not in ('post_add', 'post_remove') or not pk_set:
+        return
+    if reverse:
+        chore_spaces = Chore.objects.using(using).filter(pk__in=pk_set).values_list(
+            'parent_space_id', flat=True)
+        _queue_refresh(using, set(chore_spaces), [instance.pk], chore_spaces=True)
+    else:
+        _queue_refresh(using, [instance.parent_space_id], pk_set, chore_spaces=True)
+
+
+@receiver(users_assigned, sender=Chore)
+def users_assigned_to_chores(sender, chores, user_ids, **kwargs):
+    if chores and user_ids:
+        _queue_refresh(chores[0]._state.db, {chore.parent_space_id for chore in chores},
+                       user_ids, chore_spaces=True)
@@ -0,0 +1,175 @@
+"""
+Builds the incremental updates served by the sync endpoint from the 
+change log, so that clients holding a cursor only download what 
+changed since they last synced.
+"""
+import datetime
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from tracker import sharding
+from tracker.models import (ChangeLog, Space, Chore, Request,
+                            UserSpace, UserChore)
+
+
+# Models served by sync, mapped to the columns sent for each of their
+# records
+SYNC_MODELS = {
+    'space': (Space, ('id', 'name', 'parent_id')),
+    'chore': (Chore, ('id', 'name', 'parent_space_id', 'interval', 'recurrence',
+                      'next_date', 'last_date', 'next_user_id', 'last_user_id')),
+    'userchore': (UserChore, ('id', 'chore_id', 'user_id', 'vwork',
+                              'work', 'delta_src', 'available')),
+    'userspace': (UserSpace, ('id', 'space_id', 'user_id', 'available')),
+    'request': (Request, ('id', 'from_user_id', 'to_user_id', 'space_id',
+                          'created_date')),
+}
+
+
+def parse_cursor(value):
+    """
+    Returns the cursor a client passed as a dictionary mapping each
+    shard to the last change log id read from it. Cursors are plain ids
+    while there is a single shard; a plain id passed once there are more
+    applies to every shard. Raises ValueError if value isn't a cursor
+    """
+    shards = sharding.get_shards()
+    if ':' not in value:
+        return dict.fromkeys(shards, int(value or 0))
+
+    cursor = dict.fromkeys(shards, 0)
+    for part in value.split(','):
+        shard, pk = part.rsplit(':', 1)
+        if shard not in cursor:
+            raise ValueError('No such shard: %s' % shard)
+        cursor[shard] = int(pk)
+    return cursor
+
+
+def format_cursor(cursor):
+    """
+    Returns the cursor to hand to clients for a dictionary mapping
+    shards to change log ids
+    """
+    if len(cursor) == 1:
+        return next(iter(cursor.values()))
+    return ','.join('%s:%d' % item for item in cursor.items())
+
+
+def get_changes(user, accessible_space_ids, since=0):
+    """
+    Returns a dictionary describing the changes visible to user that 
+    were logged after the cursor since, a dictionary as returned by
+    parse_cursor or a change log id applying to every shard:
+        cursor: the cursor to pass in the next sync 
+        reset: True if the log no longer reaches back to since, in which
+            case the client must download its lists in full 
+        spaces: ids of the spaces the user currently has access to.
+            Records outside these spaces should be dropped by the client
+        changes: for each model, lists of created and updated records 
+            and of the ids of deleted records
+
+    Concurrent transactions may commit entries out of id order, so an
+    entry read may have been given its id after one that is still to be
+    committed. The cursor only advances past entries logged more than
+    TRACKER_SYNC_SETTLE_SECONDS ago, which no uncommitted entry is
+    assumed to precede. Entries logged since are sent, and sent again
+    by the next sync, along with any committed before them in the
+    meantime.
+
+    Each shard's log is read separately. A record reported deleted by
+    one shard and present on another has been moved with its household,
+    and is reported updated
+    """
+    if not isinstance(since, dict):
+        since = dict.fromkeys(sharding.get_shards(), since)
+
+    cursor, reset = {}, False
+    changes = {name: {'created': {}, 'updated': {}, 'deleted': set()} for name in SYNC_MODELS}
+    for shard in sharding.get_shards():
+        cursor[shard], shard_reset, shard_changes = _get_shard_changes(
+            user, accessible_space_ids, since.get(shard, 0), shard)
+        reset = reset or shard_reset
+        for name, (created, updated, deleted) in shard_changes.items():
+            changes[name]['created'].update(created)
+            changes[name]['updated'].update(updated)
+            changes[name]['deleted'] |= deleted
+
+    for name, model_changes in changes.items():
+        created, updated = model_changes['created'], model_changes['updated']
+        for pk in set(created) & set(updated):
+            del created[pk]
+        changes[name] = {
+            'created': [created[pk] for pk in sorted(created)],
+            'updated': [updated[pk] for pk in sorted(updated)],
+            'deleted': sorted(model_changes['deleted'] - set(created) - set(updated)),
+        }
+
+    return {
+        'cursor': format_cursor(cursor),
+        'reset': reset,
+        'spaces': sorted(accessible_space_ids),
+        'changes': changes,
+    }
+
+
+def _get_shard_changes(user, accessible_space_ids, since, shard):
+    """
+    Returns the cursor reached on shard, whether its log no longer
+    reaches back to since, and for each model, dictionaries of the
+    created and updated records by id and the set of deleted ids
+    """
+    log = ChangeLog.objects.using(shard)
+    oldest = log.values_list('pk', flat=True).first()
+    reset = bool(since and oldest and since < oldest - 1)
+
+    entries = log.filter(pk__gt=since).filter(
+        Q(space_id__in=accessible_space_ids) | Q(user_id=user.pk)
+    ).values_list('pk', 'model', 'object_id', 'action', 'created_at')
+    settled = timezone.now() - datetime.timedelta(
+        seconds=getattr(settings, 'TRACKER_SYNC_SETTLE_SECONDS', 30))
+
+    # Collapse the entries of each record into the first and last 
+    # actions taken on it
+    cursor, settling = since, False
+    actions = {}
+    for pk, model, object_id, action, created_at in entries:
+        settling = settling or created_at > settled
+        if not settling:
+            cursor = pk
+        first, _ = actions.get((model, object_id), (action, None))
+        actions[(model, object_id)] = (first, action)
+
+    changes = {}
+    for name, (model, columns) in SYNC_MODELS.items():
+        created, updated, deleted = set(), set(), set()
+        for (model_name, object_id), (first, last) in actions.items():
+            if model_name != name:
+                continue
+            if last == ChangeLog.DELETED:
+                deleted.add(object_id)
+            elif first == ChangeLog.CREATED:
+                created.add(object_id)
+            else:
+                updated.add(object_id)
+
+        records = {}
+        if created or updated:
+            records = {
+                record['id']: record for record in 
+                model.objects.using(shard).filter(pk__in=created | updated).values(*columns)
+            }
+
+        # Records that are gone without their deletion being logged
+        # are reported deleted
+        deleted |= (created | updated) - set(records)
+
+        changes[name] = (
+            {pk: records[pk] for pk in created if pk in records},
+            {pk: records[pk] for pk in updated if pk in records},
+            deleted,
+        )
+
+    return cursor, reset, changes
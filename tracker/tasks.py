@@ -0,0 +1,193 @@
+"""
+Runs the work that follows from a write, such as setting up a new
+chore's roster or spreading a new member down a space's subtree, outside
+the request that made the write.
+
+How queued tasks are run is picked by TRACKER_TASK_BACKEND:
+    immediate: at once, inline, as if they had been called directly
+    thread: on a pool of TRACKER_TASK_THREADS threads, once the
+        transaction that queued them commits. Meant for development, as
+        tasks queued in a process are lost if it exits
+    database: by the run_tasks command, from the Task table of the shard
+        they were queued on
+
+Tasks are called with the shard that was current when they were queued
+active. They may be run more than once, and may find the rows they were
+queued for changed or gone, so they must be idempotent
+"""
+import datetime
+import logging
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, transaction
+from django.utils import timezone
+
+from tracker import sharding
+from tracker.metrics import TASKS, TASK_LATENCY
+from tracker.models import Chore, Space, Task, User, UserSpace
+
+
+logger = logging.getLogger('tracker.tasks')
+
+# Tasks by name
+_tasks = {}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def task(function):
+    """
+    Register function as a task that can be queued by name
+    """
+    _tasks[function.__name__] = function
+    return function
+
+
+def enqueue(function, **arguments):
+    """
+    Queue a call of the task function with arguments, which must be JSON
+    serializable, on the current shard
+    """
+    backend = getattr(settings, 'TRACKER_TASK_BACKEND', 'immediate')
+    name = function.__name__
+    shard = sharding.current_shard()
+
+    if backend == 'immediate':
+        run(name, arguments, shard)
+    elif backend == 'thread':
+        transaction.on_commit(
+            lambda: _get_executor().submit(_run_in_thread, name, arguments, shard), using=shard)
+    elif backend == 'database':
+        Task.objects.using(shard).create(name=name, arguments=arguments)
+    else:
+        raise ImproperlyConfigured('Unknown TRACKER_TASK_BACKEND "%s"' % backend)
+
+
+def run(name, arguments, shard):
+    """
+    Call the task name with arguments and shard active, raising whatever
+    it raises
+    """
+    start = time.perf_counter()
+    try:
+        with sharding.using_shard(shard):
+            _tasks[name](**arguments)
+    except Exception:
+        TASKS.inc(task=name, outcome='failed')
+        raise
+    finally:
+        TASK_LATENCY.observe(time.perf_counter() - start, task=name)
+    TASKS.inc(task=name, outcome='succeeded')
+
+
+def run_due(limit=100):
+    """
+    Run up to limit of the tasks due on the current shard, oldest first,
+    and return the number run. Each task is run in one transaction with
+    its removal from the queue, holding a lock on its row that workers
+    running alongside skip
+    """
+    shard = sharding.current_shard()
+    count = 0
+    while count < limit:
+        with transaction.atomic(using=shard):
+            queued = (Task.objects.using(shard)
+                .select_for_update(skip_locked=True)
+                .filter(failed=False, run_at__lte=timezone.now())
+                .order_by('run_at', 'pk')
+                .first())
+            if queued is None:
+                break
+
+            try:
+                with transaction.atomic(using=shard):
+                    run(queued.name, queued.arguments, shard)
+            except Exception:
+                _retry_later(queued, traceback.format_exc())
+            else:
+                queued.delete()
+        count += 1
+    return count
+
+
+def _retry_later(task, error):
+    """
+    Push task back by TRACKER_TASK_RETRY_DELAY seconds, doubling with
+    each attempt, or give up on it after TRACKER_TASK_MAX_ATTEMPTS
+    """
+    task.attempts += 1
+    task.last_error = error
+    task.failed = task.attempts >= getattr(settings, 'TRACKER_TASK_MAX_ATTEMPTS', 5)
+    task.run_at = timezone.now() + datetime.timedelta(
+        seconds=getattr(settings, 'TRACKER_TASK_RETRY_DELAY', 10) * 2 ** (task.attempts - 1))
+    task.save(update_fields=['attempts', 'last_error', 'failed', 'run_at'])
+
+    if task.failed:
+        logger.error('Task %s %s failed for good: %s', task.name, task.arguments, error)
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'TRACKER_TASK_THREADS', 4),
+                thread_name_prefix='tracker-task')
+    return _executor
+
+
+def _run_in_thread(name, arguments, shard):
+    try:
+        run(name, arguments, shard)
+    except Exception:
+        logger.exception('Task %s %s failed', name, arguments)
+    finally:
+        # Connections are opened per thread, and pool threads outlive
+        # the tasks they run
+        connections.close_all()
+
+
+@task
+def initialize_chore(chore_id):
+    """
+    Assign a new chore to the members of its space, and pick its first
+    next user
+    """
+    chore = Chore.objects.filter(pk=chore_id).first()
+    if chore is None:
+        return
+    chore._initialize_users()
+    chore.get_next_user()
+
+
+@task
+def propagate_member(space_id, user_id):
+    """
+    Add a user who joined a space to its subspaces, and to the chores in
+    all of them
+    """
+    space = Space.objects.filter(pk=space_id).first()
+    user = User.objects.filter(pk=user_id).first()
+    if space is None or user is None:
+        return
+    space.add_member(user)
+    space.assign_member_to_chores(user)
+
+
+@task
+def propagate_availability(space_id, user_id, available):
+    """
+    Set a user's availability in a space's subspaces, and on the chores
+    in all of them, and reschedule the chores they were next up for
+    """
+    userspace = UserSpace.objects.filter(space_id=space_id, user_id=user_id).first()
+    # A change made since this one was queued has queued its own task
+    if userspace is None or userspace.available != available:
+        return
+    userspace.propagate_availability()
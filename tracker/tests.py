@@ -1,6 +1,47 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import gzip
+import io
+import itertools
+import json
+import os
+import sys
+import tempfile
+from types import SimpleNamespace
+from urllib.parse import urlsplit
+from unittest import mock, skipUnless
 
-from tracker.models import User, Chore, Space
+from django.contrib.auth.hashers import make_password
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.db.models import BigAutoField, BigIntegerField, F
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from rest_framework import exceptions
+from rest_framework.test import APIClient
+
+from common.util.recurrence import parse as parse_recurrence
+
+from tracker import digests, feeds, partitions, retention, tasks
+from tracker.cloning import clone_subtree
+from tracker.stats import refresh as refresh_stats
+from tracker.models import (User, ChangeLog, Chore, ChoreCompletion, DigestDelivery, MemberStats,
+                            Space, Request, Task, UserChore, UserSpace)
+from tracker.partitions import add_months
+from tracker.events import get_channel_layer, sse_application
+from tracker.backends import JWTAuthentication
+from tracker.db import ReplicaRouter, check_connections, check_pin_cache, replica_reads
+from tracker.middleware import ReplicaRoutingMiddleware
+from tracker.querylog import QueryLog, query_shape
+from tracker.sharding import ShardRouter, is_sharded, reserve_id_range, using_shard
+from tracker.sync import format_cursor, parse_cursor
 
 # Create your tests here.
 class ModelTestCase(TestCase):
@@ -93,7 +134,7 @@ class ModelTestCase(TestCase):
         chore = Chore.objects.first()
         userchore = chore.userchore_set.first()
         space = Space.objects.get(name='root space')
-        userspace = space.userspace_set.get(user_id=userchore.user_id)
+        userspace = space.userspaces.get(user_id=userchore.user_id)
 
         userchore.increment_work()
         userchore.increment_work()
@@ -137,3 +178,1894 @@ class ModelTestCase(TestCase):
         self.assertEqual(userchore.chore.min_vwork, 6.0)
         self.assertEqual(userchore.vwork, 6.0)
 
+
+class SpacePermissionTestCase(TestCase):
+    def setUp(self):
+        self.member = User.objects.create_user(email="member@gmail.com", password="1234234Zo")
+        self.outsider = User.objects.create_user(email="outsider@gmail.com", password="1234234Zo")
+
+        self.root_space = Space.objects.create(name="root space")
+        self.root_space.members.add(self.member)
+        self.child_space = Space.objects.create(name="child space", parent=self.root_space)
+        self.grandchild_space = Space.objects.create(name="grandchild space", parent=self.child_space)
+
+        self.client = APIClient()
+
+    def test_accessible_ids(self):
+        """
+        Members of a space have access to every space in its subtree, 
+        and the whole subtree is loaded with a single query
+        """
+        with self.assertNumQueries(1):
+            accessible = Space.objects.accessible_ids(self.member)
+        self.assertEqual(accessible, {
+            self.root_space.pk, self.child_space.pk, self.grandchild_space.pk
+        })
+        self.assertEqual(Space.objects.accessible_ids(self.outsider), set())
+
+    def test_space_member_permission(self):
+        """
+        Only members may list the contents of a space, and spaces that 
+        do not exist are refused rather than raising
+        """
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.member.issue_token())
+        response = self.client.get('/api/space/%d/chores' % self.grandchild_space.pk)
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get('/api/space/%d/chores' % (self.grandchild_space.pk + 100))
+        self.assertEqual(response.status_code, 403)
+
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.outsider.issue_token())
+        response = self.client.get('/api/space/%d/subspaces/' % self.root_space.pk)
+        self.assertEqual(response.status_code, 403)
+
+
+class SparseFieldsTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email="user@gmail.com", password="1234234Zo")
+        self.space = Space.objects.create(name="root space")
+        self.space.members.add(self.user)
+        for i in range(3):
+            chore = Chore.objects.create(name="chore"+str(i), parent_space=self.space)
+            chore._initialize_users()
+            chore.get_next_user()
+
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.user.issue_token())
+
+    def test_default_fields(self):
+        """
+        Without sparse parameters every field is serialized and nested 
+        relations are expanded
+        """
+        response = self.client.get('/api/chore/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data[0]['next_user'], {'email': self.user.email})
+        self.assertIn('last_user', response.data[0])
+
+    def test_sparse_fields(self):
+        """
+        Only requested fields are serialized, and relations which aren't
+        expanded are rendered as primary keys
+        """
+        response = self.client.get('/api/chore/?fields=id,name,next_user&expand=')
+        self.assertEqual(set(response.data[0]), {'id', 'name', 'next_user'})
+        self.assertEqual(response.data[0]['next_user'], self.user.pk)
+
+        response = self.client.get('/api/space/?fields=id,name')
+        self.assertEqual(response.data, [{'id': self.space.pk, 'name': self.space.name}])
+
+
+class BatchTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email="user@gmail.com", password="1234234Zo")
+        self.space = Space.objects.create(name="root space")
+        self.space.members.add(self.user)
+
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.user.issue_token())
+
+    def test_batch(self):
+        """
+        Sub-requests are dispatched in order through the existing views
+        and their responses combined
+        """
+        response = self.client.post('/api/batch/', {'requests': [
+            {'method': 'GET', 'path': '/api/user/'},
+            {'method': 'POST', 'path': '/api/space/%d/chores' % self.space.pk,
+                'body': {'name': 'dishes'}},
+            {'method': 'GET', 'path': '/api/chore/?fields=name'},
+            {'method': 'GET', 'path': '/api/nowhere/'},
+        ]}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        statuses = [sub['status'] for sub in response.data['responses']]
+        self.assertEqual(statuses, [200, 201, 200, 404])
+        self.assertEqual(response.data['responses'][0]['body']['user']['email'], self.user.email)
+        self.assertEqual(response.data['responses'][2]['body'], [{'name': 'dishes'}])
+
+    def test_atomic_batch(self):
+        """
+        Atomic batches are rolled back if any of their sub-requests fail
+        """
+        response = self.client.post('/api/batch/', {'atomic': True, 'requests': [
+            {'method': 'POST', 'path': '/api/space/%d/chores' % self.space.pk,
+                'body': {'name': 'dishes'}},
+            {'method': 'POST', 'path': '/api/space/%d/chores' % (self.space.pk + 1),
+                'body': {'name': 'laundry'}},
+        ]}, format='json')
+
+        statuses = [sub['status'] for sub in response.data['responses']]
+        self.assertEqual(statuses, [201, 403])
+        self.assertEqual(Chore.objects.count(), 0)
+
+        # Flags sent as strings are parsed rather than taken as truthy
+        response = self.client.post('/api/batch/', {'atomic': 'false', 'requests': [
+            {'method': 'POST', 'path': '/api/space/%d/chores' % self.space.pk,
+                'body': {'name': 'dishes'}},
+            {'method': 'POST', 'path': '/api/space/%d/chores' % (self.space.pk + 1),
+                'body': {'name': 'laundry'}},
+        ]}, format='json')
+        self.assertEqual(Chore.objects.count(), 1)
+
+        response = self.client.post('/api/batch/', {'requests': 'dishes'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('requests', response.data['errors'])
+
+
+class SyncTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email="user@gmail.com", password="1234234Zo")
+        self.other = User.objects.create_user(email="other@gmail.com", password="1234234Zo")
+        self.space = Space.objects.create(name="root space")
+        self.space.members.add(self.user)
+        self.other_space = Space.objects.create(name="other space")
+        self.other_space.members.add(self.other)
+
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.user.issue_token())
+
+    @override_settings(TRACKER_SYNC_SETTLE_SECONDS=0)
+    def test_sync(self):
+        """
+        Syncing from a cursor returns only the changes made after it, 
+        and only those the user can see
+        """
+        cursor = self.client.get('/api/sync/').data['cursor']
+
+        chore = Chore.objects.create(name="dishes", parent_space=self.space)
+        chore._initialize_users()
+        Chore.objects.create(name="laundry", parent_space=self.other_space)
+
+        response = self.client.get('/api/sync/?since=%d' % cursor)
+        changes = response.data['changes']
+        self.assertEqual([record['name'] for record in changes['chore']['created']], ['dishes'])
+        self.assertEqual(len(changes['userchore']['created']), 1)
+
+        cursor = response.data['cursor']
+        chore.name = "dishes and pans"
+        chore.save()
+        Chore.objects.create(name="mopping", parent_space=self.space).delete()
+
+        response = self.client.get('/api/sync/?since=%d' % cursor)
+        changes = response.data['changes']
+        self.assertEqual([record['name'] for record in changes['chore']['updated']], ['dishes and pans'])
+        self.assertEqual(changes['chore']['created'], [])
+        self.assertEqual(len(changes['chore']['deleted']), 1)
+
+        # Rosters deleted along with their chore are logged in the 
+        # chore's space
+        cursor = response.data['cursor']
+        chore.delete()
+        changes = self.client.get('/api/sync/?since=%d' % cursor).data['changes']
+        self.assertEqual(len(changes['chore']['deleted']), 1)
+        self.assertEqual(len(changes['userchore']['deleted']), 1)
+
+    def test_interleaved_commits(self):
+        """
+        An entry committed after one with a higher id has been synced
+        is picked up by the next sync
+        """
+        cursor = self.client.get('/api/sync/').data['cursor']
+
+        # The first transaction logs its chore, but has yet to commit
+        # when the second one commits and the client syncs
+        early = Chore.objects.create(name="dishes", parent_space=self.space)
+        pending = list(ChangeLog.objects.filter(model='chore', object_id=early.pk))
+        ChangeLog.objects.filter(pk__in=[entry.pk for entry in pending]).delete()
+        Chore.objects.create(name="laundry", parent_space=self.space)
+
+        response = self.client.get('/api/sync/?since=%d' % cursor)
+        self.assertEqual(
+            [record['name'] for record in response.data['changes']['chore']['created']], ['laundry'])
+        cursor = response.data['cursor']
+
+        ChangeLog.objects.bulk_create(pending)
+        response = self.client.get('/api/sync/?since=%d' % cursor)
+        self.assertEqual(
+            [record['name'] for record in response.data['changes']['chore']['created']],
+            ['dishes', 'laundry'])
+
+        # Once entries have settled, the cursor moves past them
+        ChangeLog.objects.update(created_at=timezone.now() - datetime.timedelta(minutes=5))
+        response = self.client.get('/api/sync/?since=%d' % response.data['cursor'])
+        self.assertEqual(response.data['cursor'], ChangeLog.objects.last().pk)
+        changes = self.client.get('/api/sync/?since=%d' % response.data['cursor']).data['changes']
+        self.assertEqual(changes['chore']['created'], [])
+
+
+class EventsTestCase(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email="user@gmail.com", password="1234234Zo")
+        self.other = User.objects.create_user(email="other@gmail.com", password="1234234Zo")
+        self.space = Space.objects.create(name="root space")
+        self.space.members.add(self.user)
+
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def _subscribe(self, user):
+        async def subscribe():
+            return get_channel_layer().subscribe(user.pk)
+        return self.loop.run_until_complete(subscribe())
+
+    def _next_event(self, subscription):
+        return self.loop.run_until_complete(asyncio.wait_for(subscription.get(), 1))
+
+    def test_schedule_events(self):
+        """
+        Users on a chore's roster are told when it is rescheduled, and 
+        invitees when they receive a request
+        """
+        subscription = self._subscribe(self.user)
+        other_subscription = self._subscribe(self.other)
+
+        chore = Chore.objects.create(name="dishes", parent_space=self.space)
+        chore._initialize_users()
+        chore.get_next_user()
+
+        event = self._next_event(subscription)
+        self.assertEqual(event['type'], 'chore.scheduled')
+        self.assertEqual(event['next_user'], self.user.pk)
+
+        Request.objects.create(from_user=self.user, to_user=self.other, space=self.space)
+        self.assertEqual(self._next_event(other_subscription)['type'], 'request.created')
+        self.assertTrue(subscription.queue.empty())
+
+        get_channel_layer().unsubscribe(subscription)
+        get_channel_layer().unsubscribe(other_subscription)
+
+    def test_event_stream(self):
+        """
+        The event stream refuses unauthenticated clients, and streams 
+        events to authenticated ones until they disconnect
+        """
+        sent = []
+        async def send(message):
+            sent.append(message)
+            # Publish an event once the stream has started
+            if message['type'] == 'http.response.start' and message['status'] == 200:
+                get_channel_layer().publish([self.user.pk], {'type': 'chore.scheduled'})
+
+        async def receive():
+            # Disconnect once an event has been streamed
+            while len(sent) < 2:
+                await asyncio.sleep(0.01)
+            return {'type': 'http.disconnect'}
+
+        scope = {'type': 'http', 'path': '/api/events/', 'headers': [], 'query_string': b''}
+        self.loop.run_until_complete(sse_application(scope, receive, send))
+        self.assertEqual(sent[0]['status'], 401)
+
+        sent.clear()
+        scope['query_string'] = ('token=' + self.user.issue_token()).encode('utf-8')
+        self.loop.run_until_complete(sse_application(scope, receive, send))
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertTrue(sent[1]['body'].startswith(b'event: chore.scheduled'))
+
+
+class AuthenticationCacheTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email="user@gmail.com", password="1234234Zo")
+        self.token = self.user.issue_token()
+
+    def test_cached_authentication(self):
+        """
+        Once a token has been used, authenticating with it needs no 
+        queries until its user is saved
+        """
+        authentication = JWTAuthentication()
+        user, _ = authentication.authenticate_token(self.token)
+        self.assertEqual(user, self.user)
+
+        with self.assertNumQueries(0):
+            cached_user, _ = authentication.authenticate_token(self.token)
+        self.assertEqual(cached_user.email, self.user.email)
+        self.assertIsNot(cached_user, user)
+
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            authentication.authenticate_token(self.token)
+
+    def test_invalid_token(self):
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            JWTAuthentication().authenticate_token(self.token + 'x')
+
+    def test_token_reuse(self):
+        """
+        The same token is handed out until it nears expiry, and tokens 
+        are refused once revoked
+        """
+        self.assertEqual(self.user.issue_token(), self.token)
+        self.assertEqual(User.objects.get(pk=self.user.pk).token, self.token)
+
+        self.user.revoke_tokens()
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            JWTAuthentication().authenticate_token(self.token)
+
+        new_token = self.user.issue_token()
+        self.assertNotEqual(new_token, self.token)
+        user, _ = JWTAuthentication().authenticate_token(new_token)
+        self.assertEqual(user, self.user)
+
+    def test_reads_issue_no_tokens(self):
+        """
+        Reading a user writes nothing, even once their token is due for
+        renewal, which only logging in and refreshing do
+        """
+        self.user.token_issued_at -= datetime.timedelta(minutes=12)
+        self.user.save(update_fields=['token_issued_at'])
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + self.token)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get('/api/user/')
+        self.assertEqual(response.status_code, 200)
+        due = response.json()['user']['token']
+        self.assertEqual(due, self.user.token)
+        self.assertFalse([query for query in queries if query['sql'].startswith('UPDATE')])
+
+        response = client.post('/api/user/login/', {'user': {
+            'email': 'user@gmail.com', 'password': '1234234Zo'}}, format='json')
+        self.assertNotEqual(response.json()['user']['token'], due)
+
+    def test_refresh_token(self):
+        """
+        Logging in hands out a refresh token, which can be exchanged 
+        for access tokens but can't authenticate requests itself
+        """
+        client = APIClient()
+        response = client.post('/api/user/login/', {'user': {
+            'email': 'user@gmail.com', 'password': '1234234Zo'}}, format='json')
+        self.assertEqual(response.status_code, 200)
+        refresh_token = response.json()['user']['refresh_token']
+
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            JWTAuthentication().authenticate_token(refresh_token)
+
+        response = client.post('/api/user/refresh/', {'user': {
+            'refresh_token': refresh_token}}, format='json')
+        self.assertEqual(response.status_code, 200)
+        user, _ = JWTAuthentication().authenticate_token(response.json()['user']['token'])
+        self.assertEqual(user, self.user)
+
+        response = client.post('/api/user/refresh/', {'user': {
+            'refresh_token': self.token}}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+        self.user.revoke_tokens()
+        response = client.post('/api/user/refresh/', {'user': {
+            'refresh_token': refresh_token}}, format='json')
+        self.assertNotEqual(response.status_code, 200)
+
+    def test_refresh_revoked_elsewhere(self):
+        """
+        Refresh tokens revoked by another worker are refused at once,
+        though the user is still cached in this one
+        """
+        client = APIClient()
+        response = client.post('/api/user/login/', {'user': {
+            'email': 'user@gmail.com', 'password': '1234234Zo'}}, format='json')
+        refresh_token = response.json()['user']['refresh_token']
+        response = client.post('/api/user/refresh/', {'user': {
+            'refresh_token': refresh_token}}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        # Updating bypasses the signals that invalidate the cache, as
+        # saving in another process would
+        User.objects.filter(pk=self.user.pk).update(token_version=F('token_version') + 1)
+        response = client.post('/api/user/refresh/', {'user': {
+            'refresh_token': refresh_token}}, format='json')
+        self.assertNotEqual(response.status_code, 200)
+
+
+class MetricsTestCase(TestCase):
+    def test_metrics(self):
+        """
+        Requests are recorded against the name of their view and served
+        in the Prometheus text format
+        """
+        user = User.objects.create_user(email="user@gmail.com", password="1234234Zo")
+        space = Space.objects.create(name="root space")
+        space.members.add(user)
+
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + user.issue_token())
+        client.post('/api/space/%d/chores' % space.pk, {'name': 'dishes'}, format='json')
+        client.get('/api/chore/')
+
+        with override_settings(TRACKER_METRICS_TOKEN='scraper-secret'):
+            response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scraper-secret')
+        self.assertEqual(response.status_code, 200)
+        text = response.content.decode('utf-8')
+        self.assertIn('tracker_requests_total{view="tracker:userchores",method="GET",status="200"}', text)
+        self.assertIn('tracker_request_queries_bucket{view="tracker:userchores",le="+Inf"}', text)
+        self.assertIn('tracker_scheduler_calls_total{function="get_next_user"}', text)
+
+    @override_settings(TRACKER_METRICS_TOKEN='scraper-secret')
+    def test_metrics_access(self):
+        """
+        Metrics are only served with the scraper's token, or to staff
+        """
+        user = User.objects.create_user(email="user@gmail.com", password="1234234Zo")
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(
+            self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        self.assertEqual(
+            self.client.get('/metrics', HTTP_AUTHORIZATION='Token ' + user.issue_token()).status_code, 403)
+
+        user.is_staff = True
+        user.save()
+        self.assertEqual(
+            self.client.get('/metrics', HTTP_AUTHORIZATION='Token ' + user.issue_token()).status_code, 200)
+
+
+class ProfilingTestCase(TestCase):
+    def test_profiling(self):
+        """
+        Only requests carrying the profiling secret are profiled
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(TRACKER_PROFILING_SECRET='secret', TRACKER_PROFILING_DIR=directory):
+                response = self.client.get('/api/chore/', HTTP_X_PROFILE='wrong')
+                self.assertFalse(response.has_header('X-Profile-File'))
+                self.assertEqual(os.listdir(directory), [])
+
+                response = self.client.get('/api/chore/?profile=secret')
+                self.assertEqual(os.listdir(directory), [response['X-Profile-File']])
+                self.assertIn('tracker_userchores', response['X-Profile-File'])
+
+    def test_non_ascii_secret(self):
+        """
+        Values that aren't ASCII are refused rather than failing the
+        comparison with the secret
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(TRACKER_PROFILING_SECRET='secret', TRACKER_PROFILING_DIR=directory):
+                response = self.client.get('/api/chore/', {'profile': 'caf\u00e9'})
+                self.assertNotEqual(response.status_code, 500)
+                self.assertFalse(response.has_header('X-Profile-File'))
+                self.assertEqual(os.listdir(directory), [])
+
+
+class QueryLogTestCase(TestCase):
+    def test_query_shape(self):
+        self.assertEqual(
+            query_shape('SELECT 1 WHERE id IN (%s, %s, %s) AND a = %s'),
+            query_shape('SELECT 1 WHERE id IN (%s, %s) AND a = %s'))
+
+    def test_repeated_queries(self):
+        """
+        Statements repeated within a block are logged along with the 
+        tracker frame which issued them
+        """
+        spaces = [Space.objects.create(name="space"+str(i)) for i in range(5)]
+
+        with self.assertLogs('tracker.queries') as logs:
+            with QueryLog(label='test'):
+                for space in spaces:
+                    Space.objects.get(pk=space.pk)
+
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn('"event": "repeated_query"', logs.output[0])
+        self.assertIn('test_repeated_queries', logs.output[0])
+
+    @override_settings(TRACKER_SLOW_QUERY_THRESHOLD=0)
+    def test_slow_queries(self):
+        with self.assertLogs('tracker.queries') as logs:
+            with QueryLog(label='test'):
+                Space.objects.count()
+        self.assertIn('"event": "slow_query"', logs.output[0])
+
+
+class SeedTestCase(TestCase):
+    def test_seed(self):
+        """
+        Seeded households are trees of spaces whose members are on the 
+        roster of every chore in them
+        """
+        call_command('seed_tracker', users=6, households=2, depth=2, fanout=2,
+                     chores=2, requests=1, seed=1, stdout=io.StringIO())
+
+        self.assertEqual(User.objects.count(), 6)
+        self.assertEqual(Space.objects.filter(parent=None).count(), 2)
+        self.assertEqual(Space.objects.count(), 2 * 7)
+        self.assertEqual(Chore.objects.count(), 2 * 7 * 2)
+        self.assertEqual(UserChore.objects.count(), 2 * 7 * 2 * 3)
+        self.assertEqual(Request.objects.count(), 2)
+
+        # New rows still get fresh ids after the explicitly numbered ones
+        space = Space.objects.create(name="new space")
+        self.assertGreater(space.pk, max(Space.objects.exclude(pk=space.pk).values_list('pk', flat=True)))
+
+
+class ChoreCompleteTestCase(TestCase):
+    def test_complete(self):
+        user = User.objects.create_user(email="user@gmail.com", password="1234234Zo")
+        outsider = User.objects.create_user(email="outsider@gmail.com", password="1234234Zo")
+        space = Space.objects.create(name="root space")
+        space.members.add(user)
+        chore = Chore.objects.create(name="dishes", parent_space=space, interval=3)
+        chore._initialize_users()
+
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + outsider.issue_token())
+        response = client.post('/api/chore/%d/complete/' % chore.pk)
+        self.assertEqual(response.status_code, 403)
+
+        client.credentials(HTTP_AUTHORIZATION='Token ' + user.issue_token())
+        response = client.post('/api/chore/%d/complete/' % chore.pk)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(chore.userchore_set.get(user=user).work, 1)
+        self.assertEqual(response.data['last_user'], {'email': user.email})
+
+        completion = ChoreCompletion.objects.get()
+        self.assertEqual(
+            (completion.chore_id, completion.space_id, completion.user_id, completion.completed_on),
+            (chore.pk, space.pk, user.pk, datetime.date.today()))
+        self.assertEqual(completion.vdelta, 1.0)
+
+    def test_drop_completions(self):
+        """
+        Completions made before a month are removed in batches
+        """
+        for month in (1, 2, 3):
+            ChoreCompletion.objects.bulk_create([
+                ChoreCompletion(chore_id=1, space_id=1, user_id=1, 
+                                completed_on=datetime.date(2024, month, 15), vdelta=1)
+            ] * 3)
+
+        out = io.StringIO()
+        call_command('partition_completions', '--drop-before', '2024-03', stdout=out)
+        self.assertIn('Removed 6 completions', out.getvalue())
+        self.assertEqual(
+            set(ChoreCompletion.objects.values_list('completed_on', flat=True)), 
+            {datetime.date(2024, 3, 15)})
+        self.assertEqual(add_months(datetime.date(2024, 11, 1), 3), datetime.date(2025, 2, 1))
+
+    @skipUnless(connection.vendor == 'postgresql', "completions are only partitioned on Postgres")
+    def test_late_partition(self):
+        """
+        Completions in the default partition are moved to the partition
+        for their month when it is created late
+        """
+        month = add_months(partitions.month_start(datetime.date.today()), 12)
+        ChoreCompletion.objects.create(
+            chore_id=1, space_id=1, user_id=1, completed_on=month, vdelta=1)
+
+        partitions.create_partitions('default', ahead=12)
+        self.assertIn(month, partitions.get_partitions('default'))
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM %s' % partitions.partition_name(month))
+            self.assertEqual(cursor.fetchone()[0], 1)
+            cursor.execute('SELECT COUNT(*) FROM %s' % partitions.DEFAULT_PARTITION)
+            self.assertEqual(cursor.fetchone()[0], 0)
+        self.assertEqual(ChoreCompletion.objects.filter(completed_on=month).count(), 1)
+
+
+
+class RecurrenceTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email="user@gmail.com", password="1234234Zo")
+        self.other = User.objects.create_user(email="other@gmail.com", password="1234234Zo")
+        self.space = Space.objects.create(name="root space")
+        self.space.members.add(self.user, self.other)
+
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.user.issue_token())
+
+    def take(self, rule, start, count):
+        return list(itertools.islice(parse_recurrence(rule).occurrences(start), count))
+
+    def test_occurrences(self):
+        """
+        Rules are expanded lazily, from any date, and skip excluded dates
+        """
+        monday = datetime.date(2024, 1, 1)
+        self.assertEqual(
+            [date.weekday() for date in self.take('RRULE:FREQ=WEEKLY;BYDAY=MO,TH', monday, 6)],
+            [0, 3] * 3)
+        self.assertEqual(
+            self.take('FREQ=MONTHLY;BYDAY=2TU,-1FR', monday, 4),
+            [datetime.date(2024, 1, 9), datetime.date(2024, 1, 26),
+             datetime.date(2024, 2, 13), datetime.date(2024, 2, 23)])
+        self.assertEqual(
+            self.take('DTSTART:20240101\nRRULE:FREQ=WEEKLY;INTERVAL=2;BYDAY=MO\n'
+                      'EXDATE:20240129', datetime.date(2024, 1, 16), 2),
+            [datetime.date(2024, 2, 12), datetime.date(2024, 2, 26)])
+        self.assertEqual(
+            self.take('DTSTART:20240101\nRRULE:FREQ=DAILY;COUNT=3', datetime.date(2024, 1, 2), 5),
+            [datetime.date(2024, 1, 2), datetime.date(2024, 1, 3)])
+
+        # Far off dates are reached without generating what comes before
+        self.assertEqual(
+            self.take('DTSTART:20240101\nRRULE:FREQ=DAILY', datetime.date(9000, 1, 1), 1),
+            [datetime.date(9000, 1, 1)])
+
+        with self.assertRaises(ValueError):
+            parse_recurrence('FREQ=WEEKLY;BYDAY=2MO')
+
+    def test_recurring_chore(self):
+        """
+        Chores created with a rule are due on its occurrences, and are 
+        projected onto them in the calendar
+        """
+        response = self.client.post(
+            '/api/space/%d/chores' % self.space.pk,
+            {'name': 'bins', 'recurrence': 'FREQ=WEEKLY;BYDAY=MO,TH'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertIn('RRULE:FREQ=WEEKLY;BYDAY=MO,TH', response.data['recurrence'])
+
+        chore = Chore.objects.get(pk=response.data['id'])
+        self.assertIn(chore.next_date.weekday(), (0, 3))
+
+        today = datetime.date.today()
+        offsets = [offset for _, offset in chore.get_chore_calendar()]
+        self.assertEqual(
+            offsets, [(date - today).days for date in self.take(chore.recurrence, today, 30)
+                      if (date - today).days <= 30])
+
+        chore.mark_complete(self.user)
+        chore.refresh_from_db()
+        self.assertGreater(chore.next_date, today)
+        self.assertIn(chore.next_date.weekday(), (0, 3))
+        self.assertEqual(chore.next_user, self.other)
+
+        response = self.client.post(
+            '/api/space/%d/chores' % self.space.pk,
+            {'name': 'bins', 'recurrence': 'FREQ=FORTNIGHTLY'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('recurrence', response.data)
+
+    def test_ended_rule(self):
+        """
+        Chores whose rule has ended are no longer scheduled, as they no
+        longer show in the calendar
+        """
+        chore = Chore.objects.create(
+            name="bins", parent_space=self.space, next_date=datetime.date(2024, 1, 3),
+            next_user=self.user, recurrence='DTSTART:20240101\nRRULE:FREQ=DAILY;COUNT=3')
+        chore._initialize_users()
+        self.assertEqual(chore.get_chore_calendar(), [])
+        self.assertIsNone(chore.next_occurrence(datetime.date.today()))
+
+        chore.mark_complete(self.user)
+        chore.refresh_from_db()
+        self.assertIsNone(chore.next_user)
+        self.assertEqual(chore.next_date, datetime.date(2024, 1, 3))
+        self.assertEqual(chore.get_chore_calendar(), [])
+
+
+class CalendarFeedTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email="user@gmail.com", password="1234234Zo")
+        self.other = User.objects.create_user(email="other@gmail.com", password="1234234Zo")
+        self.space = Space.objects.create(name="root space")
+        self.space.members.add(self.user, self.other)
+        self.chore = Chore.objects.create(name="dishes, pans", parent_space=self.space)
+        self.chore._initialize_users()
+
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.user.issue_token())
+        response = self.client.post('/api/user/calendar/')
+        self.assertEqual(response.status_code, 201)
+        self.url = urlsplit(response.data['url']).path
+
+    def get_feed(self, **headers):
+        return APIClient().get(self.url, **headers)
+
+    def test_feed(self):
+        """
+        Feeds list the user's turns at their chores, and are streamed 
+        once, then served from the cache or as a 304 until the rosters
+        change
+        """
+        response = self.get_feed()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        body = b''.join(response.streaming_content).decode('utf-8')
+        self.assertTrue(body.startswith('BEGIN:VCALENDAR\r\n'))
+        self.assertIn('SUMMARY:dishes\\, pans\r\n', body)
+        self.assertEqual(
+            body.count('BEGIN:VEVENT'),
+            len([1 for user_id, _ in self.chore.get_chore_calendar() if user_id == self.user.pk]))
+        etag = response['ETag']
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get_feed()
+        self.assertFalse(response.streaming)
+        self.assertEqual(response.content.decode('utf-8'), body)
+        self.assertFalse([query for query in queries if 'tracker_chore' in query['sql']])
+
+        response = self.get_feed(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        self.chore.mark_complete(self.user)
+        response = self.get_feed(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_revoke(self):
+        """
+        Feed URLs stop working once they are revoked or replaced
+        """
+        self.client.post('/api/user/calendar/')
+        self.assertEqual(self.get_feed().status_code, 404)
+
+        self.url = urlsplit(self.client.post('/api/user/calendar/').data['url']).path
+        self.assertEqual(self.get_feed().status_code, 200)
+        self.assertEqual(self.client.delete('/api/user/calendar/').status_code, 204)
+        self.assertEqual(self.get_feed().status_code, 404)
+
+    def test_folding(self):
+        """
+        Long lines are folded at character boundaries
+        """
+        line = feeds._line('SUMMARY:' + '\u00e9' * 100)
+        parts = line[:-2].split('\r\n ')
+        self.assertTrue(all(len(part.encode('utf-8')) <= 75 for part in parts))
+        self.assertEqual(''.join(parts), 'SUMMARY:' + '\u00e9' * 100)
+
+
+class DigestTestCase(TestCase):
+    def setUp(self):
+        self.today = datetime.date(2024, 5, 6)
+        self.space = Space.objects.create(name="root space")
+        self.users = [User.objects.create_user(email="user%d@gmail.com" % i, password="1234234Zo")
+                      for i in range(6)]
+        for i, user in enumerate(self.users):
+            for offset in (0, 1, 2):
+                Chore.objects.create(
+                    name="chore%d-%d" % (i, offset), parent_space=self.space, next_user=user,
+                    next_date=self.today + datetime.timedelta(days=offset))
+        # Users with nothing due aren't sent anything
+        User.objects.create_user(email="idle@gmail.com", password="1234234Zo")
+
+    def test_send_digests(self):
+        """
+        Every user with chores due today or tomorrow is sent one digest
+        a day, in batches, with a number of queries independent of the 
+        number of users
+        """
+        out = io.StringIO()
+        with CaptureQueriesContext(connection) as queries:
+            call_command('send_digests', '--date', '2024-05-06', '--batch-size', '4', stdout=out)
+        self.assertIn('Sent 6 digests', out.getvalue())
+        # Chores, then deliveries, users and the insert for each batch
+        self.assertLessEqual(len(queries), 1 + 2 * 3 + 4)
+
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox),
+                         sorted(user.email for user in self.users))
+        body = next(message.body for message in mail.outbox if message.to == [self.users[0].email])
+        self.assertIn('Due today:\n  - chore0-0 (root space)', body)
+        self.assertIn('Due tomorrow:\n  - chore0-1 (root space)', body)
+        self.assertNotIn('chore0-2', body)
+
+        # Rerunning the same day sends nothing more
+        out = io.StringIO()
+        call_command('send_digests', '--date', '2024-05-06', stdout=out)
+        self.assertIn('Sent 0 digests', out.getvalue())
+        self.assertEqual(len(mail.outbox), 6)
+
+    def test_failed_batch(self):
+        """
+        Batches that fail to send are logged and left for the next run,
+        and the batches after them are still sent
+        """
+        send_messages = EmailBackend.send_messages
+        calls = []
+
+        def fail_second_batch(backend, messages):
+            calls.append(len(messages))
+            if len(calls) == 2:
+                raise ConnectionError
+            return send_messages(backend, messages)
+
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages',
+                        autospec=True, side_effect=fail_second_batch):
+            with self.assertLogs('tracker.digests', level='ERROR'):
+                self.assertEqual(digests.send_digests(self.today, batch_size=2), 4)
+        self.assertEqual(calls, [2, 2, 2])
+        self.assertEqual(DigestDelivery.objects.count(), 4)
+        self.assertEqual(len(mail.outbox), 4)
+
+        self.assertEqual(digests.send_digests(self.today), 2)
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox),
+                         sorted(user.email for user in self.users))
+
+
+class BulkInviteTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email="user@gmail.com", password="1234234Zo")
+        self.member = User.objects.create_user(email="member@gmail.com", password="1234234Zo")
+        self.pending = User.objects.create_user(email="pending@gmail.com", password="1234234Zo")
+        self.space = Space.objects.create(name="root space")
+        self.space.members.add(self.user, self.member)
+        Request.objects.create(from_user=self.user, to_user=self.pending, space=self.space)
+
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.user.issue_token())
+
+    def invite(self, emails):
+        return self.client.post(
+            '/api/space/%d/request/bulk/' % self.space.pk, {'emails': emails}, format='json')
+
+    def test_bulk_invite(self):
+        """
+        Each email gets a result, and only users who are neither members
+        nor invited already are sent requests, which are logged
+        """
+        new = [User.objects.create_user(email="new%d@gmail.com" % i, password="1234234Zo")
+               for i in range(2)]
+        response = self.invite([
+            'new0@gmail.com', 'new1@GMAIL.com', 'new0@gmail.com', 'member@gmail.com',
+            'pending@gmail.com', 'nobody@gmail.com', 'not an email'])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            [result['status'] for result in response.data['results']],
+            ['invited', 'invited', 'duplicate', 'member', 'pending', 'unknown', 'invalid'])
+
+        invitations = Request.objects.filter(to_user__in=new)
+        self.assertEqual(
+            {result['id'] for result in response.data['results'][:2]},
+            {invitation.pk for invitation in invitations})
+        self.assertEqual(
+            set(ChangeLog.objects.filter(model='request', action=ChangeLog.CREATED)
+                .values_list('object_id', flat=True)),
+            set(Request.objects.values_list('pk', flat=True)))
+
+        response = self.invite(['new0@gmail.com'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['status'], 'pending')
+
+    def test_queries(self):
+        """
+        Invitations cost as many queries for many emails as for one
+        """
+        # Warm up the caches of the requesting user
+        self.invite(['nobody@gmail.com'])
+        counts = []
+        for size in (1, 10):
+            emails = ['bulk%d-%d@gmail.com' % (size, i) for i in range(size)]
+            User.objects.bulk_create([User(email=email) for email in emails])
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.invite(emails).status_code, 201)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_invalid(self):
+        self.assertEqual(self.invite('user@gmail.com').status_code, 400)
+        with override_settings(TRACKER_BULK_INVITE_MAX_EMAILS=1):
+            self.assertEqual(self.invite(['a@gmail.com', 'b@gmail.com']).status_code, 400)
+        outsider = User.objects.create_user(email="outsider@gmail.com", password="1234234Zo")
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + outsider.issue_token())
+        self.assertEqual(self.invite(['new@gmail.com']).status_code, 403)
+
+
+class BulkChoreTestCase(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create_user(email="user%d@gmail.com" % i, password="1234234Zo")
+                      for i in range(3)]
+        self.space = Space.objects.create(name="root space")
+        self.space.members.add(*self.users)
+
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.users[0].issue_token())
+        self.client.get('/api/space/')
+
+    def create(self, chores):
+        return self.client.post('/api/space/%d/chores' % self.space.pk, chores, format='json')
+
+    def test_bulk_create(self):
+        """
+        A list of chores is created with rosters and next users, in as 
+        many queries for many chores as for one
+        """
+        counts = []
+        for size in (1, 30):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.create(
+                    [{'name': 'chore%d-%d' % (size, i), 'interval': i + 1} for i in range(size)])
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(len(response.data), size)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+        chore = Chore.objects.get(name='chore30-4')
+        self.assertEqual(chore.interval, 5)
+        self.assertEqual(
+            set(chore.userchore_set.values_list('user_id', flat=True)), {u.pk for u in self.users})
+        self.assertIn(chore.next_user, self.users)
+        self.assertEqual(response.data[4]['next_user'], {'email': chore.next_user.email})
+        self.assertEqual(
+            ChangeLog.objects.filter(model='userchore', action=ChangeLog.CREATED).count(), 31 * 3)
+
+        # Chores made in bulk schedule like the ones made one at a time
+        chore.mark_complete(chore.next_user)
+        chore.refresh_from_db()
+        self.assertNotEqual(chore.next_user, chore.last_user)
+
+    def test_invalid(self):
+        response = self.create([{'name': 'dishes'}, {'interval': 2}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Chore.objects.count(), 0)
+
+
+class CloneTestCase(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create_user(email="user%d@gmail.com" % i, password="1234234Zo")
+                      for i in range(3)]
+        self.home = Space.objects.create(name="home")
+        kitchen = Space.objects.create(name="kitchen", parent=self.home)
+        Space.objects.create(name="fridge", parent=kitchen)
+        Space.objects.create(name="bath", parent=self.home)
+        for user in self.users[:2]:
+            self.home.add_member(user)
+
+        self.other = Space.objects.create(name="other")
+        for user in self.users:
+            self.other.add_member(user)
+
+        spaces = {space.name: space for space in Space.objects.all()}
+        self.dishes, _, _ = Chore.create_bulk([
+            Chore(name="dishes", interval=2, parent_space=spaces['kitchen']),
+            Chore(name="shelves", recurrence="RRULE:FREQ=WEEKLY;BYDAY=MO", parent_space=spaces['fridge']),
+            Chore(name="trash", parent_space=self.home),
+        ])
+        UserChore.objects.filter(chore=self.dishes, user=self.users[1]).update(
+            delta_src=50.0, available=False)
+
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.users[0].issue_token())
+        self.client.get('/api/space/')
+
+    def tree(self, space):
+        """
+        Returns the subtree under space as nested (name, members, chores)
+        tuples, with chores as (name, interval, roster) tuples
+        """
+        members = sorted(space.userspaces.values_list('user__email', flat=True))
+        chores = sorted(
+            (chore.name, chore.interval, tuple(sorted(chore.userchore_set
+                .values_list('user__email', 'delta_src', 'available'))))
+            for chore in space.chores.all())
+        children = sorted(self.tree(child) for child in space.child.all())
+        return (space.name, tuple(members), tuple(chores), tuple(children))
+
+    def test_clone_household(self):
+        """
+        A household copied on its own takes only the user copying it as
+        a member, and puts them on every chore
+        """
+        copy = clone_subtree(self.home, name="holiday home", user=self.users[0])
+        self.assertIsNone(copy.parent_id)
+        self.assertNotEqual(copy.pk, self.home.pk)
+
+        name, members, chores, children = self.tree(copy)
+        self.assertEqual(name, "holiday home")
+        self.assertEqual(members, ("user0@gmail.com",))
+        self.assertEqual(chores, (("trash", 1, (("user0@gmail.com", 100.0, True),)),))
+        self.assertEqual([child[0] for child in children], ["bath", "kitchen"])
+        self.assertEqual(children[1][3][0][2][0][0], "shelves")
+
+        # The original is left as it was
+        self.assertEqual(self.home.child.count(), 2)
+        self.assertEqual(Chore.objects.filter(name="dishes").count(), 2)
+
+        shelves = Chore.objects.exclude(pk__in=Chore.objects.filter(
+            parent_space_id__in=Space.objects.subtree_ids(self.home))).get(name="shelves")
+        self.assertEqual(shelves.next_date.weekday(), 0)
+        self.assertGreaterEqual(shelves.next_date, datetime.date.today())
+        self.assertEqual(shelves.next_user, self.users[0])
+
+    def test_clone_with_members_and_rosters(self):
+        """
+        Members and rosters are kept for those who are members of the
+        space copied under
+        """
+        self.other.userspaces.filter(user=self.users[1]).delete()
+        copy = clone_subtree(self.home, parent=self.other, members=True, rosters=True)
+        self.assertEqual(copy.parent_id, self.other.pk)
+
+        name, members, chores, children = self.tree(copy)
+        self.assertEqual(name, "home")
+        self.assertEqual(members, ("user0@gmail.com",))
+        kitchen = children[1]
+        self.assertEqual(kitchen[2], (("dishes", 2, (("user0@gmail.com", 100.0, True),)),))
+
+        self.other.add_member(self.users[1])
+        copy = clone_subtree(self.home, parent=self.other, members=True, rosters=True)
+        self.assertEqual(self.tree(copy), self.tree(self.home))
+        dishes = Chore.objects.get(name="dishes", parent_space__parent=copy)
+        self.assertEqual(dishes.next_user, self.users[0])
+        self.assertEqual(
+            ChangeLog.objects.filter(model='space', object_id=copy.pk, action=ChangeLog.CREATED).count(), 1)
+
+    def test_clone_without_members(self):
+        """
+        Copies take the members of the space they are copied under, as
+        new subspaces do
+        """
+        copy = clone_subtree(self.home, parent=self.other)
+        everyone = tuple(sorted(user.email for user in self.users))
+        self.assertEqual(self.tree(copy)[1], everyone)
+        dishes = Chore.objects.get(name="dishes", parent_space__parent=copy)
+        self.assertEqual(
+            set(dishes.userchore_set.values_list('user_id', 'delta_src', 'available')),
+            {(user.pk, 100.0, True) for user in self.users})
+
+        stats = MemberStats.objects.get(space=copy, user=self.users[2])
+        self.assertEqual(stats.chores, 3)
+
+    def test_concurrent_inserts(self):
+        """
+        Spaces inserted by others while a copy is made aren't mistaken
+        for parts of the copy
+        """
+        bulk_create = Space.objects.bulk_create
+
+        def insert_alongside(rows, *args, **kwargs):
+            created = bulk_create(rows, *args, **kwargs)
+            Space.objects.create(name="elsewhere", parent=self.other)
+            return created
+
+        expected = self.tree(clone_subtree(self.home, parent=self.other))
+        with mock.patch.object(Space.objects, 'bulk_create', side_effect=insert_alongside):
+            copy = clone_subtree(self.home, parent=self.other)
+        self.assertEqual(self.tree(copy), expected)
+
+    def test_queries(self):
+        """
+        A subtree is copied in as many queries however wide it is
+        """
+        counts = []
+        for width in (1, 20):
+            root = Space.objects.create(name="root%d" % width)
+            root.add_member(self.users[0])
+            Space.objects.bulk_create([Space(name="child%d" % i, parent=root) for i in range(width)])
+            Chore.create_bulk([Chore(name="chore%d" % i, parent_space=space)
+                               for i, space in enumerate(root.child.all())])
+            with CaptureQueriesContext(connection) as queries:
+                copy = clone_subtree(root, parent=self.other, members=True, rosters=True)
+            counts.append(len(queries))
+            self.assertEqual(copy.child.count(), width)
+        self.assertEqual(counts[0], counts[1])
+
+    def test_view(self):
+        response = self.client.post('/api/space/%d/clone/' % self.home.pk,
+                                    {'parent_id': self.other.pk, 'name': 'flat', 'members': True},
+                                    format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['name'], 'flat')
+        self.assertEqual(response.data['parent_id'], self.other.pk)
+        self.assertEqual(len(response.data['userspaces']), 2)
+
+        response = self.client.post('/api/space/%d/clone/' % self.home.pk, {}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('parent_id', response.data)
+
+        # Flags sent as strings, as forms send them, are parsed
+        response = self.client.post('/api/space/%d/clone/' % self.home.pk,
+                                    {'parent_id': self.other.pk, 'members': 'false', 'rosters': '0'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data['userspaces']), 3)
+
+        response = self.client.post('/api/space/%d/clone/' % self.home.pk, {'name': '  '},
+                                    format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('name', response.data['errors'])
+
+        stranger = Space.objects.create(name="stranger")
+        response = self.client.post('/api/space/%d/clone/' % self.home.pk,
+                                    {'parent_id': stranger.pk}, format='json')
+        self.assertEqual(response.status_code, 403)
+        response = self.client.post('/api/space/%d/clone/' % stranger.pk, {}, format='json')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(stranger.child.count(), 0)
+
+
+class RetentionTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email="user@gmail.com", password="1234234Zo")
+        self.other = User.objects.create_user(email="other@gmail.com", password="1234234Zo")
+        self.space = Space.objects.create(name="root space")
+        self.space.members.add(self.other)
+
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.user.issue_token())
+
+        self.archive_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.archive_dir.cleanup)
+        settings = override_settings(
+            TRACKER_ARCHIVE_DIR=self.archive_dir.name, TRACKER_RETENTION_BATCH_SIZE=2,
+            TRACKER_RETENTION_DAYS={'request': 30, 'changelog': 90, 'chorecompletion': 365})
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_expire_requests(self):
+        """
+        Requests past their retention period are no longer listed or
+        accepted, and are deleted in batches with their deletion logged
+        """
+        today = datetime.date.today()
+        requests = [Request.objects.create(from_user=self.other, to_user=self.user, space=self.space)
+                    for i in range(4)]
+        Request.objects.filter(pk__in=[r.pk for r in requests[:3]]).update(
+            created_date=today - datetime.timedelta(days=31))
+
+        response = self.client.get('/api/requests/')
+        self.assertEqual([request['id'] for request in response.data], [requests[3].pk])
+        response = self.client.post('/api/requests/accept/', {'request_id': requests[0].pk})
+        self.assertEqual(response.status_code, 400)
+
+        out = io.StringIO()
+        call_command('apply_retention', 'request', stdout=out)
+        self.assertIn('Removed 3 request rows from default', out.getvalue())
+        self.assertEqual(list(Request.objects.all()), [requests[3]])
+        self.assertEqual(
+            ChangeLog.objects.filter(model='request', action=ChangeLog.DELETED).count(), 3)
+
+    def test_archive_completions(self):
+        """
+        Completions past their retention period are archived to 
+        compressed JSON lines before they are removed
+        """
+        today = datetime.date.today()
+        old = today - datetime.timedelta(days=400)
+        ChoreCompletion.objects.bulk_create(
+            [ChoreCompletion(chore_id=1, space_id=1, user_id=1, completed_on=old, vdelta=1)] * 3 +
+            [ChoreCompletion(chore_id=1, space_id=1, user_id=1, completed_on=today, vdelta=1)])
+
+        archived, removed = retention.apply(retention.get_policy('chorecompletion'), 'default')
+        self.assertEqual((archived, removed), (3, 3))
+        self.assertEqual(list(ChoreCompletion.objects.values_list('completed_on', flat=True)), [today])
+
+        path = retention.archive_path(retention.get_policy('chorecompletion'), 'default')
+        with gzip.open(path, 'rt') as archive:
+            rows = [json.loads(line) for line in archive]
+        self.assertEqual([row['completed_on'] for row in rows], [old.isoformat()] * 3)
+
+    def test_prune_change_log(self):
+        """
+        The change log is pruned by the time of its entries
+        """
+        Chore.objects.create(name="dishes", parent_space=self.space)
+        old = ChangeLog.objects.update(created_at=timezone.now() - datetime.timedelta(days=91))
+        Chore.objects.create(name="laundry", parent_space=self.space)
+
+        _, removed = retention.apply(retention.get_policy('changelog'), 'default')
+        self.assertEqual(removed, old)
+        self.assertEqual(list(ChangeLog.objects.values_list('model', flat=True)), ['chore'])
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class QueryBudgetTestCase(TestCase):
+    """
+    Every endpoint and scheduling operation must issue as many queries 
+    for a household with 100 members, subspaces and chores as for one 
+    with 1. Failures list the SQL issued at each size.
+
+    Django splits bulk statements into batches: deletes everywhere, a 
+    hundred rows at a time, and inserts and updates on SQLite, to stay
+    under the 999 variables older SQLites allow. The batches of one 
+    statement count as a single query, so the statements sent do grow 
+    with the rows written, on SQLite especially. Only on Postgres do 
+    bulk inserts stay a single statement however many rows they write
+    """
+    sizes = (1, 10, 100)
+
+    # Django's functions which split a bulk statement into batches
+    batching_functions = {'_batched_insert', 'delete_batch', 'bulk_update'}
+
+    def setUp(self):
+        self.households = 0
+
+    def _batch(self, execute, sql, params, many, context):
+        """
+        Records the call of a batching function that a query was issued
+        from, or None if it wasn't issued from any
+        """
+        frame = sys._getframe(1)
+        while frame is not None and frame.f_code.co_name not in self.batching_functions:
+            frame = frame.f_back
+        self.batches.append(frame)
+        return execute(sql, params, many, context)
+
+    def count_queries(self, batches):
+        """
+        Returns the number of queries issued, given the batching call 
+        each was issued from, counting the batches of a call once
+        """
+        return sum(1 for i, batch in enumerate(batches) 
+                   if batch is None or i == 0 or batch is not batches[i - 1])
+
+    def _household(self, size):
+        """
+        A root space with the household's user and size other members, 
+        size subspaces and size chores, plus one chore in each subspace. 
+        Every member is on every chore, and the invitee has been invited 
+        to the root space by each member
+        """
+        self.households += 1
+        prefix = 'budget%d-%d' % (size, self.households)
+        password = make_password('1234234Zo')
+        User.objects.bulk_create([
+            User(email='%s-member%d@gmail.com' % (prefix, i), password=password)
+            for i in range(size + 1)])
+        members = list(User.objects.filter(email__startswith=prefix + '-member'))
+        invitee = User.objects.create_user(email=prefix + '-invitee@gmail.com', password='1234234Zo')
+        outsider = User.objects.create_user(email=prefix + '-outsider@gmail.com', password='1234234Zo')
+
+        root = Space.objects.create(name=prefix)
+        subspaces = [Space.objects.create(name='subspace%d' % i, parent=root) for i in range(size)]
+        UserSpace.objects.bulk_create([
+            UserSpace(space=space, user=member) 
+            for space in [root] + subspaces for member in members])
+
+        chores = [Chore.objects.create(name='chore%d' % i, parent_space=root) for i in range(size)]
+        chores += [Chore.objects.create(name='chore', parent_space=space) for space in subspaces]
+        UserChore.objects.bulk_create([
+            UserChore(chore=chore, user=member) for chore in chores for member in members])
+        Chore.reschedule(chores)
+
+        Request.objects.bulk_create([
+            Request(from_user=member, to_user=invitee, space=root) for member in members])
+
+        household = SimpleNamespace(prefix=prefix, user=members[0], invitee=invitee, 
+            outsider=outsider, root=root, subspaces=subspaces, chores=chores,
+            requests=list(invitee.received_requests.all()))
+        household.client = self._client(household.user)
+        household.invitee_client = self._client(invitee)
+        return household
+
+    def _client(self, user):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + user.issue_token())
+        return client
+
+    def assertConstantQueries(self, operation):
+        """
+        Run operation on a household of each size, and fail with the SQL
+        captured at each size unless it issued the same number of queries
+        every time
+        """
+        captured = []
+        for size in self.sizes:
+            household = self._household(size)
+            self.batches = []
+            with CaptureQueriesContext(connection) as context, connection.execute_wrapper(self._batch):
+                operation(household)
+            captured.append((size, self.count_queries(self.batches),
+                             [query['sql'] for query in context.captured_queries]))
+            self.batches = None
+
+        if len({count for size, count, queries in captured}) > 1:
+            self.fail('Query count depends on household size\n\n' + '\n\n'.join(
+                '%d queries at size %d:\n%s' % (count, size, '\n'.join(queries))
+                for size, count, queries in captured))
+
+    def assertConstantRequestQueries(self, method, path, data=None, status=200, client='client'):
+        """
+        As assertConstantQueries, for a request made by the household's 
+        user, or by its invitee. path and data may be functions of the 
+        household
+        """
+        def operation(household):
+            response = getattr(getattr(household, client), method)(
+                path(household) if callable(path) else path,
+                data(household) if callable(data) else data,
+                format='json')
+            self.assertEqual(response.status_code, status, response.content)
+
+        self.assertConstantQueries(operation)
+
+    def test_register(self):
+        self.assertConstantRequestQueries('post', '/api/user/register/', lambda household: {
+            'user': {'email': household.prefix + '-new@gmail.com', 'password': '1234234Zo'}}, 
+            status=201)
+
+    def test_login(self):
+        self.assertConstantRequestQueries('post', '/api/user/login/', lambda household: {
+            'user': {'email': household.user.email, 'password': '1234234Zo'}})
+
+    def test_refresh(self):
+        self.assertConstantRequestQueries('post', '/api/user/refresh/', lambda household: {
+            'user': {'refresh_token': household.user.refresh_token}})
+
+    def test_user(self):
+        self.assertConstantRequestQueries('get', '/api/user/')
+        self.assertConstantRequestQueries('put', '/api/user/', {'user': {'name': 'Member'}})
+
+    def test_rootspaces(self):
+        self.assertConstantRequestQueries('get', '/api/space/')
+        self.assertConstantRequestQueries('post', '/api/space/', {'name': 'home'}, status=201)
+
+    def test_spaces(self):
+        path = lambda household: '/api/space/%d/subspaces/' % household.root.pk
+        self.assertConstantRequestQueries('get', path)
+        self.assertConstantRequestQueries('post', path, {'name': 'kitchen'}, status=201)
+
+    def test_members(self):
+        self.assertConstantRequestQueries(
+            'get', lambda household: '/api/space/%d/members/' % household.root.pk)
+
+    def test_spacestats(self):
+        self.assertConstantRequestQueries(
+            'get', lambda household: '/api/space/%d/stats/' % household.root.pk)
+
+    def test_requests(self):
+        self.assertConstantRequestQueries('get', '/api/requests/', client='invitee_client')
+
+    def test_createrequest(self):
+        self.assertConstantRequestQueries(
+            'post', lambda household: '/api/space/%d/request/create/' % household.root.pk, 
+            lambda household: {'to_user': {'email': household.outsider.email}}, status=201)
+
+    def test_acceptrequest(self):
+        self.assertConstantRequestQueries('post', '/api/requests/accept/', 
+            lambda household: {'request_id': household.requests[0].pk}, client='invitee_client')
+
+    def test_userchores(self):
+        self.assertConstantRequestQueries('get', '/api/chore/')
+
+    def test_spacechores(self):
+        path = lambda household: '/api/space/%d/chores' % household.root.pk
+        self.assertConstantRequestQueries('get', path)
+        self.assertConstantRequestQueries('post', path, {'name': 'dishes'}, status=201)
+
+    def test_completechore(self):
+        self.assertConstantRequestQueries(
+            'post', lambda household: '/api/chore/%d/complete/' % household.chores[0].pk)
+
+    def test_batch(self):
+        self.assertConstantRequestQueries('post', '/api/batch/', lambda household: {'requests': [
+            {'method': 'GET', 'path': '/api/chore/'},
+            {'method': 'GET', 'path': '/api/space/%d/subspaces/' % household.root.pk},
+        ]})
+
+    def test_sync(self):
+        self.assertConstantRequestQueries('get', '/api/sync/?since=0')
+
+    @override_settings(TRACKER_METRICS_TOKEN='scraper-secret')
+    def test_metrics(self):
+        def operation(household):
+            response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scraper-secret')
+            self.assertEqual(response.status_code, 200)
+
+        self.assertConstantQueries(operation)
+
+    def test_calendar(self):
+        def operation(household):
+            token = feeds.issue_token(household.user)
+            response = household.client.get('/api/calendar/%s.ics' % token)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(b'BEGIN:VEVENT', b''.join(response.streaming_content))
+
+        self.assertConstantQueries(operation)
+
+    def test_calendartoken(self):
+        self.assertConstantRequestQueries('post', '/api/user/calendar/', status=201)
+        self.assertConstantRequestQueries('delete', '/api/user/calendar/', status=204)
+
+    def test_bulkrequest(self):
+        self.assertConstantRequestQueries(
+            'post', lambda household: '/api/space/%d/request/bulk/' % household.root.pk,
+            lambda household: {'emails': [household.outsider.email, household.invitee.email]},
+            status=201)
+
+    def test_clonespace(self):
+        self.assertConstantRequestQueries(
+            'post', lambda household: '/api/space/%d/clone/' % household.root.pk, {}, status=201)
+
+        # Copying every member into every space of the household would
+        # take more rows than SQLite inserts at once, so a subspace is
+        # copied with its members
+        self.assertConstantRequestQueries(
+            'post', lambda household: '/api/space/%d/clone/' % household.subspaces[0].pk,
+            lambda household: {'parent_id': household.root.pk, 'members': True, 'rosters': True},
+            status=201)
+
+    def test_mark_complete(self):
+        self.assertConstantQueries(
+            lambda household: household.chores[0].mark_complete(household.user))
+
+    def test_assign_member_to_chores(self):
+        self.assertConstantQueries(
+            lambda household: household.root.assign_member_to_chores(household.outsider))
+
+    def test_mark_unavailable(self):
+        def operation(household):
+            userspace = household.root.userspaces.get(user=household.user)
+            userspace.mark_unavailable()
+            userspace.mark_available()
+
+        self.assertConstantQueries(operation)
+
+    def test_remove_member(self):
+        def operation(household):
+            household.user.chores.remove(*household.chores)
+            household.root.members.remove(household.user)
+
+        self.assertConstantQueries(operation)
+
+    def test_delete_chores(self):
+        self.assertConstantQueries(
+            lambda household: Chore.objects.filter(parent_space=household.root).delete())
+
+    def test_delete_space(self):
+        self.assertConstantQueries(lambda household: household.root.delete())
+
+
+@override_settings(TRACKER_DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTestCase(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email="user@gmail.com", password="1234234Zo")
+        self.router = ReplicaRouter()
+
+    def _route(self, method):
+        """
+        Returns the database a request made by self.user with method 
+        would read chores from
+        """
+        routed = []
+        def get_response(request):
+            routed.append(self.router.db_for_read(Chore))
+            return HttpResponse()
+
+        request = RequestFactory().generic(
+            method, '/api/chore/', HTTP_AUTHORIZATION='Token ' + self.user.issue_token())
+        ReplicaRoutingMiddleware(get_response)(request)
+        return routed[0]
+
+    def test_router(self):
+        """
+        Only reads of the tracker's models other than users go to 
+        replicas, and only where they are allowed
+        """
+        self.assertEqual(self.router.db_for_read(Chore), 'default')
+        with replica_reads():
+            self.assertEqual(self.router.db_for_read(Chore), 'replica')
+            self.assertEqual(self.router.db_for_read(User), 'default')
+            self.assertEqual(self.router.db_for_write(Chore), 'default')
+            with replica_reads(False):
+                self.assertEqual(self.router.db_for_read(Chore), 'default')
+            with transaction.atomic():
+                self.assertEqual(self.router.db_for_read(Chore), 'default')
+
+    def test_read_your_writes(self):
+        """
+        Users who write are kept on the primary until the pin expires
+        """
+        self.assertEqual(self._route('GET'), 'replica')
+        self.assertEqual(self._route('POST'), 'default')
+        self.assertEqual(self._route('GET'), 'default')
+
+        cache.clear()
+        self.assertEqual(self._route('GET'), 'replica')
+
+    def test_pin_cache(self):
+        """
+        Replicas need a cache shared between processes to pin users in
+        """
+        with override_settings(TRACKER_DATABASE_REPLICAS=['replica'], CACHES={
+                'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            with self.assertRaises(ImproperlyConfigured):
+                check_pin_cache()
+        with override_settings(TRACKER_DATABASE_REPLICAS=['replica'], CACHES={
+                'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+                            'LOCATION': 'cache'}}):
+            check_pin_cache()
+
+    @override_settings(TRACKER_DB_HEALTH_CHECKS=True)
+    def test_health_checks(self):
+        """
+        Persistent connections that no longer work are closed before
+        requests use them
+        """
+        connection.ensure_connection()
+        with mock.patch.object(connection, 'is_usable', return_value=False), \
+                mock.patch.object(connection, 'close') as close:
+            check_connections()
+        close.assert_called_once_with()
+
+
+@skipUnless('replica' in connections, "needs a 'replica' database, as set up by TRACKER_DB_SQLITE")
+class ReplicaDatabaseTestCase(TransactionTestCase):
+    databases = '__all__'
+
+    def test_replica_reads(self):
+        """
+        Reads of safe requests are served by the replica, except just 
+        after their user has written
+        """
+        cache.clear()
+        user = User.objects.create_user(email="user@gmail.com", password="1234234Zo")
+        space = Space.objects.create(name="root space")
+        space.members.add(user)
+        chore = Chore.objects.create(name="dishes", parent_space=space)
+        chore._initialize_users()
+
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + user.issue_token())
+
+        with override_settings(TRACKER_DATABASE_REPLICAS=['replica']):
+            with CaptureQueriesContext(connections['replica']) as replica:
+                response = client.get('/api/chore/')
+            self.assertEqual(response.data[0]['name'], 'dishes')
+            self.assertTrue(replica.captured_queries)
+
+            client.post('/api/chore/%d/complete/' % chore.pk)
+            with CaptureQueriesContext(connections['replica']) as replica:
+                response = client.get('/api/chore/')
+            self.assertEqual(response.data[0]['last_date'], str(datetime.date.today()))
+            self.assertFalse(replica.captured_queries)
+
+
+class StatsTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email="user@gmail.com", password="1234234Zo")
+        self.other = User.objects.create_user(email="other@gmail.com", password="1234234Zo")
+        self.space = Space.objects.create(name="root space")
+        self.space.members.add(self.user, self.other)
+        self.child_space = Space.objects.create(name="child space", parent=self.space)
+        self.child_space.initialize_members_from_parent_space()
+
+        self.chore = Chore.objects.create(name="dishes", parent_space=self.space)
+        self.chore._initialize_users()
+        self.child_chore = Chore.objects.create(name="laundry", parent_space=self.child_space)
+        self.child_chore._initialize_users()
+
+        self.child_chore.mark_complete(self.user)
+        self.child_chore.mark_complete(self.user)
+        self.chore.mark_complete(self.other)
+
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.user.issue_token())
+
+    def get_stats(self, space):
+        response = self.client.get('/api/space/%d/stats/' % space.pk)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_zero_delta(self):
+        """
+        Members on chores that add no vwork have no weight on them
+        """
+        UserChore.objects.filter(chore=self.chore, user=self.other).update(delta_src=0)
+        refresh_stats([self.space.pk])
+        other = MemberStats.objects.get(space=self.space, user=self.other)
+        self.assertEqual(other.weight, 1.0)
+        self.assertEqual(other.completions, 1)
+
+    def test_stats(self):
+        """
+        Stats cover the chores in the space's subtree, and are kept up 
+        to date as chores are completed
+        """
+        stats = self.get_stats(self.space)
+        self.assertEqual(stats['completions'], 3)
+        self.assertEqual(stats['vwork_spread'], 1.0)
+        user, other = stats['members']
+        self.assertEqual(user['user'], {'email': self.user.email})
+        self.assertEqual((user['chores'], user['completions'], user['vwork']), (2, 2, 2.0))
+        self.assertEqual((other['completions'], other['vwork_spread']), (1, 0.0))
+        self.assertAlmostEqual(user['share'], 2 / 3)
+        self.assertEqual(user['fair_share'], 0.5)
+
+        stats = self.get_stats(self.child_space)
+        self.assertEqual([member['completions'] for member in stats['members']], [2, 0])
+
+    def test_reconcile(self):
+        """
+        Reconciling recounts the stats from the chores, and picks up 
+        changes the incremental updates missed
+        """
+        expected = self.get_stats(self.space)
+        MemberStats.objects.update(completions=0, vwork=0)
+        self.child_chore.delete()
+
+        out = io.StringIO()
+        call_command('reconcile_stats', stdout=out)
+        self.assertIn('Reconciled 1 households', out.getvalue())
+
+        stats = self.get_stats(self.space)
+        self.assertEqual([member['completions'] for member in stats['members']], [0, 1])
+        self.assertEqual([member['chores'] for member in stats['members']], [1, 1])
+        self.assertNotEqual(stats, expected)
+
+
+@override_settings(TRACKER_TASK_BACKEND='database')
+class TaskTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email="user@gmail.com", password="1234234Zo")
+        self.invitee = User.objects.create_user(email="invitee@gmail.com", password="1234234Zo")
+        self.space = Space.objects.create(name="root space")
+        self.space.members.add(self.user)
+        self.child_space = Space.objects.create(name="child space", parent=self.space)
+        self.child_space.initialize_members_from_parent_space()
+
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.user.issue_token())
+
+    def run_tasks(self):
+        out = io.StringIO()
+        call_command('run_tasks', '--once', stdout=out)
+        return out.getvalue()
+
+    def test_chore_roster(self):
+        """
+        New chores are created at once, and their rosters set up by the
+        worker. Running a task again changes nothing
+        """
+        response = self.client.post('/api/space/%d/chores' % self.space.pk, 
+            {'name': 'dishes'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertIsNone(response.data['next_user'])
+        self.assertEqual(Task.objects.filter(name='initialize_chore').count(), 1)
+
+        self.run_tasks()
+        chore = Chore.objects.get(pk=response.data['id'])
+        self.assertEqual(chore.next_user, self.user)
+        self.assertFalse(Task.objects.exists())
+
+        tasks.run('initialize_chore', {'chore_id': chore.pk}, 'default')
+        self.assertEqual(chore.userchore_set.count(), 1)
+
+    def test_chore_queued_with_save(self):
+        """
+        A chore whose task fails to be queued isn't saved either
+        """
+        with mock.patch.object(tasks, 'enqueue', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.client.post('/api/space/%d/chores' % self.space.pk,
+                                 {'name': 'dishes'}, format='json')
+        self.assertFalse(Chore.objects.exists())
+
+    def test_propagation(self):
+        """
+        Accepting a request and changing availability take effect in the
+        space at once, and in its subtree once the worker has run
+        """
+        chore = Chore.objects.create(name="dishes", parent_space=self.child_space)
+        chore._initialize_users()
+        request = Request.objects.create(from_user=self.user, to_user=self.invitee, space=self.space)
+
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.invitee.issue_token())
+        response = self.client.post('/api/requests/accept/', {'request_id': request.pk}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(self.space.userspaces.filter(user=self.invitee).exists())
+        self.assertFalse(self.child_space.userspaces.filter(user=self.invitee).exists())
+
+        self.run_tasks()
+        self.assertTrue(self.child_space.userspaces.filter(user=self.invitee).exists())
+        self.assertTrue(chore.userchore_set.filter(user=self.invitee).exists())
+
+        self.space.mark_unavailable(self.user)
+        self.assertFalse(self.space.userspaces.get(user=self.user).available)
+        self.assertTrue(chore.userchore_set.get(user=self.user).available)
+
+        self.run_tasks()
+        self.assertFalse(self.child_space.userspaces.get(user=self.user).available)
+        self.assertFalse(chore.userchore_set.get(user=self.user).available)
+        chore.refresh_from_db()
+        self.assertEqual(chore.next_user, self.invitee)
+
+    def test_availability_entry_points(self):
+        """
+        Changing availability through the space or through the user's
+        userspace queues the same task, and leaves the same rows once the
+        worker has run. A task overtaken by a later change does nothing
+        """
+        chore = Chore.objects.create(name="dishes", parent_space=self.child_space)
+        self.space.members.add(self.invitee)
+        self.child_space.members.add(self.invitee)
+        chore._initialize_users()
+        userspace = self.space.userspaces.get(user=self.user)
+
+        def rows():
+            return (
+                list(UserSpace.objects.filter(user=self.user).order_by('pk')
+                     .values_list('space_id', 'available')),
+                list(UserChore.objects.filter(user=self.user).order_by('pk')
+                     .values_list('chore_id', 'available', 'vwork')),
+                Chore.objects.get(pk=chore.pk).next_user_id)
+
+        results = []
+        for mark_unavailable, mark_available in [
+                (lambda: self.space.mark_unavailable(self.user),
+                 lambda: self.space.mark_available(self.user)),
+                (userspace.mark_unavailable, userspace.mark_available)]:
+            mark_unavailable()
+            self.assertFalse(self.space.userspaces.get(user=self.user).available)
+            self.assertTrue(self.child_space.userspaces.get(user=self.user).available)
+            self.assertEqual(Task.objects.filter(name='propagate_availability').count(), 1)
+            self.run_tasks()
+            unavailable = rows()
+
+            mark_available()
+            self.run_tasks()
+            results.append((unavailable, rows()))
+
+        self.assertEqual(results[0], results[1])
+        self.assertFalse(results[0][0][1][0][1])
+        self.assertEqual(results[0][0][2], self.invitee.pk)
+        self.assertTrue(results[0][1][1][0][1])
+
+        userspace.mark_unavailable()
+        userspace.mark_available()
+        self.run_tasks()
+        self.assertTrue(chore.userchore_set.get(user=self.user).available)
+
+    @override_settings(TRACKER_TASK_MAX_ATTEMPTS=2)
+    def test_retry(self):
+        """
+        Failed tasks are put back with their error until they run out of
+        attempts
+        """
+        task = Task.objects.create(name='no_such_task')
+        self.run_tasks()
+
+        task.refresh_from_db()
+        self.assertEqual((task.attempts, task.failed), (1, False))
+        self.assertIn('KeyError', task.last_error)
+        self.assertGreater(task.run_at, task.created_at)
+
+        Task.objects.update(run_at=task.created_at)
+        self.run_tasks()
+        task.refresh_from_db()
+        self.assertEqual((task.attempts, task.failed), (2, True))
+        self.assertIn('Ran 0 tasks', self.run_tasks())
+
+
+@override_settings(TRACKER_SHARDS=['default', 'shard1'])
+class ShardRouterTestCase(TestCase):
+    def test_routing(self):
+        """
+        Household models follow the instance they are reached through, 
+        or else the current shard. Users, and the default shard, are 
+        left to the routers that follow
+        """
+        router = ShardRouter()
+        self.assertIsNone(router.db_for_read(Chore))
+        self.assertIsNone(router.db_for_write(User))
+        with using_shard('shard1'):
+            self.assertEqual(router.db_for_read(Chore), 'shard1')
+            self.assertIsNone(router.db_for_read(User))
+
+        space = Space(name="root space")
+        space._state.db = 'shard1'
+        self.assertEqual(router.db_for_write(UserSpace, instance=space), 'shard1')
+
+        user = User(email="user@gmail.com")
+        user._state.db = 'default'
+        with using_shard('shard1'):
+            self.assertEqual(router.db_for_read(Space, instance=user), 'shard1')
+
+        # Rows read from a replica are written to the primary
+        space._state.db = 'replica'
+        with override_settings(TRACKER_DATABASE_REPLICAS=['replica']):
+            self.assertIsNone(router.db_for_write(Space, instance=space))
+
+    def test_cursor(self):
+        """
+        Plain cursors apply to every shard, and cursors naming shards 
+        round trip
+        """
+        self.assertEqual(parse_cursor('12'), {'default': 12, 'shard1': 12})
+        cursor = {'default': 12, 'shard1': 1000000000005}
+        self.assertEqual(parse_cursor(format_cursor(cursor)), cursor)
+        with self.assertRaises(ValueError):
+            parse_cursor('shard2:4')
+
+    def test_id_width(self):
+        """
+        Ids of sharded rows, and the columns holding them without a 
+        foreign key, are wide enough for every shard's id range
+        """
+        from django.apps import apps
+
+        for model in apps.get_app_config('tracker').get_models():
+            if is_sharded(model):
+                self.assertIsInstance(model._meta.pk, BigAutoField, model)
+        for model, field in [(ChangeLog, 'object_id'), (ChangeLog, 'space_id'),
+                             (ChoreCompletion, 'chore_id'), (ChoreCompletion, 'space_id')]:
+            self.assertIsInstance(model._meta.get_field(field), BigIntegerField)
+
+
+@skipUnless('shard1' in connections, "needs a 'shard1' database, as set up by TRACKER_DB_SQLITE")
+@override_settings(TRACKER_SHARDS=['default', 'shard1'], TRACKER_NEW_HOUSEHOLD_SHARDS=['shard1'])
+class ShardingTestCase(TransactionTestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        reserve_id_range('shard1')
+        self.user = User.objects.create_user(email="user@gmail.com", password="1234234Zo")
+        self.invitee = User.objects.create_user(email="invitee@gmail.com", password="1234234Zo")
+
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.user.issue_token())
+        self.invitee_client = APIClient()
+        self.invitee_client.credentials(HTTP_AUTHORIZATION='Token ' + self.invitee.issue_token())
+
+    def test_household(self):
+        """
+        New households are created on the shards taking them, served 
+        from there through the API, and keep their ids and members when
+        moved to another shard
+        """
+        root = self.client.post('/api/space/', {'name': 'home'}, format='json').data['id']
+        self.assertTrue(Space.objects.using('shard1').filter(pk=root).exists())
+        self.assertGreaterEqual(root, 10 ** 12)
+
+        response = self.client.post('/api/space/%d/subspaces/' % root, 
+            {'name': 'kitchen', 'parent_id': root}, format='json')
+        self.assertEqual(response.status_code, 201)
+        kitchen = response.data['id']
+        response = self.client.post('/api/space/%d/chores' % kitchen, {'name': 'dishes'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        chore = response.data['id']
+
+        request = self.client.post('/api/space/%d/request/create/' % root, 
+            {'to_user': {'email': self.invitee.email}}, format='json').data['id']
+        self.assertEqual(self.invitee_client.get('/api/requests/').data[0]['space_id'], root)
+        response = self.invitee_client.post('/api/requests/accept/', {'request_id': request}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get('/api/chore/')
+        self.assertEqual([item['id'] for item in response.data], [chore])
+        self.assertEqual(response.data[0]['next_user'], {'email': self.user.email})
+        response = self.client.post('/api/chore/%d/complete/' % chore)
+        self.assertEqual(response.status_code, 200)
+
+        members = self.client.get('/api/space/%d/members/' % kitchen).data
+        self.assertEqual(len(members), 2)
+        response = self.client.get('/api/space/')
+        self.assertEqual(len(response.data[0]['userspaces']), 2)
+
+        sync = self.client.get('/api/sync/').data
+        self.assertIn('shard1:', sync['cursor'])
+        self.assertEqual({space['id'] for space in sync['changes']['space']['created']}, {root, kitchen})
+
+        out = io.StringIO()
+        call_command('move_household', root, 'default', stdout=out)
+        self.assertIn('2 space', out.getvalue())
+        self.assertFalse(Space.objects.using('shard1').exists())
+        self.assertEqual(UserChore.objects.using('default').filter(chore=chore).count(), 2)
+        self.assertEqual(ChoreCompletion.objects.using('default').filter(chore_id=chore).count(), 1)
+
+        response = self.client.get('/api/chore/')
+        self.assertEqual([item['id'] for item in response.data], [chore])
+        response = self.invitee_client.post('/api/chore/%d/complete/' % chore)
+        self.assertEqual(response.status_code, 200)
+
+        # Clients syncing from before the move see the household 
+        # updated rather than deleted
+        changes = self.client.get('/api/sync/?since=%s' % sync['cursor']).data['changes']
+        self.assertEqual({space['id'] for space in changes['space']['updated']}, {root, kitchen})
+        self.assertEqual(changes['space']['deleted'], [])
@@ -1,31 +1,43 @@
 from django.urls import path, include
 
-from tracker.views import (RegistrationAPIView, LoginAPIView,
+from tracker.views import (RegistrationAPIView, LoginAPIView, RefreshTokenAPIView,
     UserRetrieveUpdateAPIView, HomePageView, SpaceListView,
-    ChoreListView, MemberListView, RequestView, AcceptRequestView)
+    ChoreListView, ChoreCompleteView, MemberListView, SpaceStatsView, SpaceCloneView, RequestView, BulkRequestView,
+    AcceptRequestView, BatchView, SyncView, UserCalendarView, CalendarTokenView, metrics_view)
 
 app_name = 'tracker'
 
 api_urlpatterns = [
     path('user/register/', RegistrationAPIView.as_view(), name='register'),
     path('user/login/', LoginAPIView.as_view(), name='login'),
+    path('user/refresh/', RefreshTokenAPIView.as_view(), name='refresh'),
     path('user/', UserRetrieveUpdateAPIView.as_view(), name='user'),
+    path('user/calendar/', CalendarTokenView.as_view(), name='calendartoken'),
+    path('calendar/<str:token>.ics', UserCalendarView.as_view(), name='calendar'),
     
     path('space/', SpaceListView.as_view(), name='rootspaces'),
     path('space/<int:parent>/subspaces/', SpaceListView.as_view(), name='spaces'),
     
     path('space/<int:space>/members/', MemberListView.as_view(), name='members'),
+    path('space/<int:space>/stats/', SpaceStatsView.as_view(), name='spacestats'),
+    path('space/<int:space>/clone/', SpaceCloneView.as_view(), name='clonespace'),
     
     path('requests/', RequestView.as_view(), name='requests'),
     path('space/<int:space_id>/request/create/', RequestView.as_view(), name='createrequest'),
+    path('space/<int:space_id>/request/bulk/', BulkRequestView.as_view(), name='bulkrequest'),
     path('requests/accept/', AcceptRequestView.as_view(), name='acceptrequest'),
 
     path('chore/', ChoreListView.as_view(), name='userchores'),
     path('space/<int:parent_space>/chores', ChoreListView.as_view(), name='spacechores'),
+    path('chore/<int:chore>/complete/', ChoreCompleteView.as_view(), name='completechore'),
+
+    path('batch/', BatchView.as_view(), name='batch'),
+    path('sync/', SyncView.as_view(), name='sync'),
 ]
 
 
 urlpatterns = [
     path('api/', include(api_urlpatterns)),
+    path('metrics', metrics_view, name='metrics'),
     path('', HomePageView.as_view()),
 ]
@@ -1,8 +1,23 @@
+import hmac
+import io
+import json
 import jwt
+from contextlib import nullcontext
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import transaction
+from django.http import HttpRequest, HttpResponse, QueryDict, StreamingHttpResponse
 from django.shortcuts import render
+from django.urls import resolve, reverse, Resolver404
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from django.views.generic import TemplateView
 
-from rest_framework import status 
+from rest_framework import exceptions, status 
+from rest_framework.authentication import get_authorization_header
 from rest_framework.permissions import AllowAny, IsAuthenticated, DjangoModelPermissions
 from rest_framework.response import Response 
 from rest_framework.views import APIView
@@ -12,16 +27,49 @@ from rest_framework.renderers import JSONRenderer
 
 from tracker.serializers import (
     RegistrationSerializer, LoginSerializer, UserSerializer,
+    RefreshTokenSerializer,
     RootSpaceSerializer, SpaceSerializer, ChoreListSerializer,
-    UserEmailSerializer, RequestSerializer)
+    UserEmailSerializer, RequestSerializer, MemberStatsSerializer,
+    SpaceCloneSerializer, BatchSerializer)
 from tracker.renderers import UserJSONRenderer
+from tracker.backends import JWTAuthentication
+from tracker.metrics import REGISTRY
+from tracker import cloning, feeds, retention, sharding, tasks
+from tracker.permissions import (IsSpaceMember, get_accessible_space_ids, get_space_shard,
+                                 is_space_member)
+from tracker.sync import get_changes, parse_cursor
 from tracker.models import (Chore, Space, User, Request,
-                            UserSpace, UserChore)
+                            UserSpace, UserChore, MemberStats)
 
 class HomePageView(TemplateView):
     template_name = "index.html"
 
 
+def metrics_view(request):
+    """
+    Serves the metrics collected by this process for Prometheus to scrape
+    with the TRACKER_METRICS_TOKEN bearer token, or to staff
+    """
+    if not _may_read_metrics(request):
+        return HttpResponse('Forbidden.', status=status.HTTP_403_FORBIDDEN, content_type='text/plain')
+    return HttpResponse(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def _may_read_metrics(request):
+    secret = getattr(settings, 'TRACKER_METRICS_TOKEN', None)
+    header = get_authorization_header(request).split()
+    if secret and len(header) == 2 and header[0].lower() == b'bearer':
+        return hmac.compare_digest(header[1], secret.encode('utf-8'))
+
+    if request.user.is_authenticated:
+        return request.user.is_staff
+    try:
+        authenticated = JWTAuthentication().authenticate(request)
+    except exceptions.AuthenticationFailed:
+        return False
+    return authenticated is not None and authenticated[0].is_staff
+
+
 class UserRetrieveUpdateAPIView(RetrieveUpdateAPIView):
     permission_classes = (IsAuthenticated,)
     renderer_classes = (UserJSONRenderer,)
@@ -54,6 +102,7 @@ class RegistrationAPIView(APIView):
         serializer = self.serializer_class(data=user)
         serializer.is_valid(raise_exception=True)
         serializer.save() 
+        serializer.instance.issue_token()
 
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
@@ -68,33 +117,53 @@ class LoginAPIView(APIView):
 
         serializer = self.serializer_class(data=user)
         serializer.is_valid(raise_exception=True)
+
+        # Issuing a token may write its issue time, which serializing 
+        # users never does
+        serializer.validated_data['token'] = serializer.validated_data['user'].issue_token()
         response = Response(serializer.data, status = status.HTTP_200_OK)
         return response
 
 
+class RefreshTokenAPIView(APIView):
+    """
+    Exchange a refresh token for a new access token
+    """
+    permission_classes = (AllowAny,)
+    renderer_classes = (UserJSONRenderer,)
+    serializer_class = RefreshTokenSerializer
+
+    def post(self, request):
+        user = request.data.get('user', {})
+
+        serializer = self.serializer_class(data=user)
+        serializer.is_valid(raise_exception=True)
+        serializer.validated_data['token'] = serializer.validated_data['user'].issue_token()
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+
 class SpaceListView(APIView):
     """
     List spaces user is a member of/list subspaces under 
     a space the user is a member of
     """
-    # TODO: make access to space list contingent on authentication 
-    # and membership
-    permission_classes = (IsAuthenticated,)
+    # User must be a member of a space to get or add subspaces
+    permission_classes = (IsAuthenticated, IsSpaceMember)
+    space_url_kwarg = 'parent'
+
     def get(self, request, format=None, parent=None):
         user = request.user
 
         if not parent:
-            spaces = Space.objects.filter(parent=None).filter(members=user)
-            serializer = RootSpaceSerializer(spaces, many=True)
+            # Households are spread across shards
+            spaces = sharding.collect_from_shards(lambda: list(RootSpaceSerializer.optimize_queryset(
+                Space.objects.filter(parent=None).filter(members=user), request)))
+            serializer = RootSpaceSerializer(spaces, many=True, context={'request': request})
             return Response(serializer.data)
-        
-        space = Space.objects.get(pk=parent)
-        # User must be a member of a space to get subspaces
-        if not space.members.filter(pk=request.user.pk).count():
-            return Response(None, status=status.HTTP_400_BAD_REQUEST)
 
-        spaces = space.child.all()
-        serializer = SpaceSerializer(spaces, many=True)
+        spaces = SpaceSerializer.optimize_queryset(
+            Space.objects.filter(parent_id=parent), request)
+        serializer = SpaceSerializer(spaces, many=True, context={'request': request})
         
 
         return Response(serializer.data)
@@ -111,14 +180,8 @@ class SpaceListView(APIView):
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         
         # Otherwise create space with parent parent_id
-        # Parent in request data takes precedence over parent in url
-        space = Space.objects.get(pk=parent)
-        # User must be a member of a space to add a subspace
-        if not space.members.filter(pk=request.user.pk).count():
-            return Response(None, status=status.HTTP_400_BAD_REQUEST)
-        
         new_space['parent_id'] = parent
-        serializer = SpaceSerializer(data=new_space)
+        serializer = SpaceSerializer(data=new_space, context={'request': request})
         if(serializer.is_valid()):
             serializer.save()
             return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -129,70 +192,185 @@ class MemberListView(APIView):
     List members of a space
     """
 
-    permission_classes = (IsAuthenticated,)
-    def get(self, request, space, format=None):
-        user = request.user 
-        space = Space.objects.get(pk=space)
-
-        members = space.members.all()
+    # user must be a member of this space to view other members
+    permission_classes = (IsAuthenticated, IsSpaceMember)
+    space_url_kwarg = 'space'
 
-        # user must be a member of this space to view other members
-        if not members.filter(pk=request.user.pk).count():
-            return Response(None, status=status.HTTP_400_BAD_REQUEST)
+    def get(self, request, space, format=None):
+        # Users are global, and can't be joined to the space's shard
+        member_ids = UserSpace.objects.filter(space_id=space).values_list('user_id', flat=True)
+        members = User.objects.filter(pk__in=list(member_ids))
         serializer = UserEmailSerializer(members, many=True)
         return Response(serializer.data)
 
 
+class SpaceStatsView(APIView):
+    """
+    Fairness stats for the members of a space, over the chores in its 
+    whole subtree: the work each of them did, how far apart their vwork
+    is, and their share of the work next to the share their weights on
+    their chores entitle them to
+    """
+
+    permission_classes = (IsAuthenticated, IsSpaceMember)
+    space_url_kwarg = 'space'
+
+    def get(self, request, space, format=None):
+        stats = list(sharding.select_global(
+            MemberStats.objects.filter(space_id=space).order_by('user_id'), 'user'))
+        vworks = [member.vwork for member in stats] or [0]
+        totals = {
+            'completions': sum(member.completions for member in stats),
+            'weight': sum(member.weight for member in stats),
+            'min_vwork': min(vworks),
+        }
+
+        serializer = MemberStatsSerializer(stats, many=True, context={'totals': totals})
+        return Response({
+            'space': space,
+            'completions': totals['completions'],
+            'vwork_spread': max(vworks) - min(vworks),
+            'members': serializer.data,
+        })
+
+
+class SpaceCloneView(APIView):
+    """
+    Copies a space, with its subspaces and their chores, under the space
+    with id 'parent_id', or as a new household if none is given, named
+    'name' if given. 'members' keeps the members of each copied space
+    who can be, and 'rosters' the rosters of each copied chore
+    """
+
+    # User must be a member of both the space copied and the one it is
+    # copied under
+    permission_classes = (IsAuthenticated, IsSpaceMember)
+    space_url_kwarg = 'space'
+
+    def post(self, request, space, format=None):
+        options = SpaceCloneSerializer(data=request.data)
+        options.is_valid(raise_exception=True)
+        parent_id = options.validated_data.get('parent_id')
+        name = options.validated_data.get('name')
+
+        if parent_id is not None and not is_space_member(request, parent_id):
+            return Response(
+                {'errors': {'parent_id': 'You must be a member of this space.'}},
+                status=status.HTTP_403_FORBIDDEN)
+
+        source = Space.objects.get(pk=space)
+        parent = None
+        if parent_id is not None:
+            parent = Space.objects.using(get_space_shard(request, parent_id)).get(pk=parent_id)
+
+        copy = cloning.clone_subtree(
+            source, parent=parent, name=name, members=options.validated_data['members'],
+            rosters=options.validated_data['rosters'], user=request.user)
+
+        serializer_class = SpaceSerializer if parent is not None else RootSpaceSerializer
+        with sharding.using_shard(copy._state.db):
+            copy = serializer_class.optimize_queryset(
+                Space.objects.filter(pk=copy.pk), request).get()
+        serializer = serializer_class(copy, context={'request': request})
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
 class ChoreListView(APIView):
     """
-    List chores belonging to a space or a user 
+    List chores belonging to a space or a user, or add chores to a 
+    space, one at a time or a list of them in bulk
     """
 
-    permission_classes = (IsAuthenticated,)
+    # User must be a member of a space to get or add chores
+    permission_classes = (IsAuthenticated, IsSpaceMember)
+    space_url_kwarg = 'parent_space'
+
     def get(self, request, format=None, parent_space=None):
         user = request.user 
 
         if not parent_space:
-            chores = Chore.objects.filter(users=user)
-            serializer = ChoreListSerializer(chores, many=True)
-            return Response(serializer.data)
-    
-        space = Space.objects.get(pk=parent_space)
-        # User must be a member of a space to get chores
-        if not space.members.filter(pk=request.user.pk).count():
-            return Response(None, status=status.HTTP_400_BAD_REQUEST)
-
-        chores = space.chores.all()
-        serializer = ChoreListSerializer(chores, many=True)
+            # The user's chores are spread across the shards of their
+            # households
+            chores = sharding.collect_from_shards(lambda: list(
+                ChoreListSerializer.optimize_queryset(Chore.objects.filter(users=user), request)))
+        else:
+            chores = ChoreListSerializer.optimize_queryset(
+                Chore.objects.filter(parent_space_id=parent_space), request)
+
+        serializer = ChoreListSerializer(chores, many=True, context={'request': request})
         return Response(serializer.data)
 
     def post(self, request, parent_space, format=None):
-        user = request.user
         new_chore = request.data 
 
-        space = Space.objects.get(pk=parent_space)
-        # User must be a member of a space to get chores
-        if not space.members.filter(pk=request.user.pk).count():
-            return Response(None, status=status.HTTP_400_BAD_REQUEST)
-        
+        # A list of chores is created in bulk
+        if isinstance(new_chore, list):
+            max_chores = getattr(settings, 'TRACKER_BULK_CREATE_MAX_CHORES', 100)
+            if len(new_chore) > max_chores:
+                return Response(
+                    {'errors': {'chores': 'At most %d chores may be created at once.' % max_chores}},
+                    status=status.HTTP_400_BAD_REQUEST)
+            for chore in new_chore:
+                if isinstance(chore, dict):
+                    chore['parent_space_id'] = parent_space
+            serializer = ChoreListSerializer(data=new_chore, many=True, context={'request': request})
+            if(serializer.is_valid()):
+                serializer.save()
+                return Response(serializer.data, status=status.HTTP_201_CREATED)
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
         new_chore['parent_space_id'] = parent_space 
-        serializer = ChoreListSerializer(data=new_chore)
+        serializer = ChoreListSerializer(data=new_chore, context={'request': request})
         if(serializer.is_valid()):
             serializer.save()
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class ChoreCompleteView(APIView):
+    """
+    Mark a chore complete by the requesting user
+    """
+
+    permission_classes = (IsAuthenticated,)
+    def post(self, request, chore, format=None):
+        chore = sharding.find(Chore.objects.filter(pk=chore))
+
+        # User must be a member of the chore's space
+        if chore is None or not is_space_member(request, chore.parent_space_id):
+            return Response(None, status=status.HTTP_403_FORBIDDEN)
+        sharding.activate(chore._state.db)
+
+        try:
+            chore.mark_complete(request.user)
+        except UserChore.DoesNotExist:
+            return Response(
+                {'errors': {'chore': 'You are not assigned to this chore.'}},
+                status=status.HTTP_400_BAD_REQUEST)
+
+        serializer = ChoreListSerializer(chore)
+        return Response(serializer.data)
+
+
 class RequestView(APIView):
     """
     List chores received by a user, or create requests 
     """
 
-    permission_classes = (IsAuthenticated,)
+    # User must be a member of a space to invite others to it
+    permission_classes = (IsAuthenticated, IsSpaceMember)
+    space_url_kwarg = 'space_id'
+
     def get(self, request, format=None):
         user = request.user 
 
-        serializer = RequestSerializer(user.received_requests, many=True)
+        # Requests are kept on the shards of the spaces they invite to,
+        # apart from the global users they are between. Expired ones are
+        # left out until the retention job removes them
+        requests = sharding.collect_from_shards(lambda: list(
+            retention.unexpired(Request.objects.filter(to_user=user))
+            .prefetch_related('from_user', 'to_user')))
+        serializer = RequestSerializer(requests, many=True)
         return Response(serializer.data)
     
     def post(self, request, space_id, format=None):
@@ -200,9 +378,8 @@ class RequestView(APIView):
         new_request = request.data
         new_request["space_id"] = space_id
         new_request["from_user"] = from_user
-        print(new_request)
         
-        serializer = RequestSerializer(data=new_request)
+        serializer = RequestSerializer(data=new_request, context={'request': request})
   
         if(serializer.is_valid()):
             serializer.save()
@@ -211,6 +388,80 @@ class RequestView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class BulkRequestView(APIView):
+    """
+    Invites the users with each of the emails in 'emails' to a space, 
+    returning a result for each email in the order given: 'invited', 
+    along with the request's id, or why it was skipped: 'invalid',
+    'duplicate', 'unknown' for emails of no user, 'member' or 'pending'
+    for users who are members or have been invited already
+    """
+
+    # User must be a member of a space to invite others to it
+    permission_classes = (IsAuthenticated, IsSpaceMember)
+    space_url_kwarg = 'space_id'
+
+    def post(self, request, space_id, format=None):
+        emails = request.data.get('emails')
+        max_emails = getattr(settings, 'TRACKER_BULK_INVITE_MAX_EMAILS', 100)
+
+        if not isinstance(emails, list) or not emails:
+            return Response(
+                {'errors': {'emails': 'A list of emails is required.'}},
+                status=status.HTTP_400_BAD_REQUEST)
+        if len(emails) > max_emails:
+            return Response(
+                {'errors': {'emails': 'At most %d emails may be invited at once.' % max_emails}},
+                status=status.HTTP_400_BAD_REQUEST)
+
+        results, seen = [], set()
+        for email in emails:
+            normalized = User.objects.normalize_email(email.strip()) if isinstance(email, str) else None
+            result = {'email': email, 'status': None}
+            try:
+                validate_email(normalized)
+            except ValidationError:
+                result['status'] = 'invalid'
+            if normalized in seen:
+                result['status'] = result['status'] or 'duplicate'
+            seen.add(normalized)
+            results.append((normalized, result))
+
+        # Users are resolved in one query, and their memberships and
+        # pending requests on the space's shard in one query each
+        user_ids = dict(User.objects.filter(email__in=seen - {None}).values_list('email', 'pk'))
+        members = set(UserSpace.objects.filter(
+            space_id=space_id, user_id__in=user_ids.values()).values_list('user_id', flat=True))
+        pending = set(Request.objects.filter(
+            space_id=space_id, to_user_id__in=user_ids.values()).values_list('to_user_id', flat=True))
+
+        invited = []
+        for normalized, result in results:
+            if result['status']:
+                continue
+            user_id = user_ids.get(normalized)
+            if user_id is None:
+                result['status'] = 'unknown'
+            elif user_id in members:
+                result['status'] = 'member'
+            elif user_id in pending:
+                result['status'] = 'pending'
+            else:
+                result['status'] = 'invited'
+                invited.append(user_id)
+
+        with transaction.atomic(using=sharding.current_shard()):
+            requests = Request.invite(space_id, request.user, invited)
+        request_ids = {invitation.to_user_id: invitation.pk for invitation in requests}
+        for normalized, result in results:
+            if result['status'] == 'invited':
+                result['id'] = request_ids[user_ids[normalized]]
+
+        return Response(
+            {'results': [result for _, result in results]},
+            status=status.HTTP_201_CREATED if invited else status.HTTP_200_OK)
+
+
 class AcceptRequestView(APIView):
     """
     Adds user to the space associated with the request
@@ -220,21 +471,181 @@ class AcceptRequestView(APIView):
     def post(self, request, format=None):
         user = request.user
         request_id = request.data.get('request_id')
-        request_instance = Request.objects.get(pk=request_id)
+        request_instance = sharding.find(retention.unexpired(
+            Request.objects.select_related('space').filter(pk=request_id, to_user=user)))
+
+        if(request_instance is None):
+            return Response(
+                {'errors': {'request_id': 'No such request was sent to you.'}},
+                status=status.HTTP_400_BAD_REQUEST)
+        sharding.activate(request_instance._state.db)
+
+        # The user joins the space at once, and its subspaces and chores
+        # in the background
+        with transaction.atomic(using=request_instance._state.db):
+            request_instance.space.members.add(user)
+            request_instance.delete()
+            tasks.enqueue(tasks.propagate_member, space_id=request_instance.space_id, user_id=user.pk)
 
-        if(request_instance.to_user != user):
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        return Response()
 
-        request_instance.space.add_member(user)
-        request_instance.space.assign_member_to_chores(user)
 
-        request_instance.delete()
+class BatchView(APIView):
+    """
+    Dispatches a list of sub-requests through the existing views in a 
+    single round trip. Each sub-request is an object with a 'method', 
+    a 'path' (optionally with a query string) and a 'body'. 
 
-        return Response()
+    The requesting user is authenticated once and every sub-request runs
+    as that user. If 'atomic' is set, sub-requests share one transaction
+    which is rolled back should any of them fail
+    """
+
+    permission_classes = (IsAuthenticated,)
+    def post(self, request, format=None):
+        batch = BatchSerializer(data=request.data)
+        batch.is_valid(raise_exception=True)
+        sub_requests = batch.validated_data['requests']
+        atomic = batch.validated_data['atomic']
+
+        responses = []
+        with (sharding.atomic_on_all_shards() if atomic else nullcontext()):
+            for sub_request in sub_requests:
+                # Each sub-request activates the shard it acts on
+                with sharding.using_shard(None):
+                    responses.append(self._dispatch_sub_request(request, sub_request))
+
+            if atomic and any(response['status'] >= 400 for response in responses):
+                for shard in sharding.get_shards():
+                    transaction.set_rollback(True, using=shard)
+
+        return Response({'responses': responses})
+
+    def _dispatch_sub_request(self, request, sub_request):
+        """
+        Runs a single sub-request through the view its path resolves to,
+        and returns a dictionary of its status and rendered body
+        """
+        if not isinstance(sub_request, dict) or not sub_request.get('path'):
+            return {'status': status.HTTP_400_BAD_REQUEST,
+                    'body': {'errors': 'A path is required.'}}
+
+        method = str(sub_request.get('method', 'GET')).upper()
+        url = urlsplit(sub_request['path'])
+
+        try:
+            match = resolve(url.path)
+        except Resolver404:
+            return {'status': status.HTTP_404_NOT_FOUND, 'body': None}
+
+        # Batches may not be nested
+        if getattr(match.func, 'view_class', None) is BatchView:
+            return {'status': status.HTTP_400_BAD_REQUEST,
+                    'body': {'errors': 'Batches may not be nested.'}}
+
+        body = sub_request.get('body')
+        body = json.dumps(body).encode('utf-8') if body is not None else b''
+
+        sub = HttpRequest()
+        sub.method = method
+        sub.path = sub.path_info = url.path
+        sub.META = dict(request.META)
+        sub.META.update({
+            'REQUEST_METHOD': method,
+            'PATH_INFO': url.path,
+            'QUERY_STRING': url.query,
+            'CONTENT_TYPE': 'application/json',
+            'CONTENT_LENGTH': str(len(body)),
+        })
+        sub.GET = QueryDict(url.query)
+        sub._body = body
+        sub._stream = io.BytesIO(body)
+        sub._read_started = False
+        sub.resolver_match = match
+
+        # Reuse the outer request's credentials rather than 
+        # authenticating the token again
+        sub._force_auth_user = request.user
+        sub._force_auth_token = request.auth
+
+        response = match.func(sub, *match.args, **match.kwargs)
+        if hasattr(response, 'render'):
+            response.render()
+
+        content = response.content
+        if content and 'json' in response.get('Content-Type', ''):
+            content = json.loads(content.decode('utf-8'))
+        else:
+            content = content.decode('utf-8') if content else None
+
+        return {'status': response.status_code, 'body': content}
+
+
+class SyncView(APIView):
+    """
+    Returns the records the user can see that were created, updated or 
+    deleted since the cursor passed in 'since', along with a new cursor
+    """
+
+    permission_classes = (IsAuthenticated,)
+    def get(self, request, format=None):
+        try:
+            since = parse_cursor(request.query_params.get('since', '0'))
+        except ValueError:
+            return Response(
+                {'errors': {'since': 'A valid cursor is required.'}},
+                status=status.HTTP_400_BAD_REQUEST)
+
+        changes = get_changes(request.user, get_accessible_space_ids(request), since)
+        return Response(changes)
 
 
 class UserCalendarView(APIView):
-    # TODO: define calendar view
-    pass
+    """
+    Serves the chores a user is projected to do as an iCalendar feed, 
+    read with the feed token in the URL rather than credentials, which 
+    calendar apps can't send. Feeds are served from the cache, or as a 
+    304, until the user's rosters change
+    """
+
+    authentication_classes = ()
+    permission_classes = (AllowAny,)
+    def get(self, request, token, format=None):
+        user = feeds.get_user(token)
+        if user is None:
+            return HttpResponse('No such feed.', status=status.HTTP_404_NOT_FOUND, content_type='text/plain')
+
+        etag, last_modified = feeds.get_version(user)
+        response = get_conditional_response(
+            request, etag=etag, last_modified=int(last_modified.timestamp()))
+        if response is None:
+            body = feeds.get_cached(user, etag)
+            if body is not None:
+                response = HttpResponse(body, content_type='text/calendar; charset=utf-8')
+            else:
+                response = StreamingHttpResponse(
+                    feeds.stream(user, etag), content_type='text/calendar; charset=utf-8')
+
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+
+class CalendarTokenView(APIView):
+    """
+    Issues the requesting user a new calendar feed URL, revoking the one
+    issued before, or revokes it without issuing another
+    """
+
+    permission_classes = (IsAuthenticated,)
+    def post(self, request, format=None):
+        token = feeds.issue_token(request.user)
+        url = request.build_absolute_uri(reverse('tracker:calendar', kwargs={'token': token}))
+        return Response({'url': url}, status=status.HTTP_201_CREATED)
+
+    def delete(self, request, format=None):
+        feeds.revoke_token(request.user)
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
 